@@ -0,0 +1,257 @@
+"""
+    End-to-end benchmark of `gostep deploy diff` against a local fake of the
+    Google cloud APIs.
+
+    Generates synthetic workspaces with 1 to 500 services and runs deploy_all
+    on them in a fresh process per scenario, with gostep pointed at the fake
+    by GOSTEP_API_ROOT_URL, STORAGE_EMULATOR_HOST and authorized user
+    credentials holding a token which never expires. Each workspace is
+    deployed three times: the first deployment creates every function, the
+    second finds nothing changed and the third patches every function after
+    a source change. Wall time, API calls, injected errors and bytes uploaded
+    are reported per scenario.
+
+        Usage:
+            python benchmarks/deploy_benchmark.py [--services 1,10,100,500] [--jobs 1,8]
+                [--latency 0.02] [--error-rate 0.0] [--operation-time 1.0] [--files 5]
+                [--file-size 4096] [--wait] [--stream]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_gcp import FakeGcp
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT_ID = 'gostep-benchmark'
+LOCATION_ID = 'us-central1'
+RESULT_PREFIX = 'BENCHMARK_RESULT '
+
+
+def create_workspace(workspace_dir, services, files, file_size):
+    """
+        Writes a synthetic workspace with config.json, credentials.json and a
+        Python service per function.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                services (int): number of services
+                files (int): number of source files per service
+                file_size (int): size of each source file in bytes
+    """
+    sys.path.insert(0, REPO_DIR)
+    from gostep.consts import NAME, PROJECT_ID as PROJECT_ID_KEY, DESCRIPTION, DEFAULT_LOCATION, VERSION, \
+        TEMPLATES, SERVICES, SOURCE_DIRECTORY, SOURCE_ARCHIVE, LOCATION_NAME, LOCATION_ID as LOCATION_ID_KEY, \
+        ENVIRONMENT, TRIGGER, CHECKSUM, ALLOW_ALL, BASE_CONFIG_FILE, SERVICE_CONFIG_FILE
+    location_name = 'projects/%s/locations/%s' % (PROJECT_ID, LOCATION_ID)
+    project_spec = {
+        NAME: 'benchmark',
+        PROJECT_ID_KEY: PROJECT_ID,
+        DESCRIPTION: 'Synthetic benchmark workspace',
+        DEFAULT_LOCATION: LOCATION_ID,
+        VERSION: '0.1.0',
+        TEMPLATES: {},
+        SERVICES: {}
+    }
+    for index in range(services):
+        service_name = 'service-%04d' % index
+        source_dir = os.path.join(workspace_dir, 'src', service_name)
+        os.makedirs(source_dir)
+        for file_index in range(files):
+            with open(os.path.join(source_dir, 'module_%d.py' % file_index), 'w') as source_file:
+                line = '# %s module %d\n' % (service_name, file_index)
+                source_file.write((line * (file_size // len(line) + 1))[:file_size])
+        with open(os.path.join(source_dir, 'main.py'), 'w') as main_file:
+            main_file.write('def main(request):\n    return "%s"\n' % service_name)
+        with open(os.path.join(source_dir, SERVICE_CONFIG_FILE), 'w') as function_file:
+            json.dump({
+                'name': '/'.join([location_name, 'functions', service_name]),
+                'description': service_name,
+                'entryPoint': 'main',
+                'runtime': 'python38',
+                'httpsTrigger': {}
+            }, function_file, indent=4)
+        project_spec[SERVICES][service_name] = {
+            NAME: service_name,
+            DESCRIPTION: service_name,
+            SOURCE_DIRECTORY: 'src/%s' % service_name,
+            SOURCE_ARCHIVE: '',
+            LOCATION_NAME: location_name,
+            LOCATION_ID_KEY: LOCATION_ID,
+            VERSION: '0.1.0',
+            ENVIRONMENT: 'python',
+            TRIGGER: 'http',
+            CHECKSUM: '',
+            ALLOW_ALL: index % 2 == 0
+        }
+    with open(os.path.join(workspace_dir, BASE_CONFIG_FILE), 'w') as config_file:
+        json.dump(project_spec, config_file, indent=4)
+
+
+def change_sources(workspace_dir):
+    """
+        Appends a line to the main module of every service.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+    """
+    sources_dir = os.path.join(workspace_dir, 'src')
+    for service_name in os.listdir(sources_dir):
+        with open(os.path.join(sources_dir, service_name, 'main.py'), 'a') as main_file:
+            main_file.write('# changed at %f\n' % time.time())
+
+
+def write_credentials(credentials_file, base_url):
+    """
+        Writes authorized user credentials holding a token which never
+        expires, so no token is requested from Google.
+
+            Parameters:
+                credentials_file (string): path to credentials file
+                base_url (string): root URL of the fake
+    """
+    with open(credentials_file, 'w') as credentials_file_object:
+        json.dump({
+            'type': 'authorized_user',
+            'client_id': 'benchmark',
+            'client_secret': 'benchmark',
+            'refresh_token': 'benchmark',
+            'token': 'benchmark',
+            'expiry': '2999-01-01T00:00:00Z',
+            'token_uri': ''.join([base_url, '/token']),
+            'quota_project_id': PROJECT_ID
+        }, credentials_file_object)
+
+
+def run_deploy(workspace_dir, jobs, wait, stream):
+    """
+        Runs deploy_all in this process and prints its wall time and the
+        number of services which have not been deployed.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                jobs (int): number of services deployed at the same time
+                wait (boolean): wait for every deployment to finish
+                stream (boolean): upload sources without temporary zip files
+    """
+    sys.path.insert(0, REPO_DIR)
+    import contextlib
+    import io
+    from gostep.aggregator import deploy_all
+    output = io.StringIO()
+    started_at = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        deploy_all(workspace_dir, jobs, None, stream, wait)
+    wall_time = time.perf_counter() - started_at
+    failed = output.getvalue().count('Failed to deploy ')
+    print(''.join([RESULT_PREFIX, json.dumps({'wall_time': wall_time, 'failed': failed})]))
+
+
+def run_scenario(fake, workspace_dir, home_dir, jobs, wait, stream):
+    """
+        Runs a deployment in a fresh process and returns its measurements.
+
+            Parameters:
+                fake (FakeGcp): running fake
+                workspace_dir (string): workspace directory path
+                home_dir (string): home directory holding gostep caches
+                jobs (int): number of services deployed at the same time
+                wait (boolean): wait for every deployment to finish
+                stream (boolean): upload sources without temporary zip files
+
+            Returns:
+                result (dictionary): wall time, failures, API calls, errors and bytes uploaded
+    """
+    credentials_file = os.path.join(workspace_dir, 'credentials.json')
+    env = dict(
+        os.environ,
+        HOME=home_dir,
+        PYTHONPATH=REPO_DIR,
+        GOOGLE_APPLICATION_CREDENTIALS=credentials_file,
+        GOOGLE_CLOUD_PROJECT=PROJECT_ID,
+        GOSTEP_API_ROOT_URL=fake.base_url,
+        STORAGE_EMULATOR_HOST=fake.base_url
+    )
+    command = [sys.executable, os.path.abspath(__file__), '--run', workspace_dir, '--jobs', str(jobs)]
+    command += ['--wait'] if wait else []
+    command += ['--stream'] if stream else []
+    fake.reset_counters()
+    process = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                             universal_newlines=True)
+    results = [line[len(RESULT_PREFIX):] for line in process.stdout.splitlines() if line.startswith(RESULT_PREFIX)]
+    if process.returncode != 0 or len(results) == 0:
+        raise RuntimeError(''.join(['Benchmark run has been failed:\n', process.stdout]))
+    result = json.loads(results[-1])
+    stats = fake.get_stats()
+    result.update({
+        'api_calls': stats['api_calls'],
+        'batches': stats['requests'].get('batch', 0),
+        'errors': sum(stats['errors'].values()),
+        'bytes_uploaded': stats['bytes_uploaded'],
+        'requests': stats['requests']
+    })
+    return result
+
+
+def main(args):
+    fake = FakeGcp(args.latency, args.error_rate, args.operation_time)
+    fake.start()
+    rows = []
+    try:
+        for services in [int(value) for value in args.services.split(',')]:
+            for jobs in [int(value) for value in args.jobs.split(',')]:
+                fake.reset()
+                root_dir = tempfile.mkdtemp(prefix='gostep-benchmark-')
+                try:
+                    workspace_dir = os.path.join(root_dir, 'workspace')
+                    home_dir = os.path.join(root_dir, 'home')
+                    os.makedirs(workspace_dir)
+                    os.makedirs(home_dir)
+                    create_workspace(workspace_dir, services, args.files, args.file_size)
+                    write_credentials(os.path.join(workspace_dir, 'credentials.json'), fake.base_url)
+                    for phase in ['create', 'unchanged', 'patch']:
+                        if phase == 'patch':
+                            change_sources(workspace_dir)
+                        result = run_scenario(fake, workspace_dir, home_dir, jobs, args.wait, args.stream)
+                        rows.append(dict(result, services=services, jobs=jobs, phase=phase))
+                        print('%8d %5d %-10s %9.2f %7d %9d %8d %7d %14d' % (
+                            services, jobs, phase, result['wall_time'], result['failed'], result['api_calls'],
+                            result['batches'], result['errors'], result['bytes_uploaded']))
+                        sys.stdout.flush()
+                finally:
+                    shutil.rmtree(root_dir, ignore_errors=True)
+    finally:
+        fake.stop()
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(rows, output_file, indent=4)
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark gostep deploy diff against a local fake GCP.')
+    parser.add_argument('--services', default='1,10,100,500', help='Comma separated workspace sizes.')
+    parser.add_argument('--jobs', default='1,8', help='Comma separated numbers of parallel deployments.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency of each request in seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of an injected 503 error.')
+    parser.add_argument('--operation-time', type=float, default=1.0, help='Duration of a deployment in seconds.')
+    parser.add_argument('--files', type=int, default=5, help='Number of source files per service.')
+    parser.add_argument('--file-size', type=int, default=4096, help='Size of each source file in bytes.')
+    parser.add_argument('--wait', action='store_true', help='Wait for every deployment to finish.')
+    parser.add_argument('--stream', action='store_true', help='Upload sources without temporary zip files.')
+    parser.add_argument('--output', help='Write results as JSON into a file.')
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+    if arguments.run is not None:
+        run_deploy(arguments.run, int(arguments.jobs), arguments.wait, arguments.stream)
+    else:
+        print('%8s %5s %-10s %9s %7s %9s %8s %7s %14s' % (
+            'services', 'jobs', 'phase', 'wall (s)', 'failed', 'api calls', 'batches', 'errors', 'bytes uploaded'))
+        main(arguments)
@@ -0,0 +1,496 @@
+"""
+    Local stand-in for the Google cloud APIs used by gostep.
+
+    Emulates the OAuth token endpoint, the Cloud Functions v1 endpoints used
+    by gostep.gcloud_ops (locations, functions, long running operations, IAM
+    policies and batched requests) and the Cloud Storage JSON and upload APIs
+    (buckets, objects, multipart and resumable uploads, compose and delete). Latency and
+    errors can be injected, and every request is counted.
+
+        Usage:
+            server = FakeGcp(latency=0.02, error_rate=0.01, operation_time=1.0)
+            server.start()
+            ...
+            server.stop()
+"""
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import google_crc32c
+
+FUNCTIONS_ROUTES = [
+    ('token', re.compile(r'^/token$')),
+    ('batch', re.compile(r'^/batch$')),
+    ('locations.list', re.compile(r'^/v1/projects/(?P<project>[^/]+)/locations$')),
+    ('functions.list', re.compile(r'^/v1/(?P<parent>projects/[^/]+/locations/[^/]+)/functions$')),
+    ('functions.getIamPolicy', re.compile(r'^/v1/(?P<name>projects/[^/]+/locations/[^/]+/functions/[^/:]+):getIamPolicy$')),
+    ('functions.setIamPolicy', re.compile(r'^/v1/(?P<name>projects/[^/]+/locations/[^/]+/functions/[^/:]+):setIamPolicy$')),
+    ('functions.get', re.compile(r'^/v1/(?P<name>projects/[^/]+/locations/[^/]+/functions/[^/:]+)$')),
+    ('operations.get', re.compile(r'^/v1/(?P<name>operations/[^/]+)$')),
+    ('storage.objects.compose', re.compile(r'^/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<object>.+)/compose$')),
+    ('storage.objects.get', re.compile(r'^/storage/v1/b/(?P<bucket>[^/]+)/o/(?P<object>.+)$')),
+    ('storage.buckets.get', re.compile(r'^/storage/v1/b/(?P<bucket>[^/]+)$')),
+    ('storage.buckets.insert', re.compile(r'^/storage/v1/b$')),
+    ('storage.objects.insert', re.compile(r'^/upload/storage/v1/b/(?P<bucket>[^/]+)/o$'))
+]
+PAGE_SIZE = 100
+
+
+def json_response(status, content, headers=None):
+    """
+        Returns a JSON response.
+
+            Parameters:
+                status (int): HTTP status code
+                content (object): response object
+                headers (dictionary): additional headers
+
+            Returns:
+                response (tuple): status, headers and body
+    """
+    response_headers = {'Content-Type': 'application/json'}
+    response_headers.update(headers or {})
+    return status, response_headers, json.dumps(content).encode()
+
+
+def error_response(status, message):
+    """
+        Returns a Google API error response.
+
+            Parameters:
+                status (int): HTTP status code
+                message (string): error message
+
+            Returns:
+                response (tuple): status, headers and body
+    """
+    return json_response(status, {'error': {'code': status, 'message': message}})
+
+
+def split_multipart(body, boundary):
+    """
+        Splits a multipart body into its parts.
+
+            Parameters:
+                body (bytes): multipart body
+                boundary (bytes): part boundary
+
+            Returns:
+                parts (list): list of (headers, content) tuples
+    """
+    parts = []
+    for chunk in body.split(b'--' + boundary)[1:]:
+        if chunk.startswith(b'--'):
+            break
+        chunk = chunk[2:] if chunk.startswith(b'\r\n') else chunk.lstrip(b'\n')
+        header_end = re.search(b'\r?\n\r?\n', chunk)
+        headers = {}
+        for line in chunk[:header_end.start()].decode().splitlines():
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+        content = chunk[header_end.end():]
+        content = content[:-2] if content.endswith(b'\r\n') else content[:-1] if content.endswith(b'\n') else content
+        parts.append((headers, content))
+    return parts
+
+
+def get_boundary(content_type):
+    """
+        Returns the boundary of a multipart content type.
+
+            Parameters:
+                content_type (string): content type header
+
+            Returns:
+                boundary (bytes): part boundary
+    """
+    return re.search(r'boundary="?([^";]+)"?', content_type).group(1).encode()
+
+
+class FakeGcp(object):
+    """
+        In memory emulation of the Cloud Functions and Cloud Storage APIs.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, operation_time=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.operation_time = operation_time
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.base_url = None
+        self.reset()
+
+    def reset(self):
+        """
+            Clears every emulated resource and counter.
+        """
+        with self.lock:
+            self.functions = {}
+            self.operations = {}
+            self.policies = {}
+            self.buckets = {}
+            self.objects = {}
+            self.contents = {}
+            self.uploads = {}
+            self.requests = Counter()
+            self.errors = Counter()
+            self.bytes_uploaded = 0
+
+    def reset_counters(self):
+        """
+            Clears request, error and byte counters, keeping resources.
+        """
+        with self.lock:
+            self.requests = Counter()
+            self.errors = Counter()
+            self.bytes_uploaded = 0
+
+    def get_stats(self):
+        """
+            Returns the request, error and byte counters.
+
+                Returns:
+                    stats (dictionary): requests and errors per API method and bytes uploaded
+        """
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'errors': dict(self.errors),
+                'api_calls': sum(count for name, count in self.requests.items() if name not in ['token', 'batch']),
+                'bytes_uploaded': self.bytes_uploaded
+            }
+
+    def start(self, host='127.0.0.1', port=0):
+        """
+            Starts serving on a background thread.
+
+                Parameters:
+                    host (string): interface to listen on
+                    port (int): port to listen on, 0 for any free port
+
+                Returns:
+                    base_url (string): root URL of the server
+        """
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, message_format, *args):
+                pass
+
+            def handle_request(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, headers, content = fake.dispatch(self.command, self.path, dict(self.headers.items()), body)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_request
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.base_url = 'http://%s:%d' % self.server.server_address[:2]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        """
+            Stops serving.
+        """
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def dispatch(self, method, url, headers, body, batched=False):
+        """
+            Routes a request, applying latency and error injection.
+
+                Parameters:
+                    method (string): HTTP method
+                    url (string): request path with query
+                    headers (dictionary): request headers
+                    body (bytes): request body
+                    batched (boolean): true, if the request is a part of a batch
+
+                Returns:
+                    response (tuple): status, headers and body
+        """
+        split_url = urlsplit(url)
+        path = unquote(split_url.path)
+        query = {key: values[0] for key, values in parse_qs(split_url.query).items()}
+        headers = {key.lower(): value for key, value in headers.items()}
+        for name, route in FUNCTIONS_ROUTES:
+            match = route.match(path)
+            if match is None:
+                continue
+            if name == 'storage.buckets.insert' and method != 'POST':
+                continue
+            if name == 'functions.list' and method == 'POST':
+                name = 'functions.create'
+            if name == 'functions.get' and method == 'PATCH':
+                name = 'functions.patch'
+            if name == 'storage.objects.insert' and method == 'PUT':
+                name = 'storage.objects.upload'
+            if name == 'storage.objects.get' and method == 'DELETE':
+                name = 'storage.objects.delete'
+            with self.lock:
+                self.requests[name] += 1
+                inject_error = name not in ['token', 'batch'] and self.random.random() < self.error_rate
+                if inject_error:
+                    self.errors[name] += 1
+            if self.latency and not batched:
+                time.sleep(self.latency)
+            if inject_error:
+                return error_response(503, 'Injected error.')
+            handler = getattr(self, ''.join(['handle_', name.replace('.', '_')]))
+            return handler(method, match.groupdict(), query, headers, body)
+        return error_response(404, 'No route for %s %s' % (method, path))
+
+    def handle_token(self, method, params, query, headers, body):
+        return json_response(200, {'access_token': 'fake-token', 'expires_in': 3600, 'token_type': 'Bearer'})
+
+    def handle_batch(self, method, params, query, headers, body):
+        boundary = get_boundary(headers['content-type'])
+        response_boundary = 'batch_%s' % uuid.uuid4().hex
+        responses = []
+        for part_headers, content in split_multipart(body, boundary):
+            request_line, _, rest = content.partition(b'\n')
+            request_method, request_url = request_line.decode().split()[:2]
+            header_end = re.search(b'\r?\n\r?\n', rest)
+            request_headers = {}
+            for line in rest[:header_end.start()].decode().splitlines() if header_end else []:
+                if ':' in line:
+                    key, value = line.split(':', 1)
+                    request_headers[key.strip()] = value.strip()
+            request_body = rest[header_end.end():] if header_end else b''
+            status, response_headers, response_body = self.dispatch(
+                request_method, request_url, request_headers, request_body.strip(), True)
+            responses.append(''.join([
+                '--', response_boundary, '\r\n',
+                'Content-Type: application/http\r\n',
+                'Content-ID: <response-', part_headers.get('content-id', '').strip('<>'), '>\r\n\r\n',
+                'HTTP/1.1 %d OK\r\n' % status,
+                'Content-Type: application/json\r\n\r\n',
+                response_body.decode(), '\r\n'
+            ]))
+        content = ''.join(responses + ['--', response_boundary, '--\r\n']).encode()
+        return 200, {'Content-Type': 'multipart/mixed; boundary=%s' % response_boundary}, content
+
+    def handle_locations_list(self, method, params, query, headers, body):
+        project = params['project']
+        return json_response(200, {'locations': [
+            {'name': 'projects/%s/locations/%s' % (project, location), 'locationId': location}
+            for location in ['us-central1', 'europe-west1', 'asia-east1']
+        ]})
+
+    def handle_functions_list(self, method, params, query, headers, body):
+        prefix = ''.join([params['parent'], '/functions/'])
+        with self.lock:
+            names = sorted(name for name in self.functions.keys() if name.startswith(prefix))
+            start = int(query.get('pageToken') or 0)
+            functions = [self.get_function(name) for name in names[start:start + PAGE_SIZE]]
+        response = {'functions': functions}
+        if start + PAGE_SIZE < len(names):
+            response['nextPageToken'] = str(start + PAGE_SIZE)
+        return json_response(200, response)
+
+    def handle_functions_create(self, method, params, query, headers, body):
+        function = json.loads(body)
+        with self.lock:
+            if function['name'] in self.functions:
+                return error_response(409, 'Function already exists.')
+            function.update({'status': 'DEPLOY_IN_PROGRESS', 'versionId': '1', 'updateTime': time.time()})
+            self.functions[function['name']] = function
+            return json_response(200, self.create_operation(function['name'], 'CREATE_FUNCTION'))
+
+    def handle_functions_get(self, method, params, query, headers, body):
+        with self.lock:
+            if params['name'] not in self.functions:
+                return error_response(404, 'Function not found.')
+            return json_response(200, self.get_function(params['name']))
+
+    def handle_functions_patch(self, method, params, query, headers, body):
+        update = json.loads(body)
+        with self.lock:
+            if params['name'] not in self.functions:
+                return error_response(404, 'Function not found.')
+            function = self.functions[params['name']]
+            function.update(update)
+            function.update({
+                'status': 'DEPLOY_IN_PROGRESS',
+                'versionId': str(int(function['versionId']) + 1),
+                'updateTime': time.time()
+            })
+            return json_response(200, self.create_operation(params['name'], 'UPDATE_FUNCTION'))
+
+    def handle_functions_getIamPolicy(self, method, params, query, headers, body):
+        with self.lock:
+            return json_response(200, self.policies.get(params['name'], {'etag': 'ACAB'}))
+
+    def handle_functions_setIamPolicy(self, method, params, query, headers, body):
+        with self.lock:
+            if params['name'] not in self.functions:
+                return error_response(404, 'Function not found.')
+            policy = dict(json.loads(body)['policy'], etag='BwX')
+            self.policies[params['name']] = policy
+            return json_response(200, policy)
+
+    def handle_operations_get(self, method, params, query, headers, body):
+        with self.lock:
+            if params['name'] not in self.operations:
+                return error_response(404, 'Operation not found.')
+            operation = self.operations[params['name']]
+            response = {key: value for key, value in operation.items() if key != 'created_at'}
+            if time.time() - operation['created_at'] >= self.operation_time:
+                function = self.functions[operation['metadata']['target']]
+                function['status'] = 'ACTIVE'
+                response.update({'done': True, 'response': self.get_function(function['name'])})
+            return json_response(200, response)
+
+    def handle_storage_buckets_get(self, method, params, query, headers, body):
+        with self.lock:
+            if params['bucket'] not in self.buckets:
+                return error_response(404, 'Bucket not found.')
+            return json_response(200, self.buckets[params['bucket']])
+
+    def handle_storage_buckets_insert(self, method, params, query, headers, body):
+        bucket = json.loads(body)
+        with self.lock:
+            if bucket['name'] in self.buckets:
+                return error_response(409, 'Bucket already exists.')
+            bucket.update({'id': bucket['name'], 'kind': 'storage#bucket', 'projectNumber': '1'})
+            self.buckets[bucket['name']] = bucket
+            return json_response(200, bucket)
+
+    def handle_storage_objects_get(self, method, params, query, headers, body):
+        with self.lock:
+            key = (params['bucket'], params['object'])
+            if key not in self.objects:
+                return error_response(404, 'Object not found.')
+            return json_response(200, self.objects[key])
+
+    def handle_storage_objects_delete(self, method, params, query, headers, body):
+        with self.lock:
+            key = (params['bucket'], params['object'])
+            if key not in self.objects:
+                return error_response(404, 'Object not found.')
+            del self.objects[key]
+            del self.contents[key]
+            return 204, {}, b''
+
+    def handle_storage_objects_compose(self, method, params, query, headers, body):
+        request = json.loads(body)
+        with self.lock:
+            keys = [(params['bucket'], source['name']) for source in request['sourceObjects']]
+            if any(key not in self.contents for key in keys):
+                return error_response(404, 'Source object not found.')
+            data = b''.join(self.contents[key] for key in keys)
+        metadata = self.store_object(params['bucket'], params['object'], data, False)
+        metadata.update({key: value for key, value in request.get('destination', {}).items() if key not in metadata})
+        return json_response(200, metadata)
+
+    def handle_storage_objects_insert(self, method, params, query, headers, body):
+        if query.get('uploadType') == 'multipart':
+            parts = split_multipart(body, get_boundary(headers['content-type']))
+            metadata = json.loads(parts[0][1])
+            return json_response(200, self.store_object(params['bucket'], metadata.get('name', query.get('name')),
+                                                        parts[1][1]))
+        metadata = json.loads(body) if body else {}
+        upload_id = uuid.uuid4().hex
+        with self.lock:
+            self.uploads[upload_id] = {
+                'bucket': params['bucket'], 'name': metadata.get('name', query.get('name')), 'data': bytearray()}
+        location = '%s/upload/storage/v1/b/%s/o?uploadType=resumable&upload_id=%s' % (
+            self.base_url, params['bucket'], upload_id)
+        return json_response(200, {}, {'Location': location})
+
+    def handle_storage_objects_upload(self, method, params, query, headers, body):
+        with self.lock:
+            upload = self.uploads.get(query.get('upload_id'))
+            if upload is None:
+                return error_response(404, 'Upload not found.')
+            upload['data'].extend(body)
+            size = len(upload['data'])
+        content_range = headers.get('content-range', 'bytes */*')
+        total = content_range.rsplit('/', 1)[1]
+        if total == '*' or int(total) != size:
+            range_headers = {} if size == 0 else {'Range': 'bytes=0-%d' % (size - 1)}
+            return 308, range_headers, b''
+        with self.lock:
+            del self.uploads[query['upload_id']]
+        return json_response(200, self.store_object(upload['bucket'], upload['name'], bytes(upload['data'])))
+
+    def store_object(self, bucket, name, data, uploaded=True):
+        """
+            Stores an uploaded or composed object.
+
+                Parameters:
+                    bucket (string): bucket name
+                    name (string): object name
+                    data (bytes): object content
+                    uploaded (boolean): count the content as uploaded bytes
+
+                Returns:
+                    metadata (dictionary): object metadata
+        """
+        metadata = {'kind': 'storage#object', 'bucket': bucket, 'name': name, 'size': str(len(data)),
+                    'generation': str(int(time.time() * 1000000)),
+                    'crc32c': base64.b64encode(google_crc32c.Checksum(data).digest()).decode()}
+        if uploaded:
+            metadata['md5Hash'] = base64.b64encode(hashlib.md5(data).digest()).decode()
+        with self.lock:
+            self.bytes_uploaded += len(data) if uploaded else 0
+            self.objects[(bucket, name)] = metadata
+            self.contents[(bucket, name)] = data
+            return metadata
+
+    def create_operation(self, target, operation_type):
+        """
+            Starts an emulated long running operation. Called with the lock held.
+
+                Parameters:
+                    target (string): full name of the function
+                    operation_type (string): CREATE_FUNCTION or UPDATE_FUNCTION
+
+                Returns:
+                    operation (dictionary): operation object
+        """
+        name = 'operations/%s' % uuid.uuid4().hex
+        operation = {
+            'name': name,
+            'metadata': {'target': target, 'type': operation_type},
+            'done': False
+        }
+        self.operations[name] = dict(operation, created_at=time.time())
+        return operation
+
+    def get_function(self, name):
+        """
+            Returns a function object. Called with the lock held.
+
+                Parameters:
+                    name (string): full name of the function
+
+                Returns:
+                    function (dictionary): function object
+        """
+        function = dict(self.functions[name])
+        function['updateTime'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(function['updateTime']))
+        return function
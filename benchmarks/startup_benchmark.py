@@ -0,0 +1,80 @@
+"""
+    Cold start benchmark of the gostep CLI.
+
+    Runs the CLI with `python -X importtime` for commands which must not load
+    the Google cloud, SVN or YAML libraries and fails when one of them is
+    imported or the import time exceeds the budget.
+
+        Usage:
+            python benchmarks/startup_benchmark.py [runs]
+"""
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOSTEP_CLI = os.path.join(REPO_DIR, 'bin', 'gostep')
+SCENARIOS = [
+    ('gostep', []),
+    ('gostep base show', ['base', 'show']),
+    ('gostep deploy (usage error)', ['deploy'])
+]
+HEAVY_MODULES = ['google', 'googleapiclient', 'httplib2', 'svn', 'yaml']
+IMPORT_TIME_BUDGET = 0.15
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+
+def run_scenario(args, workspace_dir):
+    """
+        Runs the CLI once and returns the wall time, the total import time and
+        the imported modules.
+
+            Parameters:
+                args (list): CLI arguments
+                workspace_dir (string): working directory of the CLI
+
+            Returns:
+                result (tuple): wall time, import time in seconds and module names
+    """
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    started_at = time.perf_counter()
+    process = subprocess.run([sys.executable, '-X', 'importtime', GOSTEP_CLI] + args, cwd=workspace_dir,
+                             env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    wall_time = time.perf_counter() - started_at
+    import_time = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        modules.add(match.group(4))
+        if len(match.group(3)) == 1:
+            import_time += int(match.group(2))
+    return wall_time, import_time / 1000000.0, modules
+
+
+def main(runs):
+    failures = []
+    workspace_dir = tempfile.mkdtemp(prefix='gostep-startup-')
+    print('%-32s %10s %12s' % ('command', 'wall (s)', 'imports (s)'))
+    for name, args in SCENARIOS:
+        results = [run_scenario(args, workspace_dir) for _ in range(runs)]
+        wall_time = min(result[0] for result in results)
+        import_time = min(result[1] for result in results)
+        print('%-32s %10.3f %12.3f' % (name, wall_time, import_time))
+        heavy_modules = sorted(module for module in results[0][2]
+                               if module.split('.')[0] in HEAVY_MODULES)
+        if len(heavy_modules) != 0:
+            failures.append('%s imports %s' % (name, ', '.join(heavy_modules[:5])))
+        if import_time > IMPORT_TIME_BUDGET:
+            failures.append('%s spends %.3fs importing, budget is %.3fs' % (name, import_time, IMPORT_TIME_BUDGET))
+    for failure in failures:
+        print('FAIL: %s' % failure)
+    return 1 if len(failures) != 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
@@ -1,14 +1,49 @@
-from gostep.aggregator import bootstrap_base
-from gostep.aggregator import bootstrap_service
-from gostep.aggregator import deploy
-from gostep.aggregator import deploy_all
-from gostep.aggregator import get_cloud_functions
-from gostep.file_manager import get_checksum
-from gostep.file_manager import get_json_from_file
-from gostep.file_manager import get_json_from_file
-from gostep.file_manager import path_exists
-from gostep.gcloud_ops import create_credentials
-from gostep.gcloud_ops import default_gcloud_project
-from gostep.gcloud_ops import get_locations
-from gostep.gcloud_ops import get_projects
-from gostep.gcloud_ops import set_credential_file
+from importlib import import_module
+
+__all__ = [
+    'bootstrap_base',
+    'bootstrap_service',
+    'deploy',
+    'deploy_all',
+    'get_cloud_functions',
+    'get_checksum',
+    'get_json_from_file',
+    'path_exists',
+    'create_credentials',
+    'default_gcloud_project',
+    'get_locations',
+    'get_projects',
+    'set_credential_file'
+]
+
+EXPORTS = {
+    'bootstrap_base': 'gostep.aggregator',
+    'bootstrap_service': 'gostep.aggregator',
+    'deploy': 'gostep.aggregator',
+    'deploy_all': 'gostep.aggregator',
+    'get_cloud_functions': 'gostep.aggregator',
+    'get_checksum': 'gostep.file_manager',
+    'get_json_from_file': 'gostep.file_manager',
+    'path_exists': 'gostep.file_manager',
+    'create_credentials': 'gostep.gcloud_ops',
+    'default_gcloud_project': 'gostep.gcloud_ops',
+    'get_locations': 'gostep.gcloud_ops',
+    'get_projects': 'gostep.gcloud_ops',
+    'set_credential_file': 'gostep.gcloud_ops'
+}
+
+
+def __getattr__(name):
+    """
+        Imports exported functions on first access, so the Google cloud and
+        SVN libraries are loaded only by the commands which use them.
+
+            Parameters:
+                name (string): attribute name
+
+            Returns:
+                attribute (object): exported function
+    """
+    if name in EXPORTS:
+        return getattr(import_module(EXPORTS[name]), name)
+    raise AttributeError("module 'gostep' has no attribute '%s'" % name)
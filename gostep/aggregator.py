@@ -1,22 +1,46 @@
+import json
 import re
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from os import makedirs
 from os.path import join
 
-from gostep.builders import build_java_project
+from gostep.builders import build_java_project, get_build_cache_stats, vendor_dependencies, get_build_dir, \
+    get_dependencies
 from gostep.consts import BASE_CONFIG_FILE, BUILD_DIR, GOSTEP_BUCKET, SERVICES, \
     TEMPLATES, NAME, DESCRIPTION, VERSION, SOURCE_DIRECTORY, SOURCE_ARCHIVE, \
     LOCATION_NAME, LOCATION_ID, PROJECT_ID, DEFAULT_LOCATION, \
     ENVIRONMENT, AUTH_FILE, SERVICE_CONFIG_FILE, CHECKSUM, TRIGGER, RUNTIME, JAVA_RUNTIME, \
-    ALLOW_ALL
+    ALLOW_ALL, GOSTEP_STATE_DIR, MANIFESTS_DIR, SOURCE_ARCHIVES_PREFIX, OPERATION, STARTED_AT, \
+    GOSTEP_CACHE_DIR, KNOWN_BUCKETS_FILE, SERVICE, CHANGED, ACTION, IAM_BINDING, SOURCE_SIZE, CREATE_ACTION, \
+    PATCH_ACTION, NO_ACTION, RESPONSE, ERROR, LOCATION_IDS, REGIONS, GIT_COMMIT, REGION_DEPLOY_WORKERS, \
+    JAVA_BUILD_OUTPUT, DEPENDENCIES_DIR
 from gostep.consts import TEMPLATE_DIRECTORY
-from gostep.file_manager import copy_dir, get_checksum
+from gostep.file_manager import copy_dir, get_service_digest, path_exists
 from gostep.file_manager import get_dir
 from gostep.file_manager import get_json_from_file, create_compressed_file, \
-    rewrite_json_file
-from gostep.gcloud_ops import get_cloud_functions, get_buckets, \
-    create_bucket, get_bucket, update_cloud_function, deploy_cloud_function, \
-    upload_file_to_bucket, get_locations, set_iam_policy, get_iam_policy, \
-    get_cloud_function
+    rewrite_json_file, open_compressed_stream, get_archive_digest, get_sources_size
+from gostep.gcloud_ops import get_cloud_functions, create_bucket, \
+    update_cloud_function, deploy_cloud_function, upload_file_to_bucket, \
+    get_locations, set_iam_policy, get_iam_policy, \
+    upload_stream_to_bucket, blob_exists, lookup_bucket, get_bucket_reference, \
+    get_storage_client, get_iam_policies, set_iam_policies, get_cloud_functions_by_name
+from gostep.git_ops import get_git_changes
+from gostep.inventory import cloud_function_exists, invalidate_cloud_function, get_inventory, \
+    refresh_cloud_functions
+from gostep.operations import wait_for_operations, describe_operation, operation_succeeded
 from gostep.repo_service import clone_template
+from gostep.state import get_service, get_services, put_service, update_services, load_project_spec
+from gostep.tracing import span
+
+storage_bucket_lock = threading.Lock()
+storage_buckets = {}
+region_executors = {}
+region_executors_lock = threading.Lock()
+running_deployments = {}
+running_deployments_lock = threading.Lock()
 
 
 def bootstrap_base(workspace_dir, project_name, description, default_location,
@@ -70,31 +94,36 @@ def get_template(workspace_dir, environment):
     return get_dir(environment, template_dir)
 
 
-def get_template_from_store(environment, trigger, workspace_dir, project_spec):
+def get_template_from_store(environment, trigger, workspace_dir, project_spec, offline=False):
     """
-        Gets template from local store, download if it does not exists locally.
+        Gets template from the machine wide template cache, download if it
+        does not exists there, and materializes it in the workspace.
 
         Parameters:
             workspace_dir (string): workspace directory
             environment (string): runtime
             trigger (string): function invocation trigger
             project_spec (dictionary): base project config
+            offline (boolean): use cached templates without network calls
 
         Returns:
             template_dir (string): path to template in local store
     """
     template_id = ''.join([environment, '/', trigger])
     template_path = ''.join([TEMPLATE_DIRECTORY, '/', template_id])
-    if template_id not in project_spec.get(TEMPLATES).keys():
-        template_path = get_dir(template_path, workspace_dir)
-        source_template = clone_template(template_id, template_path)
-        project_spec[TEMPLATES][template_id] = source_template.replace(''.join([workspace_dir, '/']), '')
+    if template_id not in project_spec.get(TEMPLATES).keys() or \
+            not path_exists(join(workspace_dir, project_spec[TEMPLATES][template_id])):
+        source_template = clone_template(template_id, join(workspace_dir, template_path), offline)
+        if source_template is None:
+            return None
+        project_spec[TEMPLATES][template_id] = template_path
         rewrite_json_file(''.join([workspace_dir, '/', BASE_CONFIG_FILE]), project_spec)
         return source_template
     return join(workspace_dir, project_spec[TEMPLATES][template_id])
 
 
-def bootstrap_service(workspace_dir, name, description, environment, location, version, trigger, allow_all=False):
+def bootstrap_service(workspace_dir, name, description, environment, location, version, trigger, allow_all=False,
+                      offline=False, location_ids=None):
     """
         Gets template and builds directory for a service.
 
@@ -107,18 +136,23 @@ def bootstrap_service(workspace_dir, name, description, environment, location, v
             version (string): version number,
             trigger (string): function invocation trigger,
             allow_all (boolen): allow invoke access to public
+            offline (boolean): use cached templates without network calls
+            location_ids (list): gcloud location ids to deploy to, None for the location only
 
         Returns:
             service_spec (object): dictionary object containing service info
     """
-    project_spec_file = ''.join([workspace_dir, '/', BASE_CONFIG_FILE])
-    project_spec = get_json_from_file(project_spec_file)
     service_name = re.sub('[^A-Za-z0-9]+', '-', name).lower()
-    if service_name in project_spec[SERVICES].keys():
+    service_spec = get_service(workspace_dir, service_name)
+    if service_spec is not None:
         print('Service already exists. Please select a different name')
-        return project_spec[SERVICES][service_name][SOURCE_DIRECTORY]
+        return service_spec[SOURCE_DIRECTORY]
+    project_spec = get_json_from_file(''.join([workspace_dir, '/', BASE_CONFIG_FILE]))
     print(''.join(['Fetching template from store for ', service_name]))
-    template_dir = get_template_from_store(environment, trigger, workspace_dir, project_spec)
+    template_dir = get_template_from_store(environment, trigger, workspace_dir, project_spec, offline)
+    if template_dir is None:
+        print(''.join(['Template ', environment, '/', trigger, ' is not available.']))
+        return None
     sources_root = get_dir('src', workspace_dir)
     source_path = copy_dir(template_dir, ''.join([sources_root, '/', service_name]))
     location_name = ''.join(['projects/', project_spec[PROJECT_ID], '/locations/', location])
@@ -129,8 +163,7 @@ def bootstrap_service(workspace_dir, name, description, environment, location, v
     function_spec[DESCRIPTION] = description
     function_spec = rewrite_json_file(function_spec_file, function_spec)
     print('Function specification for %s has been updated.' % function_spec[NAME])
-    project_spec = get_json_from_file(project_spec_file)
-    project_spec[SERVICES][service_name] = {
+    service_spec = {
         NAME: service_name,
         DESCRIPTION: description,
         SOURCE_DIRECTORY: source_path.replace(''.join([workspace_dir, '/']), ''),
@@ -143,43 +176,59 @@ def bootstrap_service(workspace_dir, name, description, environment, location, v
         CHECKSUM: '',
         ALLOW_ALL: allow_all
     }
-    project_spec = rewrite_json_file(project_spec_file, project_spec)
-    print(''.join(['Function has been configured in ', project_spec[SERVICES][service_name][SOURCE_DIRECTORY]]))
-    return project_spec[SERVICES][service_name]
+    if location_ids:
+        service_spec[LOCATION_IDS] = list(location_ids)
+    put_service(workspace_dir, service_name, service_spec)
+    print(''.join(['Function has been configured in ', service_spec[SOURCE_DIRECTORY]]))
+    return service_spec
 
 
-def cloud_function_exists(name, location_path):
+def bucket_exists(name):
     """
-        Find that function already has been deployed.
+        Find that storage bucket already has been deployed.
 
         Parameters:
-            name (string): name of the service
-            location_path (string): location path of the functions
+            name (string): name of the bucket
 
         Returns:
-            is_exists (boolean): true, if function already has been deployed
+            is_exists (boolean): true, if bucket has been created
     """
-    cloud_functions = get_cloud_functions(location_path)
-    return any(name == function[NAME] for function in cloud_functions)
+    return lookup_bucket(name) is not None
 
 
-def bucket_exists(name):
+def get_known_buckets():
     """
-        Find that storage bucket already has been deployed.
+        Returns the staging buckets resolved by previous runs.
+
+        Returns:
+            known_buckets (dictionary): project id against list of bucket names
+    """
+    known_buckets_file = join(GOSTEP_CACHE_DIR, KNOWN_BUCKETS_FILE)
+    if not path_exists(known_buckets_file):
+        return {}
+    return get_json_from_file(known_buckets_file) or {}
+
+
+def set_known_bucket(project, name, known):
+    """
+        Remembers or forgets a resolved staging bucket for later runs.
 
         Parameters:
+            project (string): gcloud project id
             name (string): name of the bucket
-
-        Returns:
-            is_exists (boolean): true, if bucket has been created
+            known (boolean): true to remember the bucket, false to forget it
     """
-    buckets = list(get_buckets())
-    return any(name == bucket.name for bucket in buckets)
+    known_buckets = get_known_buckets()
+    project_buckets = [bucket for bucket in known_buckets.get(project, []) if bucket != name]
+    known_buckets[project] = project_buckets + [name] if known else project_buckets
+    makedirs(GOSTEP_CACHE_DIR, exist_ok=True)
+    rewrite_json_file(join(GOSTEP_CACHE_DIR, KNOWN_BUCKETS_FILE), known_buckets)
 
 
 def get_storage_bucket(name, location):
     """
-        Get the storage bucket, create one if it does not exists.
+        Get the storage bucket, create one if it does not exists. Resolved
+        buckets are remembered for the process and for later runs.
 
         Parameters:
             name (string): name of the bucket
@@ -188,9 +237,32 @@ def get_storage_bucket(name, location):
         Returns:
             bucket (object): storage bucket object
     """
-    if not bucket_exists(name):
-        return create_bucket(name, location)
-    return get_bucket(name)
+    with storage_bucket_lock:
+        if name in storage_buckets:
+            return storage_buckets[name]
+        project = get_storage_client().project
+        if name in get_known_buckets().get(project, []):
+            storage_buckets[name] = get_bucket_reference(name)
+            return storage_buckets[name]
+        bucket = lookup_bucket(name)
+        if bucket is None:
+            bucket = create_bucket(name, location)
+        if bucket is not None:
+            storage_buckets[name] = bucket
+            set_known_bucket(project, name, True)
+        return bucket
+
+
+def forget_storage_bucket(name):
+    """
+        Forgets a resolved storage bucket, so it is looked up again.
+
+        Parameters:
+            name (string): name of the bucket
+    """
+    with storage_bucket_lock:
+        storage_buckets.pop(name, None)
+        set_known_bucket(get_storage_client().project, name, False)
 
 
 def authorize_public_invoking(resource_path):
@@ -204,7 +276,17 @@ def authorize_public_invoking(resource_path):
         Returns:
             policy (object): updated policy
     """
-    return set_iam_policy(resource_path, {
+    return set_iam_policy(resource_path, get_public_invoking_policy())
+
+
+def get_public_invoking_policy():
+    """
+        Returns the IAM policy request which allows public invoking.
+
+        Returns:
+            policy_request (dictionary): policy request object
+    """
+    return {
         'policy': {
             'bindings': [
                 {
@@ -213,7 +295,35 @@ def authorize_public_invoking(resource_path):
                 }
             ]
         }
-    })
+    }
+
+
+def authorize_deployments(function_names):
+    """
+        Allows public invoking of many functions with batched requests. Policies
+        are read first and set only for the functions which have no bindings.
+
+        Parameters:
+            function_names (list): paths to functions as
+            /projects/{}/locations/{}/functions/{}
+
+        Returns:
+            errors (dictionary): function name against the error of setting its policy
+    """
+    if len(function_names) == 0:
+        return {}
+    policies = get_iam_policies(function_names) or {}
+    unauthorized = [
+        function_name for function_name in function_names
+        if function_name not in policies or policies[function_name][ERROR] is not None
+        or 'bindings' not in policies[function_name][RESPONSE]
+    ]
+    results = set_iam_policies({function_name: get_public_invoking_policy() for function_name in unauthorized}) or {}
+    return {
+        function_name: results[function_name][ERROR] if function_name in results else 'No response.'
+        for function_name in unauthorized
+        if function_name not in results or results[function_name][ERROR] is not None
+    }
 
 
 def invoke_role_exists(resource_path):
@@ -231,7 +341,22 @@ def invoke_role_exists(resource_path):
     return 'bindings' in policy
 
 
-def upload_source_to_bucket(workspace_dir, name, service_dir, location, runtime):
+def check_cancelled(cancel_event, name, stage):
+    """
+        Stops a deployment whose run has been cancelled, so workers left behind
+        by an expired deadline do not upload, deploy or write state.
+
+        Parameters:
+            cancel_event (Event): set when the run has been cancelled, None if it can not be
+            name (string): service name
+            stage (string): what the deployment was about to do
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise RuntimeError('Deployment of %s has been cancelled before %s.' % (name, stage))
+
+
+def upload_source_to_bucket(workspace_dir, name, service_dir, location, runtime, streaming=False, vendor=False,
+                            cancel_event=None):
     """
         Build compressed file and upload it into storage bucket.
 
@@ -241,80 +366,565 @@ def upload_source_to_bucket(workspace_dir, name, service_dir, location, runtime)
             service_dir (string): path to service source
             location (string): region id
             runtime (string): runtime environment
+            streaming (boolean): compress while uploading, without a temporary zip file
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+            cancel_event (Event): set when the deployment has to stop, None if it can not be cancelled
 
         Returns:
             source_url (string): path to cloud function
     """
-    build_dir = get_dir(BUILD_DIR, workspace_dir)
     service_root = service_dir
+    manifest_file = join(workspace_dir, GOSTEP_STATE_DIR, MANIFESTS_DIR, ''.join([name, '.json']))
     if JAVA_RUNTIME in runtime:
-        service_dir = build_java_project(service_dir)
-    source_archive = create_compressed_file(name, service_root, service_dir, build_dir)
-    storage_bucket = get_storage_bucket(GOSTEP_BUCKET, location)
-    return upload_file_to_bucket(storage_bucket.name, name, source_archive)
+        service_dir = build_java_project(
+            service_dir, join(workspace_dir, GOSTEP_STATE_DIR, MANIFESTS_DIR, ''.join([name, '.sources.json'])))
+        if service_dir is None:
+            print('Build has been failed for %s.' % name)
+            return None
+        manifest_file = join(workspace_dir, GOSTEP_STATE_DIR, MANIFESTS_DIR, ''.join([name, '.build.json']))
+    dependencies = vendor_dependencies(service_dir, runtime) if vendor and JAVA_RUNTIME not in runtime else None
+    with span('archive_digest'):
+        archive_digest = get_archive_digest(service_root, service_dir, manifest_file, dependencies)
+    if archive_digest is None:
+        print('Sources of %s have not been hashed.' % name)
+        return None
+    archive_name = ''.join([SOURCE_ARCHIVES_PREFIX, archive_digest, '.zip'])
+    with span('bucket_lookup'):
+        storage_bucket = get_storage_bucket(GOSTEP_BUCKET, location)
+    if blob_exists(storage_bucket.name, archive_name):
+        print(''.join(['Source archive of ', name, ' has already been uploaded as ', archive_name, '.']))
+        return ''.join(['gs://', storage_bucket.name, '/', archive_name])
+    check_cancelled(cancel_event, name, 'uploading its sources')
+    with span('upload', streaming=streaming):
+        if streaming:
+            archive_stream = open_compressed_stream(service_root, service_dir, dependencies)
+            try:
+                source_url = upload_stream_to_bucket(storage_bucket.name, archive_name, archive_stream)
+            finally:
+                archive_stream.close()
+        else:
+            build_dir = get_dir(BUILD_DIR, workspace_dir)
+            source_archive = create_compressed_file(name, service_root, service_dir, build_dir, dependencies)
+            source_url = upload_file_to_bucket(storage_bucket.name, archive_name, source_archive)
+    if source_url is None:
+        forget_storage_bucket(storage_bucket.name)
+    return source_url
+
+
+def get_service_locations(project_spec, service_info, location=None):
+    """
+        Returns the regions a service is deployed to: the given region, the
+        location_ids of the service, its location_id or the default location.
 
+        Parameters:
+            project_spec (dictionary): base project config
+            service_info (dictionary): service entry of the base project config
+            location (string): region id, None for the regions of the service
 
-def deploy(name, location, workspace_dir):
+        Returns:
+            locations (list): region ids
     """
-        Deploy a cloud function service, redeploy if already has been deployed.
+    if location:
+        return [location]
+    if service_info.get(LOCATION_IDS):
+        return list(service_info[LOCATION_IDS])
+    if service_info.get(LOCATION_ID):
+        return [service_info[LOCATION_ID]]
+    if project_spec[DEFAULT_LOCATION] != '':
+        return [project_spec[DEFAULT_LOCATION]]
+    return [get_locations(project_spec[PROJECT_ID])[0]['locationId']]
+
+
+def deploy_to_location(service_name, location_name, function_spec, authorize=False, cancel_event=None):
+    """
+        Creates or patches the function of a service in one region.
+
+        Parameters:
+            service_name (string): service name
+            location_name (string): region path as projects/{project_id}/locations/{location_id}
+            function_spec (dictionary): function specification with the uploaded sources
+            authorize (boolean): allow public invoking of the function
+            cancel_event (Event): set when the deployment has to stop, None if it can not be cancelled
+
+        Returns:
+            operation (object): long running operation of the deployment, with
+            the time it has been started
+    """
+    function_name = ''.join([location_name, '/functions/', service_name])
+    function_spec = dict(function_spec, name=function_name)
+    exists = cloud_function_exists(function_name, location_name)
+    check_cancelled(cancel_event, service_name, 'deploying it')
+    if exists:
+        with span('patch', service=service_name, location=location_name):
+            result = update_cloud_function(function_name, 'sourceArchiveUrl', function_spec)
+    else:
+        with span('create', service=service_name, location=location_name):
+            result = deploy_cloud_function(location_name, function_spec)
+    if result is not None:
+        result[STARTED_AT] = time.time()
+    invalidate_cloud_function(function_name, location_name)
+    if result is not None and authorize:
+        with span('iam', service=service_name, location=location_name):
+            if not invoke_role_exists(result['metadata']['target']):
+                authorize_public_invoking(result['metadata']['target'])
+    return result
+
+
+def get_region_executor():
+    """
+        Returns the pool of workers deploying services to several regions,
+        shared by every deployment of the process so its workers keep their
+        API clients.
+
+        Returns:
+            executor (ThreadPoolExecutor): pool of workers
+    """
+    with region_executors_lock:
+        if 'executor' not in region_executors:
+            region_executors['executor'] = ThreadPoolExecutor(max_workers=REGION_DEPLOY_WORKERS,
+                                                              thread_name_prefix='region')
+        return region_executors['executor']
+
+
+def trigger_deployment(name, location, workspace_dir, streaming=False, vendor=False, authorize=True,
+                       cancel_event=None):
+    """
+        Upload sources and trigger the deployment of a cloud function service,
+        redeploy if already has been deployed. Sources are built and uploaded
+        once and every region of the service is deployed at the same time.
 
         Parameters:
             name (string): service name
-            location (string): region id
+            location (string): region id, None for the regions of the service
             workspace_dir (string): workspace directory path
+            streaming (boolean): upload sources without a temporary zip file
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+            authorize (boolean): allow public invoking here, false if the caller does it in batch
+            cancel_event (Event): set when the deployment has to stop, None if it can not be cancelled
 
         Returns:
-            function (object): cloud function object
+            operations (dictionary): region id against the long running
+            operation of its deployment, None for regions which failed
     """
-    project_spec_file = ''.join([workspace_dir, '/', BASE_CONFIG_FILE])
-    project_spec = get_json_from_file(project_spec_file)
+    project_spec = get_json_from_file(''.join([workspace_dir, '/', BASE_CONFIG_FILE]))
     service_name = re.sub('[^A-Za-z0-9]+', '-', name).lower()
-    if service_name not in project_spec[SERVICES].keys():
+    service_info = get_service(workspace_dir, service_name)
+    if service_info is None:
         print('Service does not exists.')
         return False
-    service_info = project_spec[SERVICES][service_name]
     service_dir = ''.join([workspace_dir, '/', service_info[SOURCE_DIRECTORY]])
-    location = location if location is not None else get_locations(
-        project_spec[PROJECT_ID])[0]['locationId'] if project_spec[DEFAULT_LOCATION] == '' else project_spec[
-        DEFAULT_LOCATION]
-    location_name = ''.join(['projects/', project_spec[PROJECT_ID], '/locations/', location])
-    function_name = ''.join([location_name, '/functions/', service_name])
+    locations = get_service_locations(project_spec, service_info, location)
+    location_names = {
+        region: ''.join(['projects/', project_spec[PROJECT_ID], '/locations/', region]) for region in locations}
     function_spec_file = ''.join([service_dir, '/', 'function.json'])
     function_spec = get_json_from_file(function_spec_file)
-    source_archive_url = upload_source_to_bucket(workspace_dir, service_name, service_dir, location,
-                                                 function_spec[RUNTIME])
-    function_spec[NAME] = function_name
+    check_cancelled(cancel_event, service_name, 'building its sources')
+    with span('sources', service=service_name):
+        source_archive_url = upload_source_to_bucket(workspace_dir, service_name, service_dir, locations[0],
+                                                     function_spec[RUNTIME], streaming, vendor, cancel_event)
+    if source_archive_url is None:
+        print('Sources of %s have not been uploaded.' % service_name)
+        return False
     function_spec['sourceArchiveUrl'] = source_archive_url
-    if cloud_function_exists(function_name, location_name):
-        result = update_cloud_function(function_spec[NAME], 'sourceArchiveUrl', function_spec)
-        function_spec[NAME] = result['metadata']['target']
+    authorize = authorize and service_info[ALLOW_ALL]
+    operations = {}
+    check_cancelled(cancel_event, service_name, 'deploying it')
+    if len(locations) == 1:
+        try:
+            operations[locations[0]] = deploy_to_location(service_name, location_names[locations[0]], function_spec,
+                                                          authorize, cancel_event)
+        except Exception as error:
+            print(error if cancel_event is not None and cancel_event.is_set() else traceback.format_exc())
+            operations[locations[0]] = None
     else:
-        result = deploy_cloud_function(location_name, function_spec)
-        function_spec[NAME] = result['metadata']['target']
-    if project_spec[SERVICES][service_name][ALLOW_ALL] and not invoke_role_exists(function_spec[NAME]):
-        authorize_public_invoking(function_spec[NAME])
-    rewrite_json_file(function_spec_file, function_spec)
-    project_spec[SERVICES][service_name][LOCATION_NAME] = location_name
-    project_spec[SERVICES][service_name][LOCATION_ID] = location
-    rewrite_json_file(project_spec_file, project_spec)
-    service = get_cloud_function(function_spec[NAME])
-    print(''.join(['New deployment has been triggered for ', service_name]))
-    return service
-
-
-def deploy_all(workspace_dir):
-    project_spec_file = ''.join([workspace_dir, '/', BASE_CONFIG_FILE])
-    project_spec = get_json_from_file(project_spec_file)
-    for service_key in project_spec[SERVICES].keys():
-        service = project_spec[SERVICES][service_key]
-        service_dir = ''.join([workspace_dir, '/', service[SOURCE_DIRECTORY]])
-        service_checksum = get_checksum(service_dir)
-        if service_checksum != service[CHECKSUM]:
-            print("Deploying service %s..." % service[NAME])
-            deploy(service[NAME], service[LOCATION_ID], workspace_dir)
-            service_checksum = get_checksum(service_dir)
-            project_spec[SERVICES][service_key][CHECKSUM] = service_checksum
-            project_spec = rewrite_json_file(project_spec_file, project_spec)
-            print(''.join([service[NAME], ' service checksum updated ', service_checksum, '.']))
-    print('All up to date.')
-    return project_spec
+        futures = {region: get_region_executor().submit(deploy_to_location, service_name, location_names[region],
+                                                        function_spec, authorize, cancel_event)
+                   for region in locations}
+        for region, future in futures.items():
+            try:
+                operations[region] = future.result()
+            except Exception as error:
+                print(error if cancel_event is not None and cancel_event.is_set() else traceback.format_exc())
+                operations[region] = None
+    primary = locations[0]
+    if operations[primary] is not None:
+        check_cancelled(cancel_event, service_name, 'updating its state')
+        function_spec[NAME] = operations[primary]['metadata']['target']
+        rewrite_json_file(function_spec_file, function_spec)
+        update_services(workspace_dir, {service_name: {LOCATION_NAME: location_names[primary], LOCATION_ID: primary,
+                                                       GIT_COMMIT: ''}})
+    for region in locations:
+        if operations[region] is None:
+            print('Deployment of %s has not been triggered in %s' % (service_name, region))
+        else:
+            print('New deployment has been triggered for %s in %s' % (service_name, region))
+    return operations
+
+
+def deploy(name, location, workspace_dir, streaming=False, wait=False, vendor=False):
+    """
+        Deploy a cloud function service, redeploy if already has been deployed.
+
+        Parameters:
+            name (string): service name
+            location (string): region id, None for the regions of the service
+            workspace_dir (string): workspace directory path
+            streaming (boolean): upload sources without a temporary zip file
+            wait (boolean): return after the build has been succeeded or failed
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+
+        Returns:
+            functions (dictionary): region id against the cloud function
+            object, False for regions which failed
+    """
+    operations = trigger_deployment(name, location, workspace_dir, streaming, vendor)
+    if not operations:
+        return False
+    functions = {region: False for region in operations.keys()}
+    triggered = {region: operation for region, operation in operations.items() if operation is not None}
+    if wait and len(triggered) != 0:
+        print('Waiting for the deployment of %s...' % name)
+        with span('poll', service=name):
+            results = wait_for_operations({operation[NAME]: operation[STARTED_AT] for operation in triggered.values()})
+        for region in sorted(triggered.keys()):
+            result = results[triggered[region][NAME]]
+            print(''.join(['Deployment of ', name, ' in ', region, ' ', describe_operation(result)]))
+            if not operation_succeeded(result):
+                del triggered[region]
+    function_names = {operation['metadata']['target']: region for region, operation in triggered.items()}
+    for function_name, result in (get_cloud_functions_by_name(list(function_names.keys())) or {}).items():
+        functions[function_names[function_name]] = result[RESPONSE] if result[ERROR] is None else False
+    return functions
+
+
+def get_service_checksum(workspace_dir, service):
+    """
+        Returns the checksum of the sources and the function specification of
+        a service, rehashing only the files which have been changed since the
+        previous scan.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            service (dictionary): service entry of the base project config
+
+        Returns:
+            checksum (string): checksum of the service sources
+    """
+    service_dir = ''.join([workspace_dir, '/', service[SOURCE_DIRECTORY]])
+    manifest_file = join(workspace_dir, GOSTEP_STATE_DIR, MANIFESTS_DIR, ''.join([service[NAME], '.json']))
+    return get_service_digest(service_dir, manifest_file)
+
+
+def deploy_changed_service(workspace_dir, service, streaming=False, vendor=False, cancel_event=None, previous=None):
+    """
+        Trigger the deployment of a service if its sources have been changed
+        since the last deployment.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            service (dictionary): service entry of the base project config
+            streaming (boolean): upload sources without a temporary zip file
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+            cancel_event (Event): set when the deployment has to stop, None if it can not be cancelled
+            previous (Future): deployment of the same service left running by an earlier run, waited for first
+
+        Returns:
+            deployment (dictionary): checksum of the deployed sources, the
+            operation and function names and the trigger time per region and
+            the public invoking status, None if nothing changed
+    """
+    if previous is not None:
+        wait([previous])
+    check_cancelled(cancel_event, service[NAME], 'hashing its sources')
+    with span('checksum', service=service[NAME]):
+        service_checksum = get_service_checksum(workspace_dir, service)
+    if service_checksum == service[CHECKSUM]:
+        return None
+    print("Deploying service %s..." % service[NAME])
+    with span('deploy', service=service[NAME]):
+        operations = trigger_deployment(service[NAME], None, workspace_dir, streaming, vendor, False, cancel_event)
+    if not operations or any(operation is None for operation in operations.values()):
+        raise RuntimeError(''.join(['Deployment of ', service[NAME], ' has not been completed.']))
+    with span('checksum', service=service[NAME]):
+        service_checksum = get_service_checksum(workspace_dir, service)
+    return {
+        CHECKSUM: service_checksum,
+        REGIONS: {region: {OPERATION: operation[NAME], NAME: operation['metadata']['target'],
+                           STARTED_AT: operation[STARTED_AT]}
+                  for region, operation in operations.items()},
+        ALLOW_ALL: service[ALLOW_ALL]
+    }
+
+
+def deploy_all(workspace_dir, jobs=1, timeout=None, streaming=False, wait_builds=False, vendor=False,
+               service_keys=None, executor=None, git=False):
+    """
+        Deploy every changed service of the workspace using a pool of workers.
+        Workers still running when the deadline expires are cancelled and stop
+        before their next upload, deployment or state write. A service left
+        running by an earlier run is deployed again only once that run stops.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            jobs (int): number of services deployed at the same time
+            timeout (float): deadline of the whole run in seconds, None to wait forever
+            streaming (boolean): upload sources without temporary zip files
+            wait_builds (boolean): return after every build has been succeeded or failed
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+            service_keys (list): names of the services to check, None for every service
+            executor (ThreadPoolExecutor): pool of workers kept by the caller, None to use a new pool
+            git (boolean): skip hashing services whose sources no commit or local change has touched
+
+        Returns:
+            project_spec (dictionary): updated base project config
+    """
+    started_at = time.time()
+    services = get_services(workspace_dir, service_keys)
+    git_changes = get_git_changes(workspace_dir, services) if git else None
+    if git and git_changes is None:
+        print('Workspace is not inside a git repository. Hashing every service.')
+    elif git:
+        print('%d services unchanged since their last deployment, %d to be hashed.' % (
+            len(git_changes['unchanged']), len(git_changes['changed']) + len(git_changes['unknown'])))
+    pool = ThreadPoolExecutor(max_workers=max(1, jobs)) if executor is None else executor
+    cancel_event = threading.Event()
+    futures = {}
+    with running_deployments_lock:
+        for service_key, service in services.items():
+            if git_changes is not None and service_key in git_changes['unchanged']:
+                continue
+            previous = running_deployments.get((workspace_dir, service_key))
+            future = pool.submit(deploy_changed_service, workspace_dir, service, streaming, vendor, cancel_event,
+                                 None if previous is None or previous.done() else previous)
+            running_deployments[(workspace_dir, service_key)] = future
+            futures[future] = service_key
+    finished, unfinished = wait(futures, timeout=timeout)
+    if len(unfinished) != 0:
+        cancel_event.set()
+    with running_deployments_lock:
+        for future in finished:
+            if running_deployments.get((workspace_dir, futures[future])) is future:
+                del running_deployments[(workspace_dir, futures[future])]
+    if executor is None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        for future in unfinished:
+            future.cancel()
+    deployments = {}
+    unchanged = set() if git_changes is None else set(git_changes['unchanged'])
+    failures = {}
+    for future in finished:
+        try:
+            deployment = future.result()
+            if deployment is not None:
+                deployments[futures[future]] = deployment
+            else:
+                unchanged.add(futures[future])
+        except Exception:
+            failures[futures[future]] = traceback.format_exc()
+    for future in unfinished:
+        failures[futures[future]] = 'Deadline of %s seconds exceeded.\n' % timeout
+    public_services = {region[NAME]: service_key for service_key, deployment in deployments.items()
+                       if deployment[ALLOW_ALL] for region in deployment[REGIONS].values()}
+    with span('authorize', functions=len(public_services)):
+        authorization_errors = authorize_deployments(list(public_services.keys()))
+    for function_name, error in authorization_errors.items():
+        failures[public_services[function_name]] = ''.join(['Unable to allow public invoking: ', error, '\n'])
+        deployments.pop(public_services[function_name], None)
+    if wait_builds and len(deployments) != 0:
+        operations = {region[OPERATION]: region[STARTED_AT]
+                      for deployment in deployments.values() for region in deployment[REGIONS].values()}
+        print('Waiting for %d deployments...' % len(operations))
+        remaining = None if timeout is None else max(0.0, timeout - (time.time() - started_at))
+        with span('poll', operations=len(operations)):
+            results = wait_for_operations(operations, remaining)
+        for service_key in sorted(deployments.keys()):
+            for location in sorted(deployments[service_key][REGIONS].keys()):
+                result = results[deployments[service_key][REGIONS][location][OPERATION]]
+                print(''.join(['Deployment of ', service_key, ' in ', location, ' ', describe_operation(result)]))
+                if not operation_succeeded(result):
+                    failures[service_key] = ''.join([failures.get(service_key, ''), location, ': ',
+                                                     describe_operation(result), '\n'])
+            if service_key in failures:
+                del deployments[service_key]
+        refresh_cloud_functions([region[NAME] for deployment in deployments.values()
+                                 for region in deployment[REGIONS].values()])
+    commits = {}
+    if git_changes is not None:
+        commits = {service_key: {GIT_COMMIT: git_changes[GIT_COMMIT]} for service_key in unchanged
+                   if service_key not in git_changes['dirty'] and services[service_key].get(GIT_COMMIT) !=
+                   git_changes[GIT_COMMIT]}
+    for service_key, deployment in deployments.items():
+        commits[service_key] = {
+            CHECKSUM: deployment[CHECKSUM],
+            GIT_COMMIT: '' if git_changes is None or service_key in git_changes['dirty'] else git_changes[GIT_COMMIT]
+        }
+    update_services(workspace_dir, commits)
+    for service_key in sorted(deployments.keys()):
+        print(''.join([service_key, ' service checksum updated ', deployments[service_key][CHECKSUM], '.']))
+    for service_key in sorted(failures.keys()):
+        print(''.join(['Failed to deploy ', service_key, ':\n', failures[service_key]]))
+    build_cache_stats = get_build_cache_stats()
+    if build_cache_stats['hits'] + build_cache_stats['misses'] != 0:
+        print('Java build cache: %d hits, %d misses.' % (build_cache_stats['hits'], build_cache_stats['misses']))
+    if len(failures) == 0:
+        print('All up to date.')
+    else:
+        print('%d of %d services have not been deployed.' % (len(failures), len(futures)))
+    return load_project_spec(workspace_dir)
+
+
+def get_archive_size(workspace_dir, service, vendor=False):
+    """
+        Measures the files which would be archived for a service, without
+        building or installing anything: the cached or local build outputs of
+        Java services, and the cached dependencies when they are vendored.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            service (dictionary): service entry of the base project config
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+
+        Returns:
+            size (int): size of the archived files in bytes, None if they have not been built yet
+    """
+    service_dir = ''.join([workspace_dir, '/', service[SOURCE_DIRECTORY]])
+    runtime = get_json_from_file(join(service_dir, SERVICE_CONFIG_FILE))[RUNTIME]
+    sources_dir = service_dir
+    dependencies = None
+    if JAVA_RUNTIME in runtime:
+        manifest_file = join(workspace_dir, GOSTEP_STATE_DIR, MANIFESTS_DIR, ''.join([service[NAME], '.sources.json']))
+        sources_dir = get_build_dir(service_dir, manifest_file)
+        if not path_exists(sources_dir):
+            sources_dir = join(service_dir, JAVA_BUILD_OUTPUT)
+    elif vendor:
+        dependencies = get_dependencies(service_dir, runtime)
+    if not path_exists(sources_dir) or dependencies is not None and not path_exists(dependencies[DEPENDENCIES_DIR]):
+        return None
+    return get_sources_size(service_dir, sources_dir, dependencies)
+
+
+def plan_service(workspace_dir, service, changed=None, vendor=False):
+    """
+        Finds that the sources of a service have been changed and measures
+        them, without building or uploading anything.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            service (dictionary): service entry of the base project config
+            changed (boolean): changed status if it is already known, None to compare checksums
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+
+        Returns:
+            plan (dictionary): changed status and size of the archived files
+    """
+    return {
+        CHANGED: get_service_checksum(workspace_dir, service) != service[CHECKSUM] if changed is None else changed,
+        SOURCE_SIZE: get_archive_size(workspace_dir, service, vendor)
+    }
+
+
+def get_plan_inventory(location_name):
+    """
+        Returns the cloud functions of a location for a deployment plan,
+        reporting a failed listing instead of raising it.
+
+        Parameters:
+            location_name (string): location path as projects/{project_id}/locations/{location_id}
+
+        Returns:
+            functions (dictionary): function name against function object, None if the listing failed
+    """
+    try:
+        return get_inventory(location_name)
+    except RuntimeError as error:
+        print(error)
+        return None
+
+
+def get_deployment_plan(workspace_dir, jobs=1, git=False, vendor=False):
+    """
+        Works out what deploy diff would do for every service, from local
+        hashes, one function listing per region and batched IAM lookups.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            jobs (int): number of services hashed at the same time
+            git (boolean): skip hashing services whose sources no commit or local change has touched
+            vendor (boolean): include locally resolved Python or Node.js dependencies in source sizes
+
+        Returns:
+            plan (list): service, location, changed status, action, IAM binding
+            need and source size of every service in each of its regions, the
+            action is None where functions could not be listed
+    """
+    project_spec = get_json_from_file(''.join([workspace_dir, '/', BASE_CONFIG_FILE]))
+    services = get_services(workspace_dir)
+    git_changes = get_git_changes(workspace_dir, services) if git else None
+    known = {}
+    if git_changes is not None:
+        known = {service_key: False for service_key in git_changes['unchanged']}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {service_key: executor.submit(plan_service, workspace_dir, service, known.get(service_key), vendor)
+                   for service_key, service in services.items()}
+        service_plans = {service_key: future.result() for service_key, future in futures.items()}
+    plan = {}
+    for service_key, service in services.items():
+        for location in get_service_locations(project_spec, service):
+            location_name = ''.join(['projects/', project_spec[PROJECT_ID], '/locations/', location])
+            plan[(service_key, location)] = dict(service_plans[service_key], **{
+                SERVICE: service_key,
+                LOCATION_ID: location,
+                LOCATION_NAME: location_name,
+                NAME: ''.join([location_name, '/functions/', re.sub('[^A-Za-z0-9]+', '-', service[NAME]).lower()])
+            })
+    location_names = sorted(set(service_plan[LOCATION_NAME] for service_plan in plan.values()))
+    with ThreadPoolExecutor(max_workers=max(1, len(location_names))) as executor:
+        inventories = dict(zip(location_names, executor.map(get_plan_inventory, location_names)))
+    for service_plan in plan.values():
+        if not service_plan[CHANGED]:
+            service_plan[ACTION] = NO_ACTION
+        elif inventories[service_plan[LOCATION_NAME]] is None:
+            service_plan[ACTION] = None
+        elif service_plan[NAME] in inventories[service_plan[LOCATION_NAME]]:
+            service_plan[ACTION] = PATCH_ACTION
+        else:
+            service_plan[ACTION] = CREATE_ACTION
+        service_plan[IAM_BINDING] = None if service_plan[ACTION] is None else \
+            service_plan[ACTION] == CREATE_ACTION and services[service_plan[SERVICE]][ALLOW_ALL]
+    patched = {service_plan[NAME]: service_plan for service_plan in plan.values()
+               if service_plan[ACTION] == PATCH_ACTION and services[service_plan[SERVICE]][ALLOW_ALL]}
+    for function_name, result in (get_iam_policies(list(patched.keys())) or {}).items():
+        patched[function_name][IAM_BINDING] = None if result[ERROR] is not None else 'bindings' not in result[RESPONSE]
+    return [plan[key] for key in sorted(plan.keys())]
+
+
+def print_deployment_plan(plan, json_output=False):
+    """
+        Prints a deployment plan as a table or as JSON.
+
+        Parameters:
+            plan (list): deployment plan returned by get_deployment_plan
+            json_output (boolean): print JSON instead of a table
+    """
+    if json_output:
+        print(json.dumps(plan, indent=4))
+        return
+    rows = [['SERVICE', 'LOCATION', 'CHANGED', 'ACTION', 'IAM BINDING', 'SOURCE SIZE']]
+    for service_plan in plan:
+        rows.append([
+            service_plan[SERVICE],
+            service_plan[LOCATION_ID],
+            'yes' if service_plan[CHANGED] else 'no',
+            'unknown' if service_plan[ACTION] is None else service_plan[ACTION],
+            'unknown' if service_plan[IAM_BINDING] is None else 'yes' if service_plan[IAM_BINDING] else 'no',
+            'unknown' if service_plan[SOURCE_SIZE] is None else str(service_plan[SOURCE_SIZE])
+        ])
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    for row in rows:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+    actions = [service_plan[ACTION] for service_plan in plan]
+    print('%d to create, %d to patch, %d unchanged.' % (
+        actions.count(CREATE_ACTION), actions.count(PATCH_ACTION), actions.count(NO_ACTION)))
+    if actions.count(None) != 0:
+        print('%d unknown, their functions could not be listed.' % actions.count(None))
@@ -1,12 +1,365 @@
+import hashlib
+import os
+import shutil
 import subprocess
+import sys
+import threading
 import traceback
+from functools import lru_cache
 from os import path
 
+from gostep.consts import GOSTEP_CACHE_DIR, BUILDS_CACHE_DIR, BUILD_CACHE_FORMAT, JAVA_BUILD_OUTPUT, \
+    MAVEN_BUILD_COMMAND, MAVEN_OFFLINE_FLAG, DEPENDENCIES_CACHE_DIR, VENDOR_FORMAT, PYTHON_RUNTIME, NODE_RUNTIME, \
+    PYTHON_LOCKFILE, NODE_LOCKFILE, NODE_PACKAGE_FILE, NODE_MODULES_DIR, PIP_PLATFORM, DEPENDENCIES_DIR, \
+    DEPENDENCIES_PREFIX, DEPENDENCIES_KEY, EXCLUDED_FILES, BUILD_IGNORE_PATTERNS, BUILD_CACHE_MAX_ENTRIES, \
+    DEPENDENCIES_CACHE_MAX_ENTRIES
+from gostep.hashing import get_file_digest
+from gostep.hashing import get_tree_digest
+from gostep.ignore import IgnoreMatcher
+from gostep.tracing import span, traced
 
-def build_java_project(service_workspace):
+build_cache_stats = {'hits': 0, 'misses': 0}
+build_cache_lock = threading.Lock()
+dependency_locks = {}
+build_ignore_matcher = IgnoreMatcher(BUILD_IGNORE_PATTERNS)
+
+
+@lru_cache(maxsize=None)
+def get_jdk_version():
+    """
+        Returns the version line of the JDK used by Maven.
+
+            Returns:
+                jdk_version (string): output of java -version, 'unknown' if it is not available
+    """
+    try:
+        result = subprocess.run(['java', '-version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return result.stdout.decode().strip().split('\n')[0]
+    except OSError:
+        return 'unknown'
+
+
+def get_build_key(service_workspace, manifest_file=None):
+    """
+        Returns the build cache key of a Java project, derived from its sources,
+        pom.xml and the JDK version.
+
+            Parameters:
+                service_workspace (string): path to the Java project
+                manifest_file (string): path to the file manifest of the project sources
+
+            Returns:
+                build_key (string): build cache key
+    """
+    sources_digest = get_tree_digest(service_workspace, manifest_file, build_ignore_matcher)
+    return hashlib.sha256('\n'.join([
+        BUILD_CACHE_FORMAT, sources_digest, get_jdk_version(), MAVEN_BUILD_COMMAND]).encode()).hexdigest()
+
+
+def record_build_cache(hit):
+    """
+        Counts a build cache hit or miss.
+
+            Parameters:
+                hit (boolean): true, if the build outputs have been reused
+    """
+    with build_cache_lock:
+        build_cache_stats['hits' if hit else 'misses'] += 1
+
+
+def get_build_cache_stats():
+    """
+        Returns the build cache hit and miss counts of the process.
+
+            Returns:
+                stats (dictionary): hits and misses
+    """
+    with build_cache_lock:
+        return dict(build_cache_stats)
+
+
+def touch_cache_entry(entry_dir):
+    """
+        Marks a cache entry as used, so it is pruned last.
+
+            Parameters:
+                entry_dir (string): path to the cache entry
+    """
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+
+
+def prune_cache(cache_dir, max_entries, keep=None):
+    """
+        Removes the least recently used entries of a cache beyond a number of
+        entries. Entries are moved aside before they are deleted, so a partly
+        deleted entry is never taken for a cache hit.
+
+            Parameters:
+                cache_dir (string): path to the cache
+                max_entries (int): number of entries to keep
+                keep (string): path to an entry which is not removed
+    """
+    try:
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.is_dir(follow_symlinks=False) and not entry.name.endswith('.tmp') and entry.path != keep:
+                entries.append((entry.stat(follow_symlinks=False).st_mtime, entry.path))
+        entries.sort(reverse=True)
+        for _, entry_dir in entries[max(0, max_entries - (0 if keep is None else 1)):]:
+            removed_dir = '%s.%d.%d.tmp' % (entry_dir, os.getpid(), threading.get_ident())
+            try:
+                os.rename(entry_dir, removed_dir)
+            except OSError:
+                continue
+            shutil.rmtree(removed_dir, ignore_errors=True)
+    except OSError:
+        print(traceback.format_exc())
+
+
+@traced('maven')
+def run_maven(service_workspace):
+    """
+        Runs an incremental Maven build, offline against the local repository
+        first and online only if dependencies are missing there.
+
+            Parameters:
+                service_workspace (string): path to the Java project
+
+            Returns:
+                succeeded (boolean): true, if the build has been succeeded
+    """
+    for command in [' '.join([MAVEN_BUILD_COMMAND, MAVEN_OFFLINE_FLAG]), MAVEN_BUILD_COMMAND]:
+        result = subprocess.run(command, shell=True, cwd=service_workspace, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        if result.returncode == 0:
+            return True
+    print(result.stdout.decode())
+    return False
+
+
+def get_build_dir(service_workspace, manifest_file=None):
+    """
+        Returns where the build cache keeps the outputs of a Java project for
+        its current sources.
+
+            Parameters:
+                service_workspace (string): path to the Java project
+                manifest_file (string): path to the file manifest of the project sources
+
+            Returns:
+                build_dir (string): path to the outputs in the build cache, which may not exist yet
+    """
+    with span('build_key'):
+        build_key = get_build_key(service_workspace, manifest_file)
+    return path.join(GOSTEP_CACHE_DIR, BUILDS_CACHE_DIR, build_key)
+
+
+def build_java_project(service_workspace, manifest_file=None):
+    """
+        Builds a Java project and returns the path of its deployable outputs.
+        Outputs are kept in the build cache and reused while the sources,
+        pom.xml and the JDK version are unchanged. Outputs of earlier builds
+        are removed first, so files which are no longer built are not cached.
+
+            Parameters:
+                service_workspace (string): path to the Java project
+                manifest_file (string): path to the file manifest of the project sources
+
+            Returns:
+                build_dir (string): path to the deployable outputs in the build cache
+    """
+    try:
+        build_dir = get_build_dir(service_workspace, manifest_file)
+        if path.exists(build_dir):
+            record_build_cache(True)
+            touch_cache_entry(build_dir)
+            print('Build cache hit for %s' % service_workspace)
+            return build_dir
+        record_build_cache(False)
+        print('Build cache miss for %s, building with Maven...' % service_workspace)
+        shutil.rmtree(path.join(service_workspace, JAVA_BUILD_OUTPUT), ignore_errors=True)
+        if not run_maven(service_workspace):
+            print('Maven build has been failed for %s' % service_workspace)
+            return None
+        temp_dir = '%s.%d.%d.tmp' % (build_dir, os.getpid(), threading.get_ident())
+        shutil.copytree(path.join(service_workspace, JAVA_BUILD_OUTPUT), temp_dir)
+        try:
+            os.rename(temp_dir, build_dir)
+        except OSError:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        touch_cache_entry(build_dir)
+        prune_cache(path.dirname(build_dir), BUILD_CACHE_MAX_ENTRIES, build_dir)
+        return build_dir
+    except Exception:
+        print(traceback.format_exc())
+
+
+def get_dependency_lock(dependency_key):
+    """
+        Returns the lock guarding the installation of a dependency tree, so
+        services sharing a lockfile install it only once.
+
+            Parameters:
+                dependency_key (string): dependency cache key
+
+            Returns:
+                lock (Lock): lock of the dependency tree
+    """
+    with build_cache_lock:
+        return dependency_locks.setdefault(dependency_key, threading.Lock())
+
+
+def get_dependency_key(lockfile, runtime):
+    """
+        Returns the dependency cache key of a lockfile for a runtime.
+
+            Parameters:
+                lockfile (string): path to the lockfile
+                runtime (string): runtime environment
+
+            Returns:
+                dependency_key (string): dependency cache key
+    """
+    return hashlib.sha256('\n'.join([VENDOR_FORMAT, runtime, get_file_digest(lockfile)]).encode()).hexdigest()
+
+
+def install_python_dependencies(service_workspace, runtime, target_dir):
+    """
+        Installs the requirements of a Python service into a directory with
+        wheels built for the Cloud Functions platform.
+
+            Parameters:
+                service_workspace (string): path to the Python service
+                runtime (string): runtime environment, such as python38
+                target_dir (string): installation target
+
+            Returns:
+                succeeded (boolean): true, if the installation has been succeeded
+    """
+    python_version = '.'.join([runtime[len(PYTHON_RUNTIME)], runtime[len(PYTHON_RUNTIME) + 1:]])
+    result = subprocess.run([
+        sys.executable, '-m', 'pip', 'install', '--quiet', '--no-compile', '--target', target_dir,
+        '--platform', PIP_PLATFORM, '--implementation', 'cp', '--python-version', python_version,
+        '--only-binary=:all:', '--requirement', path.join(service_workspace, PYTHON_LOCKFILE)
+    ], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        print(result.stdout.decode())
+    return result.returncode == 0
+
+
+def install_node_dependencies(service_workspace, target_dir):
+    """
+        Installs the production dependencies of a Node.js service into
+        node_modules of a directory.
+
+            Parameters:
+                service_workspace (string): path to the Node.js service
+                target_dir (string): installation target
+
+            Returns:
+                succeeded (boolean): true, if the installation has been succeeded
+    """
+    os.makedirs(target_dir)
+    command = ['npm', 'install', '--production', '--no-audit', '--no-fund']
+    for file_name in [NODE_PACKAGE_FILE, NODE_LOCKFILE]:
+        if path.exists(path.join(service_workspace, file_name)):
+            shutil.copy2(path.join(service_workspace, file_name), target_dir)
+            if file_name == NODE_LOCKFILE:
+                command = ['npm', 'ci', '--production', '--no-audit', '--no-fund']
+    result = subprocess.run(command, cwd=target_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    if result.returncode != 0:
+        print(result.stdout.decode())
+    return result.returncode == 0
+
+
+def get_dependencies(service_workspace, runtime):
+    """
+        Returns the tree where the dependency cache keeps the dependencies of a
+        Python or Node.js service, without installing them.
+
+            Parameters:
+                service_workspace (string): path to the service
+                runtime (string): runtime environment
+
+            Returns:
+                dependencies (dictionary): cached tree, which may not exist yet,
+                its archive prefix and key and the files to be left out of the
+                archive, None if the service has nothing to vendor
+    """
+    if runtime.startswith(PYTHON_RUNTIME):
+        lockfile = path.join(service_workspace, PYTHON_LOCKFILE)
+        prefix = ''
+        excluded_files = [PYTHON_LOCKFILE]
+    elif runtime.startswith(NODE_RUNTIME):
+        lockfile = path.join(service_workspace, NODE_LOCKFILE)
+        if not path.exists(lockfile):
+            lockfile = path.join(service_workspace, NODE_PACKAGE_FILE)
+        prefix = ''.join([NODE_MODULES_DIR, '/'])
+        excluded_files = []
+    else:
+        return None
+    if not path.exists(lockfile):
+        return None
+    dependency_key = get_dependency_key(lockfile, runtime)
+    return {
+        DEPENDENCIES_DIR: path.join(GOSTEP_CACHE_DIR, DEPENDENCIES_CACHE_DIR, dependency_key),
+        DEPENDENCIES_PREFIX: prefix,
+        DEPENDENCIES_KEY: dependency_key,
+        EXCLUDED_FILES: excluded_files
+    }
+
+
+@traced('vendor')
+def vendor_dependencies(service_workspace, runtime):
+    """
+        Resolves the dependencies of a Python or Node.js service into the
+        dependency cache and returns the tree to be included in its archive.
+        Trees are keyed by the lockfile and the runtime, so they are shared
+        between services and reused across deployments.
+
+            Parameters:
+                service_workspace (string): path to the service
+                runtime (string): runtime environment
+
+            Returns:
+                dependencies (dictionary): cached tree, its archive prefix and key
+                and the files to be left out of the archive, None if the service
+                has nothing to vendor or the installation has been failed
+    """
     try:
-        result = subprocess.check_output('mvn clean package', shell=True, cwd=service_workspace)
-        if 'Finished' in str(result):
-            return path.join(service_workspace, 'target/deploy')
+        dependencies = get_dependencies(service_workspace, runtime)
+        if dependencies is None:
+            return None
+        dependency_dir = dependencies[DEPENDENCIES_DIR]
+        with get_dependency_lock(dependencies[DEPENDENCIES_KEY]):
+            if path.exists(dependency_dir):
+                touch_cache_entry(dependency_dir)
+                print('Dependency cache hit for %s' % service_workspace)
+            else:
+                print('Dependency cache miss for %s, installing dependencies...' % service_workspace)
+                temp_dir = '%s.%d.%d.tmp' % (dependency_dir, os.getpid(), threading.get_ident())
+                os.makedirs(path.dirname(dependency_dir), exist_ok=True)
+                if runtime.startswith(PYTHON_RUNTIME):
+                    installed = install_python_dependencies(service_workspace, runtime, temp_dir)
+                    installed_dir = temp_dir
+                else:
+                    installed = install_node_dependencies(service_workspace, temp_dir)
+                    installed_dir = path.join(temp_dir, NODE_MODULES_DIR)
+                if installed:
+                    os.makedirs(installed_dir, exist_ok=True)
+                    try:
+                        os.rename(installed_dir, dependency_dir)
+                    except OSError:
+                        pass
+                shutil.rmtree(temp_dir, ignore_errors=True)
+                if not installed:
+                    print('Dependency installation has been failed for %s, '
+                          'dependencies will be installed remotely.' % service_workspace)
+                    return None
+                prune_cache(path.dirname(dependency_dir), DEPENDENCIES_CACHE_MAX_ENTRIES, dependency_dir)
+        return dependencies
     except Exception:
         print(traceback.format_exc())
@@ -0,0 +1,286 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZIP_STORED, ZIP_DEFLATED, ZIP64_LIMIT, ZipInfo
+
+from gostep.consts import COMPRESSION_LEVEL, COMPRESSION_WORKERS, COMPRESSION_SAMPLE_SIZE, COMPRESSION_SAMPLE_RATIO, \
+    COMPRESSION_BUFFER_SIZE, STORED_EXTENSIONS, PIPE_CHUNK_SIZE, ZIP_RAW_ENTRIES_MAX_VERSION, \
+    ZIP_RAW_ENTRIES_ATTRIBUTES
+
+compression_settings = {'level': COMPRESSION_LEVEL}
+compression_lock = threading.Lock()
+
+
+def set_compression_level(level):
+    """
+        Sets the deflate level used for source archives.
+
+            Parameters:
+                level (int): deflate level from 0 to 9, 0 stores every file
+    """
+    if level < 0 or level > 9:
+        raise ValueError('Compression level must be between 0 and 9.')
+    with compression_lock:
+        compression_settings['level'] = level
+
+
+def get_compression_level():
+    """
+        Returns the deflate level used for source archives.
+
+            Returns:
+                level (int): deflate level
+    """
+    with compression_lock:
+        return compression_settings['level']
+
+
+def get_compress_type(file_path, level):
+    """
+        Chooses the compression method of a file. Files of compressed formats
+        and files whose leading sample does not shrink are stored as they are.
+
+            Parameters:
+                file_path (string): path to file
+                level (int): deflate level
+
+            Returns:
+                compress_type (int): ZIP_STORED or ZIP_DEFLATED
+    """
+    if level == 0 or os.path.splitext(file_path)[1].lower() in STORED_EXTENSIONS:
+        return ZIP_STORED
+    with open(file_path, 'rb') as file_object:
+        sample = file_object.read(COMPRESSION_SAMPLE_SIZE)
+    if len(sample) == 0 or len(zlib.compress(sample, 1)) > len(sample) * COMPRESSION_SAMPLE_RATIO:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def compress_file(file_path, compress_type, level):
+    """
+        Compresses a file with raw deflate into a buffer, kept in memory up to
+        a size limit and spilled to disk above it. Stored files are only
+        scanned for their crc and size, they are copied into the archive from
+        the file itself.
+
+            Parameters:
+                file_path (string): path to file
+                compress_type (int): ZIP_STORED or ZIP_DEFLATED
+                level (int): deflate level
+
+            Returns:
+                compressed (dictionary): compress type, crc, file size, compressed
+                size, file path and the buffer positioned at its start, None
+                for stored files
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15) if compress_type == ZIP_DEFLATED else None
+    buffer = tempfile.SpooledTemporaryFile(max_size=COMPRESSION_BUFFER_SIZE) if compressor is not None else None
+    crc = 0
+    file_size = 0
+    with open(file_path, 'rb') as file_object:
+        chunk = file_object.read(PIPE_CHUNK_SIZE)
+        while chunk:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            if compressor is not None:
+                buffer.write(compressor.compress(chunk))
+            chunk = file_object.read(PIPE_CHUNK_SIZE)
+    if compressor is not None:
+        buffer.write(compressor.flush())
+        compress_size = buffer.tell()
+        buffer.seek(0)
+    else:
+        compress_size = file_size
+    return {
+        'compress_type': compress_type,
+        'crc': crc,
+        'file_size': file_size,
+        'compress_size': compress_size,
+        'file_path': file_path,
+        'buffer': buffer
+    }
+
+
+def copy_stored_file(compressed, target):
+    """
+        Copies a stored file into an archive, checking that it has not been
+        changed since its crc and size were taken.
+
+            Parameters:
+                compressed (dictionary): output of compress_file for a stored file
+                target (file): archive file object positioned after the entry header
+    """
+    crc = 0
+    file_size = 0
+    with open(compressed['file_path'], 'rb') as file_object:
+        chunk = file_object.read(PIPE_CHUNK_SIZE)
+        while chunk:
+            crc = zlib.crc32(chunk, crc)
+            file_size += len(chunk)
+            target.write(chunk)
+            chunk = file_object.read(PIPE_CHUNK_SIZE)
+    if crc != compressed['crc'] or file_size != compressed['file_size']:
+        raise RuntimeError('%s has been changed while it was archived.' % compressed['file_path'])
+
+
+def compress_entry(file_path, level):
+    """
+        Compresses a file with the method chosen for it, falling back to
+        storing it when deflate does not make it smaller.
+
+            Parameters:
+                file_path (string): path to file
+                level (int): deflate level
+
+            Returns:
+                compressed (dictionary): output of compress_file
+    """
+    compressed = compress_file(file_path, get_compress_type(file_path, level), level)
+    if compressed['compress_type'] == ZIP_DEFLATED and compressed['compress_size'] >= compressed['file_size']:
+        compressed['buffer'].close()
+        compressed = dict(compressed, compress_type=ZIP_STORED, compress_size=compressed['file_size'], buffer=None)
+    return compressed
+
+
+def raw_entries_supported(compressed_file):
+    """
+        Find that already compressed entries can be appended to a zip archive.
+        This goes through ZipFile internals, so it is only done on the Python
+        versions it has been checked against and while those internals exist.
+
+            Parameters:
+                compressed_file (ZipFile): zip archive opened for writing
+
+            Returns:
+                supported (boolean): true, if write_compressed_entry can be used
+    """
+    return sys.version_info[:2] <= ZIP_RAW_ENTRIES_MAX_VERSION and hasattr(ZipInfo, 'FileHeader') and \
+        all(hasattr(compressed_file, attribute) for attribute in ZIP_RAW_ENTRIES_ATTRIBUTES)
+
+
+def write_opened_entry(compressed_file, entry, file_path, level):
+    """
+        Appends a file to a zip archive opened for writing through
+        ZipFile.open, compressing it while it is written.
+
+            Parameters:
+                compressed_file (ZipFile): zip archive opened for writing
+                entry (ZipInfo): entry with its name, date and permissions set
+                file_path (string): path to file
+                level (int): deflate level
+
+            Returns:
+                compressed (dictionary): compress type, crc, file size and compressed size
+    """
+    entry.compress_type = get_compress_type(file_path, level)
+    setattr(entry, 'compress_level' if hasattr(ZipInfo, 'compress_level') else '_compresslevel', level)
+    entry.file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as file_object, compressed_file.open(entry, 'w') as entry_object:
+        shutil.copyfileobj(file_object, entry_object, PIPE_CHUNK_SIZE)
+    return {
+        'compress_type': entry.compress_type,
+        'crc': entry.CRC,
+        'file_size': entry.file_size,
+        'compress_size': entry.compress_size
+    }
+
+
+def write_compressed_entry(compressed_file, entry, compressed):
+    """
+        Appends an already compressed entry to a zip archive opened for
+        writing. Only used where raw_entries_supported holds.
+
+            Parameters:
+                compressed_file (ZipFile): zip archive opened for writing
+                entry (ZipInfo): entry with its name, date and permissions set
+                compressed (dictionary): output of compress_entry
+    """
+    entry.compress_type = compressed['compress_type']
+    entry.CRC = compressed['crc']
+    entry.file_size = compressed['file_size']
+    entry.compress_size = compressed['compress_size']
+    zip64 = entry.file_size > ZIP64_LIMIT or entry.compress_size > ZIP64_LIMIT
+    compressed_file._writecheck(entry)
+    entry.header_offset = compressed_file.fp.tell()
+    compressed_file.fp.write(entry.FileHeader(zip64))
+    if compressed['buffer'] is None:
+        copy_stored_file(compressed, compressed_file.fp)
+    else:
+        with compressed['buffer'] as buffer:
+            shutil.copyfileobj(buffer, compressed_file.fp, PIPE_CHUNK_SIZE)
+    compressed_file.filelist.append(entry)
+    compressed_file.NameToInfo[entry.filename] = entry
+    compressed_file.start_dir = compressed_file.fp.tell()
+    compressed_file._didModify = True
+
+
+def write_entries(compressed_file, entries, level=None):
+    """
+        Compresses files on a pool of workers and writes them into a zip
+        archive in the given order. Only a few compressed entries are held
+        at a time. Where already compressed entries can not be appended, files
+        are compressed one after another through ZipFile.open instead.
+
+            Parameters:
+                compressed_file (ZipFile): zip archive opened for writing
+                entries (list): list of (ZipInfo, file path) tuples
+                level (int): deflate level, None for the configured level
+
+            Returns:
+                stats (dictionary): files, bytes in, bytes out and seconds spent
+    """
+    level = get_compression_level() if level is None else level
+    started_at = time.time()
+    stats = {'files': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0}
+    if not raw_entries_supported(compressed_file):
+        for entry, file_path in entries:
+            compressed = write_opened_entry(compressed_file, entry, file_path, level)
+            stats['files'] += 1
+            stats['bytes_in'] += compressed['file_size']
+            stats['bytes_out'] += compressed['compress_size']
+        stats['seconds'] = time.time() - started_at
+        return stats
+    with ThreadPoolExecutor(max_workers=COMPRESSION_WORKERS) as executor:
+        pending = deque()
+
+        def write_next():
+            entry, future = pending.popleft()
+            compressed = future.result()
+            write_compressed_entry(compressed_file, entry, compressed)
+            stats['files'] += 1
+            stats['bytes_in'] += compressed['file_size']
+            stats['bytes_out'] += compressed['compress_size']
+
+        try:
+            for entry, file_path in entries:
+                pending.append((entry, executor.submit(compress_entry, file_path, level)))
+                if len(pending) >= COMPRESSION_WORKERS * 2:
+                    write_next()
+            while len(pending) != 0:
+                write_next()
+        finally:
+            for entry, future in pending:
+                future.cancel()
+    stats['seconds'] = time.time() - started_at
+    return stats
+
+
+def describe_compression(stats):
+    """
+        Returns a line describing the outcome of compressing an archive.
+
+            Parameters:
+                stats (dictionary): output of write_entries
+
+            Returns:
+                description (string): files, sizes, ratio and time spent
+    """
+    ratio = 100.0 * stats['bytes_out'] / stats['bytes_in'] if stats['bytes_in'] != 0 else 100.0
+    return '%d files, %d bytes in, %d bytes out (%.1f%%) in %.2fs' % (
+        stats['files'], stats['bytes_in'], stats['bytes_out'], ratio, stats['seconds'])
@@ -1,8 +1,27 @@
+from os import path, environ, name as os_name
+
 GOSTEP_VERSION = 'v0.1.0beta'
 
 GCLOUD_STORAGE_CLASS = 'STANDARD'
 FUNCTIONS_API = 'cloudfunctions'
 FUNCTIONS_API_VERSION = 'v1'
+DISCOVERY_CACHE_TTL = 86400
+API_ROOT_URL_ENV = 'GOSTEP_API_ROOT_URL'
+RESOURCE_MANAGER_API = 'cloudresourcemanager'
+RESOURCE_MANAGER_API_VERSION = 'v1'
+IAM_API = 'iam'
+IAM_API_VERSION = 'v1'
+SERVICE_ACCOUNT_ROLE = 'roles/editor'
+SERVICE_ACCOUNT_KEY_TYPE = 'TYPE_GOOGLE_CREDENTIALS_FILE'
+IAM_POLICY_ATTEMPTS = 5
+GCLOUD_CONFIG_ENV = 'CLOUDSDK_CONFIG'
+GCLOUD_PROJECT_ENV = 'CLOUDSDK_CORE_PROJECT'
+GCLOUD_ACTIVE_CONFIG_ENV = 'CLOUDSDK_ACTIVE_CONFIG_NAME'
+GCLOUD_CONFIG_DIR = path.join(environ['APPDATA'], 'gcloud') if os_name == 'nt' and 'APPDATA' in environ else \
+    path.join(path.expanduser('~'), '.config', 'gcloud')
+GCLOUD_ACTIVE_CONFIG_FILE = 'active_config'
+GCLOUD_CONFIGURATIONS_DIR = 'configurations'
+GCLOUD_DEFAULT_CONFIG = 'default'
 SERVICE_ENTRY_POINT = 'main'
 ENVIRONMENTS = [
     'python',
@@ -19,6 +38,110 @@ TEMPLATE_DIRECTORY = 'templates'
 BUILD_DIR = '../build'
 GOSTEP_IGNORE_FILE = '.gostepignore'
 GOSTEP_BUCKET = 'gostep'
+GOSTEP_CACHE_DIR = path.join(path.expanduser('~'), '.cache', 'gostep')
+DISCOVERY_CACHE_DIR = 'discovery'
+KNOWN_BUCKETS_FILE = 'buckets.json'
+METADATA_CACHE_FILE = 'metadata.json'
+PROJECTS_METADATA = 'projects'
+LOCATIONS_METADATA = 'locations'
+SERVICE_ACCOUNTS_METADATA = 'service_accounts'
+METADATA_TTLS = {
+    PROJECTS_METADATA: 86400,
+    LOCATIONS_METADATA: 604800,
+    SERVICE_ACCOUNTS_METADATA: 3600
+}
+TEMPLATES_CACHE_DIR = 'templates'
+TEMPLATES_INDEX_FILE = 'index.json'
+TEMPLATE_REFRESH_INTERVAL = 3600
+TEMPLATE_FETCH_WORKERS = 8
+FICLONE = 0x40049409
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+INOTIFY_READ_SIZE = 65536
+WATCH_DEBOUNCE = 0.5
+WATCH_MAX_DELAY = 5.0
+WATCH_POLL_INTERVAL = 1.0
+BUILDS_CACHE_DIR = 'builds'
+BUILD_CACHE_MAX_ENTRIES = 32
+BUILD_CACHE_FORMAT = 'maven-v1'
+JAVA_BUILD_OUTPUT = 'target/deploy'
+BUILD_IGNORE_PATTERNS = ['/target/']
+MAVEN_BUILD_COMMAND = 'mvn --batch-mode package'
+MAVEN_OFFLINE_FLAG = '--offline'
+DEPENDENCIES_CACHE_DIR = 'dependencies'
+DEPENDENCIES_CACHE_MAX_ENTRIES = 16
+VENDOR_FORMAT = 'vendor-v1'
+PYTHON_RUNTIME = 'python'
+NODE_RUNTIME = 'nodejs'
+PYTHON_LOCKFILE = 'requirements.txt'
+NODE_LOCKFILE = 'package-lock.json'
+NODE_PACKAGE_FILE = 'package.json'
+NODE_MODULES_DIR = 'node_modules'
+PIP_PLATFORM = 'manylinux2014_x86_64'
+DEPENDENCIES_DIR = 'dir'
+DEPENDENCIES_PREFIX = 'prefix'
+DEPENDENCIES_KEY = 'key'
+EXCLUDED_FILES = 'excluded'
+DEPLOY_TIMEOUT = 3600
+GOSTEP_STATE_DIR = '.gostep'
+MANIFESTS_DIR = 'manifests'
+SERVICES_STATE_DIR = 'services'
+STATE_INDEX_FILE = 'index.json'
+STATE_LOCK_FILE = 'state.lock'
+STATE_VERSION = 1
+STATE_GITIGNORE_FILE = '.gitignore'
+STATE_IGNORED_PATTERNS = ['/' + STATE_LOCK_FILE, '/' + MANIFESTS_DIR + '/', '*.tmp']
+MANIFEST_VERSION = 1
+MTIME_GRANULARITY = 2000000000
+HASH_CHUNK_SIZE = 1048576
+LARGE_FILE_SIZE = 1048576
+HASH_WORKERS = 4
+PIPE_CHUNK_SIZE = 1048576
+COMPRESSION_LEVEL = 6
+COMPRESSION_WORKERS = 4
+COMPRESSION_SAMPLE_SIZE = 65536
+COMPRESSION_SAMPLE_RATIO = 0.9
+COMPRESSION_BUFFER_SIZE = 8388608
+ZIP_RAW_ENTRIES_MAX_VERSION = (3, 13)
+ZIP_RAW_ENTRIES_ATTRIBUTES = ['_writecheck', 'fp', 'start_dir', 'filelist', 'NameToInfo', '_didModify']
+STORED_EXTENSIONS = [
+    '.7z', '.br', '.bz2', '.ear', '.egg', '.gif', '.gz', '.jar', '.jpeg', '.jpg', '.mp3', '.mp4', '.pdf', '.png',
+    '.tgz', '.war', '.webp', '.whl', '.woff', '.woff2', '.xz', '.zip', '.zst'
+]
+PIPE_MAX_CHUNKS = 16
+PIPE_POLL_INTERVAL = 0.5
+UPLOAD_CHUNK_SIZE = 8388608
+COMPOSITE_UPLOAD_THRESHOLD = 157286400
+COMPOSITE_SLICE_SIZE = 33554432
+COMPOSITE_MAX_COMPONENTS = 32
+COMPOSITE_UPLOAD_WORKERS = 8
+REGION_DEPLOY_WORKERS = 8
+COMPOSITE_SLICES_PREFIX = 'uploads/'
+ARCHIVE_CONTENT_TYPE = 'application/zip'
+ARCHIVE_FORMAT = 'zip-v3'
+ARCHIVE_EXCLUDED_PATTERNS = ['/' + SERVICE_CONFIG_FILE]
+DEPLOYMENT_SPEC_FIELDS = ['name', 'sourceArchiveUrl']
+ARCHIVE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+ARCHIVE_FILE_MODE = 0o100644
+ARCHIVE_EXECUTABLE_MODE = 0o100755
+SOURCE_ARCHIVES_PREFIX = 'sources/'
+OPERATION_POLL_INITIAL_DELAY = 2.0
+OPERATION_POLL_MAX_DELAY = 30.0
+OPERATION_MAX_LOOKUP_FAILURES = 5
+BATCH_SIZE = 100
+INVENTORY_FIELDS = 'functions(name,status,sourceArchiveUrl,updateTime,versionId),nextPageToken'
 
 SERVICES = 'services'
 TEMPLATES = 'templates'
@@ -33,11 +156,14 @@ SOURCE_DIRECTORY = 'source_dir'
 SOURCE_ARCHIVE = 'source_archive'
 LOCATION_NAME = 'location_name'
 LOCATION_ID = 'location_id'
+LOCATION_IDS = 'location_ids'
+GIT_COMMIT = 'git_commit'
 DEFAULT_LOCATION = 'default_location'
 KIND = 'kind'
 PROJECT_ID = 'project_id'
 SERVICE_ACCOUNT_EMAIL = 'service_account_email'
 CHECKSUM = 'checksum'
+STATE_MANAGED_FIELDS = [CHECKSUM, GIT_COMMIT, SOURCE_ARCHIVE]
 TRIGGER = 'trigger'
 HTTP = 'http'
 HTTPS_TRIGGER_KEY = 'httpsTrigger'
@@ -46,6 +172,21 @@ EVENT_TYPE = 'eventType'
 EVENT_TYPE_PUBSUB = 'cloud.pubsub'
 EVENT_TYPE_STORAGE = 'cloud.storage'
 RESOURCE = 'resource'
+OPERATION = 'operation'
+STARTED_AT = 'started_at'
+REGIONS = 'regions'
+DONE = 'done'
+ERROR = 'error'
+RESPONSE = 'response'
+LATENCY = 'latency'
+SERVICE = 'service'
+CHANGED = 'changed'
+ACTION = 'action'
+IAM_BINDING = 'iam_binding'
+SOURCE_SIZE = 'source_size'
+CREATE_ACTION = 'create'
+PATCH_ACTION = 'patch'
+NO_ACTION = 'none'
 VALIDATION_MESSAGES = 'msgs'
 REQUIRED_FIELDS = 'required'
 TYPE = 'type'
@@ -72,7 +213,20 @@ COMMANDS = [
     'gcloud',
     'trigger',
     'allow-all',
-    'version'
+    'version',
+    'jobs',
+    'timeout',
+    'stream',
+    'wait',
+    'offline',
+    'vendor',
+    'level',
+    'json',
+    'trace',
+    'profile',
+    'refresh',
+    'git',
+    'regions'
 ]
 
 CMD_BRANCHES = [
@@ -169,10 +323,44 @@ CMD_TREE = {
             'Error: Invalid command.\nUsage:',
             '  gostep deploy diff',
             '    Optional args:\n'
-            '        inside <workspace directory>'
+            '        inside <workspace directory>\n'
+            '        jobs <number of parallel deployments>\n'
+            '        timeout <deadline in seconds>\n'
+            '        level <compression level 0-9>\n'
+            '        stream\n'
+            '        vendor\n'
+            '        wait\n'
+            '        git\n'
+            '        trace <trace file>\n'
+            '        profile <profile file>',
+            '  gostep deploy watch',
+            '    Optional args:\n'
+            '        inside <workspace directory>\n'
+            '        jobs <number of parallel deployments>\n'
+            '        timeout <deadline of each cycle in seconds>\n'
+            '        level <compression level 0-9>\n'
+            '        stream\n'
+            '        vendor\n'
+            '        wait',
+            '  gostep deploy plan',
+            '    Optional args:\n'
+            '        inside <workspace directory>\n'
+            '        jobs <number of services hashed in parallel>\n'
+            '        json\n'
+            '        vendor\n'
+            '        git\n'
+            '        trace <trace file>',
             '  gostep deploy <service name>',
             '    Optional args:\n'
-            '        inside <workspace directory>'
+            '        inside <workspace directory>\n'
+            '        location <gcloud region id>\n'
+            '        regions <comma separated gcloud region ids, kept for later deployments>\n'
+            '        level <compression level 0-9>\n'
+            '        stream\n'
+            '        vendor\n'
+            '        wait\n'
+            '        trace <trace file>\n'
+            '        profile <profile file>'
         ]
     },
     'gcloud': {
@@ -189,12 +377,18 @@ CMD_TREE = {
                 'locations': {
                     TYPE: BOOLEAN
                 }
+            },
+            {
+                'refresh': {
+                    TYPE: BOOLEAN
+                }
             }
         ],
         VALIDATION_MESSAGES: [
             'Error: Invalid command.\nUsage:',
             '  gostep gcloud projects',
             '  gostep gcloud locations',
+            '  gostep gcloud refresh',
             '    Optional args:\n'
             '        inside <workspace directory>'
         ]
@@ -222,8 +416,10 @@ CMD_TREE = {
                 '        explains <project info>\n'
                 '        inside <workspace directory>\n'
                 '        location <gcloud region id>\n'
+                '        regions <comma separated gcloud region ids>\n'
                 '        version <project version>\n'
-                '        allow-all'
+                '        allow-all\n'
+                '        offline'
             ]
         },
         VALIDATION_MESSAGES: [
@@ -233,8 +429,10 @@ CMD_TREE = {
             '        explains <project info>\n'
             '        inside <workspace directory>\n'
             '        location <gcloud region id>\n'
+            '        regions <comma separated gcloud region ids>\n'
             '        version <project version>\n'
-            '        allow-all'
+            '        allow-all\n'
+            '        offline'
         ]
     },
     VALIDATION_MESSAGES: [
@@ -250,6 +448,7 @@ CMD_TREE = {
         '  gostep deploy <service name>',
         '  gostep gcloud locations',
         '  gostep gcloud projects',
+        '  gostep gcloud refresh',
         '  gostep service init <service name> env <runtime environment> trigger <function invoking type>'
     ]
 }
@@ -1,15 +1,22 @@
 import fileinput
+import hashlib
+import io
 import json
 import os
+import queue
 import shutil
-import subprocess
+import threading
 import traceback
 from pathlib import Path
-from zipfile import ZipFile
+from zipfile import ZipFile, ZipInfo
 
-import yaml
-
-from gostep.consts import GOSTEP_IGNORE_FILE
+from gostep.consts import FICLONE, PIPE_CHUNK_SIZE, PIPE_MAX_CHUNKS, PIPE_POLL_INTERVAL, \
+    ARCHIVE_FORMAT, ARCHIVE_DATE_TIME, ARCHIVE_FILE_MODE, ARCHIVE_EXECUTABLE_MODE, DEPENDENCIES_DIR, \
+    DEPENDENCIES_PREFIX, DEPENDENCIES_KEY, EXCLUDED_FILES, SERVICE_CONFIG_FILE, DEPLOYMENT_SPEC_FIELDS
+from gostep.compression import write_entries, get_compression_level, describe_compression
+from gostep.hashing import get_tree_digest, list_files
+from gostep.ignore import get_ignore_matcher, get_archive_matcher
+from gostep.tracing import span, count_bytes
 
 
 def get_all_files_dict(root_dir=os.getcwd()):
@@ -48,7 +55,7 @@ def get_dir(dir_name, root_path=os.getcwd()):
     try:
         dir_path = ''.join([root_path, '/', dir_name])
         if not os.path.exists(dir_path):
-            os.makedirs(dir_path)
+            os.makedirs(dir_path, exist_ok=True)
             print('Created directory %s' % dir_path)
         return dir_path
     except Exception:
@@ -87,7 +94,254 @@ def copy_dir(source, destination):
         print(traceback.format_exc())
 
 
-def create_compressed_file(name, config_dir, sources_dir, target_dir):
+def link_file(source, destination):
+    """
+        Links a file to a new path with a hardlink, or a reflink where the
+        files are on different devices, and copies it as a last resort.
+
+            Parameters:
+                source (string): source file path
+                destination (string): destination file path
+
+            Returns:
+                destination (string): destination file path
+    """
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return destination
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+            fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+        shutil.copystat(source, destination)
+        return destination
+    except (ImportError, OSError):
+        return shutil.copy2(source, destination)
+
+
+def link_dir(source, destination):
+    """
+        Materializes a directory tree with linked files instead of copies.
+
+            Parameters:
+                source (string): source containing root directory path
+                destination (string): target root directory path
+
+            Returns:
+                destination (string): linked destination path
+    """
+    try:
+        shutil.copytree(source, destination, copy_function=link_file, dirs_exist_ok=True)
+        return destination
+    except Exception:
+        print(traceback.format_exc())
+
+
+class PipeWriter(object):
+    """
+        Writing end of a bounded in-memory pipe. Writes are grouped into chunks
+        and block while the pipe is full.
+    """
+
+    def __init__(self, pipe):
+        self.pipe = pipe
+        self.buffer = bytearray()
+        self.broken = False
+
+    def write(self, data):
+        if self.broken:
+            return len(data)
+        self.buffer.extend(data)
+        while len(self.buffer) >= PIPE_CHUNK_SIZE:
+            self.put(bytes(self.buffer[:PIPE_CHUNK_SIZE]))
+            del self.buffer[:PIPE_CHUNK_SIZE]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def put(self, item):
+        while True:
+            if self.pipe.reader.closed:
+                self.broken = True
+                raise BrokenPipeError('Reading end of the pipe has been closed.')
+            try:
+                self.pipe.chunks.put(item, timeout=PIPE_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        if len(self.buffer) != 0:
+            self.put(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.put(None)
+
+    def abort(self, error):
+        self.put(error)
+
+
+class PipeReader(io.RawIOBase):
+    """
+        Reading end of a bounded in-memory pipe. The last read block is kept,
+        so a reader can seek back to retry it.
+    """
+
+    def __init__(self, pipe):
+        super().__init__()
+        self.pipe = pipe
+        self.buffer = b''
+        self.position = 0
+        self.last_read = b''
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.pipe.chunks.get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk is None:
+                self.eof = True
+            else:
+                self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        payload = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        self.position += len(payload)
+        self.last_read = payload
+        return payload
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        if whence == io.SEEK_END or not self.position - len(self.last_read) <= offset <= self.position:
+            raise io.UnsupportedOperation('Pipe can only seek back within the last read block.')
+        rewind = self.position - offset
+        if rewind != 0:
+            self.buffer = self.last_read[len(self.last_read) - rewind:] + self.buffer
+            self.last_read = self.last_read[:len(self.last_read) - rewind]
+            self.position = offset
+        return self.position
+
+
+class Pipe(object):
+    """
+        Bounded in-memory pipe connecting a producer thread to a consumer.
+    """
+
+    def __init__(self, max_chunks=PIPE_MAX_CHUNKS):
+        self.chunks = queue.Queue(maxsize=max_chunks)
+        self.reader = PipeReader(self)
+        self.writer = PipeWriter(self)
+
+
+def get_archive_entries(config_dir, sources_dir, dependencies=None):
+    """
+        Returns the files of an archive with their names in the archive. Vendored
+        dependencies are placed under their prefix and sources take precedence
+        over them on a name collision. The function specification is left out,
+        the runtime does not read it.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+                sources_dir (string): source directory path
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
+
+            Returns:
+                entries (list): sorted list of (archive name, absolute path) tuples
+    """
+    entries = {}
+    excluded_files = []
+    if dependencies is not None:
+        excluded_files = dependencies[EXCLUDED_FILES]
+        for relative_path, file_path in list_files(dependencies[DEPENDENCIES_DIR]):
+            entries[''.join([dependencies[DEPENDENCIES_PREFIX], relative_path])] = file_path
+    for relative_path, file_path in list_files(sources_dir, get_archive_matcher(config_dir)):
+        if relative_path not in excluded_files:
+            entries[relative_path] = file_path
+    return sorted(entries.items())
+
+
+def get_sources_size(config_dir, sources_dir, dependencies=None):
+    """
+        Returns the total size of the files to be archived from a source
+        directory and vendored dependencies, before compression.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+                sources_dir (string): source directory path
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
+
+            Returns:
+                size (int): size in bytes
+    """
+    return sum(os.path.getsize(file_path)
+               for relative_path, file_path in get_archive_entries(config_dir, sources_dir, dependencies))
+
+
+def write_sources_to_archive(compressed_file, config_dir, sources_dir, dependencies=None):
+    """
+        Writes source files into a zip archive removing given list of files to
+        be ignored. Entries are sorted and timestamps and permissions are
+        normalized, so the same sources always give the same archive. Files are
+        compressed in parallel and already compressed formats are stored.
+
+            Parameters:
+                compressed_file (ZipFile): zip archive opened for writing
+                config_dir (string): path where gostep config files exists
+                sources_dir (string): source directory path
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
+
+            Returns:
+                stats (dictionary): files, bytes in, bytes out and seconds spent
+    """
+    entries = []
+    for relative_path, file_path in get_archive_entries(config_dir, sources_dir, dependencies):
+        file_stat = os.stat(file_path)
+        entry = ZipInfo(relative_path, ARCHIVE_DATE_TIME)
+        entry.create_system = 3
+        entry.external_attr = (ARCHIVE_EXECUTABLE_MODE if file_stat.st_mode & 0o111 else ARCHIVE_FILE_MODE) << 16
+        entries.append((entry, file_path))
+    return write_entries(compressed_file, entries)
+
+
+def get_archive_digest(config_dir, sources_dir, manifest_file=None, dependencies=None):
+    """
+        Returns the content digest of the archive built from a source directory
+        without building it.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+                sources_dir (string): source directory path
+                manifest_file (string): path to the file manifest of the directory
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
+
+            Returns:
+                digest (string): content digest of the archive
+    """
+    try:
+        tree_digest = get_tree_digest(sources_dir, manifest_file, get_archive_matcher(config_dir))
+        parts = [ARCHIVE_FORMAT, ':', str(get_compression_level()), ':', tree_digest]
+        if dependencies is not None:
+            parts.extend([':', dependencies[DEPENDENCIES_KEY], ':', dependencies[DEPENDENCIES_PREFIX], ':',
+                          ','.join(dependencies[EXCLUDED_FILES])])
+        return hashlib.sha256(''.join(parts).encode()).hexdigest()
+    except Exception:
+        print(traceback.format_exc())
+
+
+def create_compressed_file(name, config_dir, sources_dir, target_dir, dependencies=None):
     """
         Creates a compressed zip file removing given list of files to be
         ignored.
@@ -97,28 +351,75 @@ def create_compressed_file(name, config_dir, sources_dir, target_dir):
                 config_dir (string): path where gostep config files exists
                 sources_dir (string): source directory path
                 target_dir (string): target directory path
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
 
             Returns:
                 target_file_path (string): compressed file path
     """
     try:
         target_file_path = ''.join([target_dir, '/', name, '.zip'])
-        compressed_file = ZipFile(target_file_path, "w")
-        ignore_list = get_yaml_dict(GOSTEP_IGNORE_FILE, config_dir).split(' ')
-        for dir_name, sub_dirs, files in os.walk(sources_dir):
-            len_dir_path = len(dir_name)
-            for filename in files:
-                file_path = os.path.join(dir_name, filename)
-                if any(substring in file_path for substring in ignore_list):
-                    continue
-                compressed_file.write(file_path, file_path[len_dir_path:])
-        compressed_file.close()
-        print("Successfully created compressed file %s" % target_file_path)
+        with span('compress') as trace_args:
+            compressed_file = ZipFile(target_file_path, "w")
+            stats = write_sources_to_archive(compressed_file, config_dir, sources_dir, dependencies)
+            compressed_file.close()
+            trace_args.update(stats)
+        count_bytes('compress_in', stats['bytes_in'])
+        count_bytes('compress_out', stats['bytes_out'])
+        print("Successfully created compressed file %s: %s" % (target_file_path, describe_compression(stats)))
         return target_file_path
     except Exception:
         print(traceback.format_exc())
 
 
+def write_compressed_stream(config_dir, sources_dir, pipe_writer, dependencies=None):
+    """
+        Writes a compressed zip archive into the writing end of a pipe.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+                sources_dir (string): source directory path
+                pipe_writer (PipeWriter): writing end of the pipe
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
+    """
+    try:
+        with span('compress', streaming=True) as trace_args:
+            compressed_file = ZipFile(pipe_writer, "w")
+            stats = write_sources_to_archive(compressed_file, config_dir, sources_dir, dependencies)
+            compressed_file.close()
+            pipe_writer.close()
+            trace_args.update(stats)
+        count_bytes('compress_in', stats['bytes_in'])
+        count_bytes('compress_out', stats['bytes_out'])
+        print("Successfully compressed %s: %s" % (sources_dir, describe_compression(stats)))
+    except BrokenPipeError:
+        pass
+    except Exception as error:
+        try:
+            pipe_writer.abort(error)
+        except BrokenPipeError:
+            pass
+
+
+def open_compressed_stream(config_dir, sources_dir, dependencies=None):
+    """
+        Starts compressing sources in the background and returns a stream of
+        the zip archive. Memory use is bounded by the pipe size and nothing is
+        written to disk.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+                sources_dir (string): source directory path
+                dependencies (dictionary): vendored dependency tree, None for no dependencies
+
+            Returns:
+                archive_stream (PipeReader): readable stream of the zip archive
+    """
+    pipe = Pipe()
+    threading.Thread(target=write_compressed_stream, args=(config_dir, sources_dir, pipe.writer, dependencies),
+                     daemon=True).start()
+    return pipe.reader
+
+
 def write_to_file(file_name, dir_path, content):
     """
         Rewrite or create and write to file.
@@ -175,6 +476,7 @@ def get_yaml_dict(yaml_file, source_dir):
             Returns:
                 yaml_dict (dictionary): dictionary object
     """
+    import yaml
     try:
         with open(''.join([source_dir, '/', yaml_file])) as yaml_source:
             return yaml.load(yaml_source, Loader=yaml.FullLoader)
@@ -194,6 +496,7 @@ def build_yaml_file(yaml_file, source_dir, yaml_dict):
             Returns:
                 yaml_dict (dictionary): updated dictionary object
     """
+    import yaml
     try:
         with open(''.join([source_dir, '/', yaml_file]), 'w') as yaml_source:
             yaml.dump(yaml_dict, yaml_source)
@@ -219,6 +522,28 @@ def get_json_from_file(json_file):
         print(traceback.format_exc())
 
 
+def write_file_atomically(file_path, content):
+    """
+        Replaces a file atomically. The content is written to a temporary file
+        next to it, unique to the process and thread, which is then renamed
+        over the file.
+
+            Parameters:
+                file_path (string): path to file
+                content (string): file contents
+    """
+    temp_file = '%s.%d.%d.tmp' % (file_path, os.getpid(), threading.get_ident())
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    try:
+        with open(temp_file, 'w') as temp_file_object:
+            temp_file_object.write(content)
+        os.replace(temp_file, file_path)
+    except OSError:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+
+
 def rewrite_json_file(json_file, json_dict):
     """
         Reads and returns a JSON file as an dictionary object.
@@ -231,27 +556,53 @@ def rewrite_json_file(json_file, json_dict):
                 json_object (dictionary): updated json from file
     """
     try:
-        with open(json_file, 'w') as json_file_object:
-            json.dump(json_dict, json_file_object, indent=4)
+        write_file_atomically(json_file, json.dumps(json_dict, indent=4))
         return get_json_from_file(json_file)
     except Exception:
         print(traceback.format_exc())
 
 
-def get_checksum(dir_path):
+def get_checksum(dir_path, manifest_file=None):
     """
-        Reads and returns a md5 checksum of a directory.
+        Reads and returns a checksum of a directory, rehashing only the files
+        which have been changed since the previous scan.
 
             Parameters:
                 dir_path (string): path to directory
+                manifest_file (string): path to the file manifest of the directory
+
+            Returns:
+                checksum (string): checksum value of string
+    """
+    try:
+        return get_tree_digest(dir_path, manifest_file, get_ignore_matcher(dir_path))
+    except Exception:
+        print(traceback.format_exc())
+
+
+def get_service_digest(service_dir, manifest_file=None):
+    """
+        Returns a checksum of a service from the files going into its archive
+        and its function specification, leaving out the fields every deployment
+        rewrites.
+
+            Parameters:
+                service_dir (string): service directory path
+                manifest_file (string): path to the file manifest of the directory
 
             Returns:
                 checksum (string): checksum value of string
     """
     try:
-        print(dir_path)
-        cmd = ''.join(['tar c "', dir_path, '" | md5sum'])
-        result = subprocess.check_output(cmd, shell=True)
-        return result.decode().split()[0]
+        tree_digest = get_tree_digest(service_dir, manifest_file, get_archive_matcher(service_dir))
+        function_spec = {}
+        function_spec_file = os.path.join(service_dir, SERVICE_CONFIG_FILE)
+        if os.path.exists(function_spec_file):
+            with open(function_spec_file) as function_spec_file_object:
+                function_spec = json.load(function_spec_file_object)
+        for field in DEPLOYMENT_SPEC_FIELDS:
+            function_spec.pop(field, None)
+        spec_digest = json.dumps(function_spec, sort_keys=True)
+        return hashlib.sha256(''.join([tree_digest, ':', spec_digest]).encode()).hexdigest()
     except Exception:
         print(traceback.format_exc())
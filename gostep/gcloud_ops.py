@@ -1,20 +1,103 @@
+import base64
+import configparser
+import json
 import os
 import subprocess
+import threading
+import time
 import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
 from time import sleep
 
+import google.auth
+import google_crc32c
+from google.api_core.exceptions import Conflict, NotFound
+from google.auth.exceptions import DefaultCredentialsError
 from google.cloud import storage
 from google.cloud.storage import Blob
-from googleapiclient.discovery import build
-
-from gostep.consts import FUNCTIONS_API, AUTH_FILE
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.discovery_cache.base import Cache
+
+from gostep.consts import FUNCTIONS_API, AUTH_FILE, GOSTEP_CACHE_DIR, DISCOVERY_CACHE_DIR, DISCOVERY_CACHE_TTL, \
+    API_ROOT_URL_ENV, RESOURCE_MANAGER_API, RESOURCE_MANAGER_API_VERSION, IAM_API, IAM_API_VERSION, \
+    SERVICE_ACCOUNT_ROLE, SERVICE_ACCOUNT_KEY_TYPE, IAM_POLICY_ATTEMPTS, GCLOUD_CONFIG_ENV, GCLOUD_PROJECT_ENV, \
+    GCLOUD_ACTIVE_CONFIG_ENV, GCLOUD_CONFIG_DIR, GCLOUD_ACTIVE_CONFIG_FILE, GCLOUD_CONFIGURATIONS_DIR, \
+    GCLOUD_DEFAULT_CONFIG, PROJECTS_METADATA, LOCATIONS_METADATA, SERVICE_ACCOUNTS_METADATA
 from gostep.consts import FUNCTIONS_API_VERSION
-from gostep.consts import GCLOUD_STORAGE_CLASS
+from gostep.consts import GCLOUD_STORAGE_CLASS, UPLOAD_CHUNK_SIZE, ARCHIVE_CONTENT_TYPE, BATCH_SIZE, RESPONSE, ERROR, \
+    COMPOSITE_UPLOAD_THRESHOLD, COMPOSITE_SLICE_SIZE, COMPOSITE_MAX_COMPONENTS, COMPOSITE_UPLOAD_WORKERS, \
+    COMPOSITE_SLICES_PREFIX, HASH_CHUNK_SIZE
+from gostep.file_manager import write_file_atomically
+from gostep.metadata_cache import get_metadata, forget_metadata, refresh_metadata, get_metadata_offline
+from gostep.tracing import api_call, traced, count_api_call, count_bytes
+
+service_clients = threading.local()
+storage_clients = threading.local()
+discovery_documents = {}
+gcloud_cache = {}
+gcloud_cache_lock = threading.Lock()
+
+
+class DiscoveryDocumentCache(Cache):
+    """
+        Discovery document cache kept in memory for the process and on disk
+        for later runs, keyed by api and version. Documents bundled with the
+        client library are used before fetching a document over the network.
+    """
+
+    def __init__(self, api, version):
+        self.key = (api, version)
+        self.cache_file = os.path.join(GOSTEP_CACHE_DIR, DISCOVERY_CACHE_DIR, ''.join([api, '.', version, '.json']))
+
+    def get(self, url=None):
+        if self.key in discovery_documents:
+            return discovery_documents[self.key]
+        try:
+            if time.time() - os.path.getmtime(self.cache_file) <= DISCOVERY_CACHE_TTL:
+                with open(self.cache_file) as cache_file_object:
+                    discovery_documents[self.key] = cache_file_object.read()
+                return discovery_documents[self.key]
+        except OSError:
+            pass
+        document = get_static_doc(*self.key)
+        if document is not None:
+            discovery_documents[self.key] = document
+        return document
+
+    def set(self, url, content):
+        discovery_documents[self.key] = content
+        try:
+            write_file_atomically(self.cache_file, content)
+        except OSError:
+            print(traceback.format_exc())
+
+
+def override_root_url(document, root_url):
+    """
+        Points a discovery document at another root URL, so requests,
+        including batched ones, are sent to a local emulator.
+
+            Parameters:
+                document (string): discovery document
+                root_url (string): root URL as http://{host}:{port}/
+
+            Returns:
+                document (dictionary): updated discovery document
+    """
+    document = json.loads(document)
+    root_url = root_url if root_url.endswith('/') else ''.join([root_url, '/'])
+    document['rootUrl'] = root_url
+    document['mtlsRootUrl'] = root_url
+    document['baseUrl'] = ''.join([root_url, document['servicePath']])
+    return document
 
 
 def get_service_client(api, version):
     """
-        Creates and returns a service resource object.
+        Returns a service resource object, built once per thread from a
+        cached discovery document.
 
             Parameters:
                 api (string): api type of gcloud service
@@ -25,27 +108,56 @@ def get_service_client(api, version):
                 interacting with the service
     """
     try:
-        return build(api, version)
+        clients = service_clients.__dict__
+        if (api, version) not in clients:
+            discovery_cache = DiscoveryDocumentCache(api, version)
+            document = discovery_cache.get()
+            if document is not None and os.environ.get(API_ROOT_URL_ENV):
+                document = override_root_url(document, os.environ[API_ROOT_URL_ENV])
+            if document is None:
+                clients[(api, version)] = build(api, version, cache=discovery_cache, static_discovery=False)
+            else:
+                clients[(api, version)] = build_from_document(document)
+        return clients[(api, version)]
     except Exception:
         print(traceback.format_exc())
 
 
 def get_storage_client():
     """
-        Creates and returns a storage service resource object.
+        Returns a storage service resource object, created once per thread.
 
             Returns:
                 storage_client (object): storage service object
     """
     try:
-        return storage.Client()
+        if not hasattr(storage_clients, 'client'):
+            storage_clients.client = storage.Client()
+        return storage_clients.client
     except Exception:
         print(traceback.format_exc())
 
 
+@api_call('locations.list')
+def list_locations(project):
+    """
+        Lists the available locations of a project.
+
+            Parameters:
+                project (string): gcloud project id
+
+            Returns:
+                locations_list (list): list of location objects
+    """
+    service_client = get_service_client(FUNCTIONS_API, FUNCTIONS_API_VERSION)
+    project_name = ''.join(['projects', '/', project])
+    return service_client.projects().locations().list(name=project_name).execute()['locations']
+
+
 def get_locations(project):
     """
-        Returns a list of available locations for a project.
+        Returns a list of available locations for a project, from the metadata
+        cache when it has been fetched recently.
 
             Parameters:
                 project (string): root directory of the repo
@@ -55,14 +167,13 @@ def get_locations(project):
                 locations_list (list): list of location objects
     """
     try:
-        service_client = get_service_client(
-            FUNCTIONS_API, FUNCTIONS_API_VERSION)
-        project_name = ''.join(['projects', '/', project])
-        return service_client.projects().locations().list(name=project_name).execute()['locations']
+        return memoized((LOCATIONS_METADATA, project),
+                        lambda: get_metadata(LOCATIONS_METADATA, project, lambda: list_locations(project)))
     except Exception:
         print(traceback.format_exc())
 
 
+@api_call('storage.buckets.insert')
 def create_bucket(name, location):
     """
         Creates a storage bucket and returns the created bucket object.
@@ -80,10 +191,13 @@ def create_bucket(name, location):
         bucket.location = location
         bucket.storage_class = GCLOUD_STORAGE_CLASS
         return client.create_bucket(bucket)
+    except Conflict:
+        return lookup_bucket(name)
     except Exception:
         print(traceback.format_exc())
 
 
+@api_call('storage.buckets.list')
 def get_buckets():
     """
         Returns a list of bucket objects.
@@ -98,6 +212,38 @@ def get_buckets():
         print(traceback.format_exc())
 
 
+@api_call('storage.buckets.get')
+def lookup_bucket(name):
+    """
+        Looks up a bucket directly by name.
+
+            Parameters:
+                name (string): name of the bucket
+
+            Returns:
+                bucket (object): instance of a bucket object, None if it does not exist
+    """
+    try:
+        client = get_storage_client()
+        return client.lookup_bucket(name)
+    except Exception:
+        print(traceback.format_exc())
+
+
+def get_bucket_reference(name):
+    """
+        Returns a bucket object for a bucket known to exist, without a request.
+
+            Parameters:
+                name (string): name of the bucket
+
+            Returns:
+                bucket (object): instance of a bucket object
+    """
+    return get_storage_client().bucket(name)
+
+
+@api_call('storage.buckets.get')
 def get_bucket(name):
     """
         Returns the bucket object.
@@ -115,9 +261,29 @@ def get_bucket(name):
         print(traceback.format_exc())
 
 
+@api_call('storage.objects.get')
+def blob_exists(bucket_name, file_name):
+    """
+        Find that a file already has been uploaded to a storage bucket.
+
+            Parameters:
+                bucket_name (string): name of the bucket
+                file_name (string): name of the file with extension
+
+            Returns:
+                is_exists (boolean): true, if the file exists in the bucket
+    """
+    try:
+        return Blob(name=file_name, bucket=get_bucket_reference(bucket_name)).exists()
+    except Exception:
+        print(traceback.format_exc())
+        return False
+
+
 def upload_file_to_bucket(bucket_name, file_name, file):
     """
-        Uploads a file to a storage bucket and returns it's access path.
+        Uploads a file to a storage bucket and returns it's access path. Large
+        files are uploaded in parallel slices.
 
             Parameters:
                 bucket_name (string): name of the bucket
@@ -128,22 +294,151 @@ def upload_file_to_bucket(bucket_name, file_name, file):
                 file_path (string): bucket path of the uploaded file
     """
     try:
-        bucket = get_bucket(bucket_name)
+        if os.path.getsize(file) >= COMPOSITE_UPLOAD_THRESHOLD:
+            return upload_composite_file(bucket_name, file_name, file)
+        return upload_single_file(bucket_name, file_name, file)
+    except Exception:
+        print(traceback.format_exc())
+
+
+@api_call('storage.objects.insert')
+def upload_single_file(bucket_name, file_name, file):
+    """
+        Uploads a file to a storage bucket in one stream and returns it's
+        access path.
+
+            Parameters:
+                bucket_name (string): name of the bucket
+                file_name (string): name of the file with extension
+                file (string): path of the file to be uploaded
+
+            Returns:
+                file_path (string): bucket path of the uploaded file
+    """
+    try:
+        bucket = get_bucket_reference(bucket_name)
         blob = Blob(name=file_name, bucket=bucket)
         with open(file, 'rb') as file_object:
             blob.upload_from_file(file_object)
+        count_bytes('upload', blob.size)
         return ''.join(['gs://', blob.bucket.name, '/', blob.name])
     except Exception:
         print(traceback.format_exc())
 
 
-def get_cloud_functions(location_path):
+def get_file_crc32c(file):
+    """
+        Returns the CRC32C checksum of a file, encoded as Cloud Storage reports it.
+
+            Parameters:
+                file (string): path to file
+
+            Returns:
+                crc32c (string): base64 encoded big-endian checksum
+    """
+    checksum = google_crc32c.Checksum()
+    with open(file, 'rb') as file_object:
+        chunk = file_object.read(HASH_CHUNK_SIZE)
+        while chunk:
+            checksum.update(chunk)
+            chunk = file_object.read(HASH_CHUNK_SIZE)
+    return base64.b64encode(checksum.digest()).decode()
+
+
+@traced('composite_upload', 'api')
+def upload_composite_file(bucket_name, file_name, file):
     """
-        Returns a object list which describes a cloud function in a project.
+        Uploads slices of a file as temporary objects in parallel, composes
+        them into the final object and removes them. The CRC32C checksum of
+        the composed object is verified against the local file.
+
+            Parameters:
+                bucket_name (string): name of the bucket
+                file_name (string): name of the file with extension
+                file (string): path of the file to be uploaded
+
+            Returns:
+                file_path (string): bucket path of the uploaded file
+    """
+    try:
+        file_size = os.path.getsize(file)
+        slice_size = max(COMPOSITE_SLICE_SIZE, -(-file_size // COMPOSITE_MAX_COMPONENTS))
+        slice_prefix = ''.join([COMPOSITE_SLICES_PREFIX, file_name, '.', uuid.uuid4().hex, '/'])
+        offsets = list(range(0, file_size, slice_size))
+
+        def upload_slice(index):
+            blob = Blob(name='%s%04d' % (slice_prefix, index), bucket=get_bucket_reference(bucket_name))
+            with open(file, 'rb') as file_object:
+                file_object.seek(offsets[index])
+                count_api_call('storage.objects.insert')
+                blob.upload_from_file(file_object, size=min(slice_size, file_size - offsets[index]),
+                                      checksum='crc32c')
+            return blob
+
+        def delete_slice(blob):
+            try:
+                count_api_call('storage.objects.delete')
+                Blob(name=blob.name, bucket=get_bucket_reference(bucket_name)).delete()
+            except NotFound:
+                pass
+
+        with ThreadPoolExecutor(max_workers=COMPOSITE_UPLOAD_WORKERS) as executor:
+            futures = [executor.submit(upload_slice, index) for index in range(len(offsets))]
+            try:
+                checksum = get_file_crc32c(file)
+                slices = [future.result() for future in futures]
+                blob = Blob(name=file_name, bucket=get_bucket_reference(bucket_name))
+                blob.content_type = ARCHIVE_CONTENT_TYPE
+                count_api_call('storage.objects.compose')
+                blob.compose(slices)
+            finally:
+                wait(futures)
+                uploaded = [future.result() for future in futures if future.exception() is None]
+                list(executor.map(delete_slice, uploaded))
+        if blob.crc32c != checksum:
+            count_api_call('storage.objects.delete')
+            blob.delete()
+            raise ValueError('CRC32C of the composed %s does not match the uploaded file.' % file_name)
+        count_bytes('upload', file_size)
+        return ''.join(['gs://', blob.bucket.name, '/', blob.name])
+    except Exception:
+        print(traceback.format_exc())
+
+
+@api_call('storage.objects.insert')
+def upload_stream_to_bucket(bucket_name, file_name, stream):
+    """
+        Uploads a stream to a storage bucket with a resumable upload and
+        returns it's access path.
+
+            Parameters:
+                bucket_name (string): name of the bucket
+                file_name (string): name of the file with extension
+                stream (object): readable stream of unknown size
+
+            Returns:
+                file_path (string): bucket path of the uploaded file
+    """
+    try:
+        bucket = get_bucket_reference(bucket_name)
+        blob = Blob(name=file_name, bucket=bucket, chunk_size=UPLOAD_CHUNK_SIZE)
+        blob.upload_from_file(stream, content_type=ARCHIVE_CONTENT_TYPE)
+        count_bytes('upload', stream.tell())
+        return ''.join(['gs://', blob.bucket.name, '/', blob.name])
+    except Exception:
+        print(traceback.format_exc())
+
+
+@traced('functions.list', 'api')
+def get_cloud_functions(location_path, fields=None):
+    """
+        Returns a object list which describes a cloud function in a project,
+        following every page of the listing.
 
             Parameters:
                 location_path (string): path to function including function id
                 as 'projects/{project_id}/locations/{location_id}'
+                fields (string): partial response fields selector, None for all fields
 
             Returns:
                 functions_list (list): list of function objects
@@ -151,16 +446,23 @@ def get_cloud_functions(location_path):
     try:
         service_client = get_service_client(
             FUNCTIONS_API, FUNCTIONS_API_VERSION)
-        functions = service_client.projects().locations().functions().list(
-            parent=location_path
-        ).execute()
-        if functions == {} or functions == []:
-            return []
-        return functions['functions']
+        functions_resource = service_client.projects().locations().functions()
+        if fields is None:
+            request = functions_resource.list(parent=location_path)
+        else:
+            request = functions_resource.list(parent=location_path, fields=fields)
+        functions = []
+        while request is not None:
+            count_api_call('functions.list')
+            response = request.execute()
+            functions.extend(response.get('functions', []))
+            request = functions_resource.list_next(request, response)
+        return functions
     except Exception:
         print(traceback.format_exc())
 
 
+@api_call('functions.get')
 def get_cloud_function(function_path):
     """
         Returns a object which describes a cloud function in a project.
@@ -183,6 +485,30 @@ def get_cloud_function(function_path):
         print(traceback.format_exc())
 
 
+def get_cloud_functions_by_name(function_paths):
+    """
+        Returns objects which describe many cloud functions using batched
+        requests.
+
+            Parameters:
+                function_paths (list): paths to functions as
+                projects/{project_id}/locations/{location_id}/functions/{id}
+
+            Returns:
+                results (dictionary): function path against an object containing
+                the function and the error of the request
+    """
+    try:
+        service_client = get_service_client(
+            FUNCTIONS_API, FUNCTIONS_API_VERSION)
+        functions_resource = service_client.projects().locations().functions()
+        return execute_batch({function_path: functions_resource.get(name=function_path)
+                              for function_path in function_paths})
+    except Exception:
+        print(traceback.format_exc())
+
+
+@api_call('functions.create')
 def deploy_cloud_function(location_path, function_spec):
     """
         Deploys a function for a given specification and returns a function
@@ -205,6 +531,7 @@ def deploy_cloud_function(location_path, function_spec):
         print(traceback.format_exc())
 
 
+@api_call('functions.patch')
 def update_cloud_function(function_path, patch_field, update_spec):
     """
         Creates a directory if it does not exist.
@@ -229,20 +556,63 @@ def update_cloud_function(function_path, patch_field, update_spec):
         print(traceback.format_exc())
 
 
+@api_call('operations.get')
+def get_operation(operation_name):
+    """
+        Returns the state of a long running operation.
+
+            Parameters:
+                operation_name (string): name of the operation as operations/{id}
+
+            Returns:
+                operation (object): operation object
+    """
+    try:
+        service_client = get_service_client(FUNCTIONS_API, FUNCTIONS_API_VERSION)
+        return service_client.operations().get(name=operation_name).execute()
+    except Exception:
+        print(traceback.format_exc())
+
+
+def list_projects():
+    """
+        Lists available projects using the Resource Manager API, or the gcloud
+        cli when application default credentials are not available.
+
+            Returns:
+                projects_list (list): list of project information objects.
+    """
+    if get_default_credentials() is None:
+        return run_gcloud_command('projects list')
+    try:
+        service_client = get_service_client(RESOURCE_MANAGER_API, RESOURCE_MANAGER_API_VERSION)
+        projects_list = []
+        request = service_client.projects().list()
+        while request is not None:
+            count_api_call('projects.list')
+            response = request.execute()
+            projects_list.extend(response.get('projects', []))
+            request = service_client.projects().list_next(request, response)
+        return projects_list
+    except Exception:
+        return run_gcloud_command('projects list')
+
+
 def get_projects():
     """
-        List down available projects.
+        List down available projects. Projects are read from the metadata
+        cache when they have been listed recently.
 
             Returns:
                 projects_list (list): list of project information objects.
     """
     try:
-        response = subprocess.check_output('gcloud projects list', shell=True)
-        return response.decode("utf-8").split('\n')
+        return memoized(PROJECTS_METADATA, lambda: get_metadata(PROJECTS_METADATA, None, list_projects))
     except Exception:
         print(traceback.format_exc())
 
 
+@api_call('functions.getIamPolicy')
 def get_iam_policy(resource):
     """
         Get IAM policy for a given resource.
@@ -263,6 +633,90 @@ def get_iam_policy(resource):
         print(traceback.format_exc())
 
 
+@traced('batch', 'api')
+def execute_batch(requests, api=FUNCTIONS_API, version=FUNCTIONS_API_VERSION):
+    """
+        Executes independent requests of a service in batched HTTP requests,
+        a few multipart round trips instead of one round trip per request.
+
+            Parameters:
+                requests (dictionary): key against an unexecuted request of the service
+                api (string): api type of gcloud service
+                version (string): gcloud service version
+
+            Returns:
+                results (dictionary): key against an object containing the
+                response and the error of the request
+    """
+    keys = list(requests.keys())
+    results = {}
+
+    def collect(request_id, response, exception):
+        results[keys[int(request_id)]] = {
+            RESPONSE: None if exception is not None else response,
+            ERROR: None if exception is None else str(exception)
+        }
+
+    service_client = get_service_client(api, version)
+    for start in range(0, len(keys), BATCH_SIZE):
+        try:
+            batch = service_client.new_batch_http_request(callback=collect)
+            for index in range(start, min(start + BATCH_SIZE, len(keys))):
+                batch.add(requests[keys[index]], request_id=str(index))
+            count_api_call('batch')
+            count_api_call('batch.items', len(keys[start:start + BATCH_SIZE]))
+            batch.execute()
+        except Exception as error:
+            for key in keys[start:start + BATCH_SIZE]:
+                results.setdefault(key, {RESPONSE: None, ERROR: str(error)})
+    return results
+
+
+def get_iam_policies(resources):
+    """
+        Get IAM policies of many resources using batched requests.
+
+            Parameters:
+                resources (list): resource paths as
+                /projects/{}/locations/{}/functions/{}
+
+            Returns:
+                results (dictionary): resource path against an object containing
+                the policy and the error of the request
+    """
+    try:
+        service_client = get_service_client(FUNCTIONS_API,
+                                            FUNCTIONS_API_VERSION)
+        functions_resource = service_client.projects().locations().functions()
+        return execute_batch({resource: functions_resource.getIamPolicy(resource=resource)
+                              for resource in resources})
+    except Exception:
+        print(traceback.format_exc())
+
+
+def set_iam_policies(policy_requests):
+    """
+        Set IAM policies of many resources using batched requests.
+
+            Parameters:
+                policy_requests (dictionary): resource path as
+                /projects/{}/locations/{}/functions/{} against policy dictionary object
+
+            Returns:
+                results (dictionary): resource path against an object containing
+                the updated policy and the error of the request
+    """
+    try:
+        service_client = get_service_client(FUNCTIONS_API,
+                                            FUNCTIONS_API_VERSION)
+        functions_resource = service_client.projects().locations().functions()
+        return execute_batch({resource: functions_resource.setIamPolicy(resource=resource, body=policy_request)
+                              for resource, policy_request in policy_requests.items()})
+    except Exception:
+        print(traceback.format_exc())
+
+
+@api_call('functions.setIamPolicy')
 def set_iam_policy(resource, policy_request):
     """
         Get IAM policy for a given resource.
@@ -284,26 +738,138 @@ def set_iam_policy(resource, policy_request):
         print(traceback.format_exc())
 
 
-def get_service_account_email(account_name):
+def list_service_accounts(project):
+    """
+        Lists the service accounts of a project using the IAM API, or the
+        gcloud cli when application default credentials are not available.
+
+            Parameters:
+                project (string): gcloud project id
+
+            Returns:
+                accounts (list): list of service account objects
+    """
+    if get_default_credentials() is None:
+        return run_gcloud_command(' '.join(['iam service-accounts list --project', project]))
+    try:
+        service_client = get_service_client(IAM_API, IAM_API_VERSION)
+        accounts = []
+        request = service_client.projects().serviceAccounts().list(name='projects/%s' % project)
+        while request is not None:
+            count_api_call('serviceAccounts.list')
+            response = request.execute()
+            accounts.extend(response.get('accounts', []))
+            request = service_client.projects().serviceAccounts().list_next(request, response)
+        return accounts
+    except Exception:
+        return run_gcloud_command(' '.join(['iam service-accounts list --project', project]))
+
+
+def get_service_accounts(project):
+    """
+        Returns the service accounts of a project, from the metadata cache
+        when they have been listed recently.
+
+            Parameters:
+                project (string): gcloud project id
+
+            Returns:
+                accounts (list): list of service account objects
+    """
+    return memoized((SERVICE_ACCOUNTS_METADATA, project),
+                    lambda: get_metadata(SERVICE_ACCOUNTS_METADATA, project, lambda: list_service_accounts(project)))
+
+
+def get_service_account_email(account_name, project=None):
     """
         Returns service account name using account name.
 
             Parameters:
                 account_name (string): service account name
+                project (string): gcloud project id, None for the active project
 
             Returns:
                 service_account (list): list containing a service account email
     """
     try:
-        cmd = 'gcloud iam service-accounts list'
-        accounts_list_proc = subprocess.check_output(cmd, shell=True)
-        accounts_split = accounts_list_proc.decode('utf-8').split()
-        return [i for i in accounts_split if account_name in i and '.com' in i]
+        accounts = get_service_accounts(default_gcloud_project() if project is None else project)
+        if accounts is None:
+            return []
+        return [account['email'] for account in accounts if account['email'].split('@')[0] == account_name]
     except Exception:
         print(traceback.format_exc())
 
 
+def add_project_iam_binding(project, member, role):
+    """
+        Grants a role on a project with a read, modify and write of its IAM
+        policy, retried while the policy changes concurrently or the member
+        has not been propagated yet.
+
+            Parameters:
+                project (string): gcloud project id
+                member (string): IAM member, as serviceAccount:<email>
+                role (string): IAM role
+    """
+    service_client = get_service_client(RESOURCE_MANAGER_API, RESOURCE_MANAGER_API_VERSION)
+    for attempt in range(IAM_POLICY_ATTEMPTS):
+        try:
+            policy = service_client.projects().getIamPolicy(resource=project, body={}).execute()
+            bindings = policy.setdefault('bindings', [])
+            binding = next((entry for entry in bindings if entry['role'] == role and 'condition' not in entry), None)
+            if binding is None:
+                bindings.append({'role': role, 'members': [member]})
+            elif member in binding['members']:
+                return
+            else:
+                binding['members'].append(member)
+            service_client.projects().setIamPolicy(resource=project, body={'policy': policy}).execute()
+            return
+        except Exception:
+            if attempt == IAM_POLICY_ATTEMPTS - 1:
+                raise
+            sleep(2)
+
+
 def create_credentials(name, project, display_name, workspace_dir):
+    """
+        Creates a credentials.json file using the IAM API, or the gcloud cli
+        when application default credentials are not available.
+
+            Parameters:
+                name (string): service account name
+                project (string): gcloud project id
+                display_name (string): service account display name
+                workspace_dir (string): workspace directory path of the project
+
+            Returns:
+                succeed (boolean): status of account creation
+    """
+    if get_default_credentials() is None:
+        return create_credentials_with_gcloud(name, project, display_name, workspace_dir)
+    try:
+        service_client = get_service_client(IAM_API, IAM_API_VERSION)
+        account_email = get_service_account_email(name, project)
+        if len(account_email) == 0:
+            account = service_client.projects().serviceAccounts().create(
+                name='projects/%s' % project,
+                body={'accountId': name, 'serviceAccount': {'displayName': display_name}}
+            ).execute()
+            forget_service_accounts(project)
+            account_email = [account['email']]
+            add_project_iam_binding(project, ''.join(['serviceAccount:', account_email[0]]), SERVICE_ACCOUNT_ROLE)
+        key = service_client.projects().serviceAccounts().keys().create(
+            name='projects/%s/serviceAccounts/%s' % (project, account_email[0]),
+            body={'privateKeyType': SERVICE_ACCOUNT_KEY_TYPE}
+        ).execute()
+        with open(os.path.join(workspace_dir, AUTH_FILE), 'wb') as auth_file:
+            auth_file.write(base64.b64decode(key['privateKeyData']))
+        return True
+    except Exception:
+        print(traceback.format_exc())
+
+
+def create_credentials_with_gcloud(name, project, display_name, workspace_dir):
     """
         Creates a credentials.json file using gcloud cli.
 
@@ -317,18 +883,19 @@ def create_credentials(name, project, display_name, workspace_dir):
                 succeed (boolean): status of account creation
     """
     try:
-        account_email = get_service_account_email(name)
+        account_email = get_service_account_email(name, project)
         if len(account_email) == 0:
             cmd = ''.join([
-                'gcloud iam service-accounts create ', name, ' --display-name "',
+                'gcloud iam service-accounts create ', name, ' --project ', project, ' --display-name "',
                 display_name, '"'])
             subprocess.check_output(cmd, shell=True)
             sleep(2)
-            account_email = get_service_account_email(name)
+            forget_service_accounts(project)
+            account_email = get_service_account_email(name, project)
             cmd = ''.join(['gcloud projects add-iam-policy-binding ', project,
                            ' --member serviceAccount:', account_email[0],
-                           ' --role "roles/editor"'])
-            policy_bind_proc = subprocess.check_output(cmd, shell=True)
+                           ' --role "', SERVICE_ACCOUNT_ROLE, '"'])
+            subprocess.check_output(cmd, shell=True)
         cmd = ''.join([
             'gcloud iam service-accounts keys create "', workspace_dir, '/"',
             AUTH_FILE, ' --iam-account ', account_email[0]])
@@ -338,21 +905,151 @@ def create_credentials(name, project, display_name, workspace_dir):
         print(traceback.format_exc())
 
 
+def forget_service_accounts(project):
+    """
+        Drops the service accounts of a project from the process and metadata
+        caches after one has been created.
+
+            Parameters:
+                project (string): gcloud project id
+    """
+    with gcloud_cache_lock:
+        gcloud_cache.pop((SERVICE_ACCOUNTS_METADATA, project), None)
+    forget_metadata(SERVICE_ACCOUNTS_METADATA, project)
+
+
+def memoized(key, loader):
+    """
+        Returns a value loaded once per process.
+
+            Parameters:
+                key (object): cache key
+                loader (function): function loading the value
+
+            Returns:
+                value (object): cached or loaded value
+    """
+    with gcloud_cache_lock:
+        if key in gcloud_cache:
+            return gcloud_cache[key]
+    value = loader()
+    with gcloud_cache_lock:
+        gcloud_cache[key] = value
+    return value
+
+
+def get_default_credentials():
+    """
+        Returns application default credentials, looked up once per process.
+
+            Returns:
+                credentials (Credentials): default credentials, None if they are not configured
+    """
+    def load_credentials():
+        try:
+            return google.auth.default()[0]
+        except DefaultCredentialsError:
+            return None
+
+    return memoized('credentials', load_credentials)
+
+
+def run_gcloud_command(command):
+    """
+        Runs a gcloud cli command and returns its JSON output.
+
+            Parameters:
+                command (string): gcloud command without the gcloud prefix
+
+            Returns:
+                output (object): parsed output of the command
+    """
+    response = subprocess.check_output(' '.join(['gcloud', command, '--format=json']), shell=True)
+    return json.loads(response.decode('utf-8'))
+
+
+def read_gcloud_project():
+    """
+        Reads the project of the active gcloud configuration from the gcloud
+        config directory.
+
+            Returns:
+                project_id (string): project id, '' if it is not set, None if
+                there is no gcloud config directory
+    """
+    config_dir = os.environ.get(GCLOUD_CONFIG_ENV) or GCLOUD_CONFIG_DIR
+    if not os.path.isdir(config_dir):
+        return None
+    config_name = os.environ.get(GCLOUD_ACTIVE_CONFIG_ENV)
+    if not config_name:
+        try:
+            with open(os.path.join(config_dir, GCLOUD_ACTIVE_CONFIG_FILE)) as active_config_file:
+                config_name = active_config_file.read().strip()
+        except OSError:
+            config_name = None
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read(os.path.join(config_dir, GCLOUD_CONFIGURATIONS_DIR,
+                             ''.join(['config_', config_name or GCLOUD_DEFAULT_CONFIG])))
+    return parser.get('core', 'project', fallback='').strip()
+
+
 def default_gcloud_project():
     """
-        Call gcloud cli and returns default default selected project id.
+        Returns the project of the active gcloud configuration. It is read from
+        the gcloud config files once per process, falling back to the gcloud
+        cli when there is no gcloud config directory.
 
             Returns:
                 project_id (string): active gcloud project id
     """
     try:
-        response = subprocess.check_output('gcloud config get-value project', shell=True)
-        splits = str(response).replace('\\n', '').split("'")
-        return splits[1] if len(splits) > 1 else ''
+        def load_project():
+            project = os.environ.get(GCLOUD_PROJECT_ENV) or read_gcloud_project()
+            if project is None:
+                response = subprocess.check_output('gcloud config get-value project', shell=True)
+                project = response.decode('utf-8').strip()
+            return project
+
+        return memoized('project', load_project)
     except Exception:
         print(traceback.format_exc())
 
 
+def refresh_gcloud_metadata(project):
+    """
+        Fetches projects, locations and service accounts of the given project
+        again. Each cached value is replaced only when it has been fetched, so
+        a failure keeps the previous value.
+
+            Parameters:
+                project (string): gcloud project id, None to refresh only projects
+
+            Returns:
+                refreshed (dictionary): number of entries fetched per kind, for
+                kinds which could be fetched, None in offline mode
+    """
+    if get_metadata_offline():
+        print('Metadata can not be refreshed in offline mode.')
+        return None
+    loaders = {PROJECTS_METADATA: (PROJECTS_METADATA, None, list_projects)}
+    if project:
+        loaders[LOCATIONS_METADATA] = ((LOCATIONS_METADATA, project), project, lambda: list_locations(project))
+        loaders[SERVICE_ACCOUNTS_METADATA] = ((SERVICE_ACCOUNTS_METADATA, project), project,
+                                              lambda: list_service_accounts(project))
+    refreshed = {}
+    for kind, (cache_key, scope, loader) in loaders.items():
+        try:
+            values = refresh_metadata(kind, scope, loader)
+        except Exception:
+            print(traceback.format_exc())
+            continue
+        if values is not None:
+            refreshed[kind] = len(values)
+            with gcloud_cache_lock:
+                gcloud_cache[cache_key] = values
+    return refreshed
+
+
 def set_credential_file(cred_file_path):
     """
         Set system env variable for GOOGLE_APPLICATION_CREDENTIALS.
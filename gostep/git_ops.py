@@ -0,0 +1,163 @@
+import os
+import subprocess
+
+from gostep.consts import SOURCE_DIRECTORY, GIT_COMMIT
+from gostep.tracing import span
+
+
+def run_git_command(workspace_dir, args):
+    """
+        Runs a git command inside the workspace and returns its output.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                args (list): git arguments
+
+            Returns:
+                output (string): standard output, None if git is missing or the command failed
+    """
+    try:
+        result = subprocess.run(['git'] + args, cwd=workspace_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError:
+        return None
+    if result.returncode != 0:
+        return None
+    return result.stdout.decode('utf-8', 'surrogateescape')
+
+
+def split_paths(output):
+    """
+        Splits NUL separated git output into paths.
+
+            Parameters:
+                output (string): output of a git command run with -z
+
+            Returns:
+                paths (list): paths relative to the repository root
+    """
+    return [entry for entry in output.split('\0') if entry != '']
+
+
+def get_head_commit(workspace_dir):
+    """
+        Returns the commit checked out in the workspace.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                commit (string): commit id, None if the workspace is not inside a git repository with commits
+    """
+    output = run_git_command(workspace_dir, ['rev-parse', '--verify', '-q', 'HEAD'])
+    return None if output is None else output.strip()
+
+
+def get_dirty_files(workspace_dir):
+    """
+        Lists modified, staged and untracked files of the workspace.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                paths (list): paths relative to the repository root, None if git status failed
+    """
+    output = run_git_command(
+        workspace_dir, ['status', '--porcelain', '-z', '--no-renames', '--untracked-files=all', '--', '.'])
+    return None if output is None else [entry[3:] for entry in split_paths(output)]
+
+
+def get_committed_files(workspace_dir, commit):
+    """
+        Lists files of the workspace changed by the commits since a given one.
+        Renamed files are listed with both of their paths.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                commit (string): commit id
+
+            Returns:
+                paths (list): paths relative to the repository root, None if
+                the commit is not available, as in shallow clones
+    """
+    output = run_git_command(workspace_dir, ['diff', '--name-only', '-z', '--no-renames', commit, 'HEAD', '--', '.'])
+    return None if output is None else split_paths(output)
+
+
+class ServicePrefixes(object):
+    """
+        Maps paths relative to the repository root to the services whose
+        source directories contain them.
+    """
+
+    def __init__(self, workspace_prefix, services):
+        self.prefixes = {}
+        for service_key, service in services.items():
+            prefix = os.path.normpath(os.path.join(workspace_prefix, service[SOURCE_DIRECTORY])).replace(os.sep, '/')
+            self.prefixes.setdefault(prefix, []).append(service_key)
+
+    def get_services(self, paths):
+        """
+            Returns the services containing any of the given paths.
+
+                Parameters:
+                    paths (list): paths relative to the repository root
+
+                Returns:
+                    service_keys (set): service names
+        """
+        service_keys = set()
+        for file_path in paths:
+            parent = file_path
+            while parent != '':
+                parent = parent.rpartition('/')[0]
+                service_keys.update(self.prefixes.get(parent or '.', []))
+        return service_keys
+
+
+def get_git_changes(workspace_dir, services):
+    """
+        Works out which services have been changed since their last deployment
+        from the git history, without hashing. A service recorded at a commit
+        is changed if a commit since then touched its sources. Services with
+        modified or untracked files, and services without a usable commit, are
+        left to content hashing. Changed services still have to be hashed, the
+        commits may only hold the function.json rewritten by a deployment.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                services (dictionary): service name against its entry
+
+            Returns:
+                changes (dictionary): head commit, services changed, services
+                unchanged and services which need hashing, None if the
+                workspace is not inside a git repository
+    """
+    with span('git'):
+        head_commit = get_head_commit(workspace_dir)
+        workspace_prefix = run_git_command(workspace_dir, ['rev-parse', '--show-prefix'])
+        dirty_files = get_dirty_files(workspace_dir)
+        if head_commit is None or workspace_prefix is None or dirty_files is None:
+            return None
+        prefixes = ServicePrefixes(workspace_prefix.strip(), services)
+        dirty = prefixes.get_services(dirty_files)
+        changed = set()
+        unknown = set()
+        commits = {}
+        for service_key, service in services.items():
+            commits.setdefault(service.get(GIT_COMMIT) or None, set()).add(service_key)
+        for commit, service_keys in commits.items():
+            committed_files = None if commit is None else \
+                [] if commit == head_commit else get_committed_files(workspace_dir, commit)
+            if committed_files is None:
+                unknown.update(service_keys)
+            else:
+                changed.update(service_keys & prefixes.get_services(committed_files))
+        unknown = (unknown | dirty) - changed
+    return {
+        GIT_COMMIT: head_commit,
+        'changed': changed,
+        'unknown': unknown,
+        'unchanged': set(services.keys()) - changed - unknown,
+        'dirty': dirty
+    }
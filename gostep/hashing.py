@@ -0,0 +1,158 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from gostep.consts import HASH_CHUNK_SIZE, HASH_WORKERS, LARGE_FILE_SIZE, MANIFEST_VERSION, MTIME_GRANULARITY
+
+manifests_lock = threading.Lock()
+loaded_manifests = {}
+
+
+def get_file_digest(file_path):
+    """
+        Reads and returns the sha256 digest of a file.
+
+            Parameters:
+                file_path (string): path to file
+
+            Returns:
+                digest (string): hex digest of the file content
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file_object:
+        chunk = file_object.read(HASH_CHUNK_SIZE)
+        while chunk:
+            file_hash.update(chunk)
+            chunk = file_object.read(HASH_CHUNK_SIZE)
+    return file_hash.hexdigest()
+
+
+def load_manifest(manifest_file):
+    """
+        Reads a file manifest written by a previous scan. Manifests are kept
+        in memory and read again only when their file changes.
+
+            Parameters:
+                manifest_file (string): path to manifest file, None for no manifest
+
+            Returns:
+                manifest (dictionary): manifest object, empty if it does not exist
+    """
+    if manifest_file is not None:
+        try:
+            file_stat = os.stat(manifest_file)
+            stat_key = (file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino)
+            loaded = loaded_manifests.get(manifest_file)
+            if loaded is not None and loaded[0] == stat_key:
+                return loaded[1]
+            with open(manifest_file) as manifest_file_object:
+                manifest = json.load(manifest_file_object)
+            if manifest.get('version') == MANIFEST_VERSION:
+                loaded_manifests[manifest_file] = (stat_key, manifest)
+                return manifest
+        except (OSError, ValueError):
+            pass
+    return {'version': MANIFEST_VERSION, 'scanned_at': 0, 'files': {}}
+
+
+def save_manifest(manifest_file, manifest):
+    """
+        Writes a file manifest atomically.
+
+            Parameters:
+                manifest_file (string): path to manifest file
+                manifest (dictionary): manifest object
+    """
+    from gostep.file_manager import write_file_atomically
+    try:
+        write_file_atomically(manifest_file, json.dumps(manifest))
+        file_stat = os.stat(manifest_file)
+        loaded_manifests[manifest_file] = ((file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino), manifest)
+    except Exception:
+        print(traceback.format_exc())
+
+
+def list_files(dir_path, matcher=None):
+    """
+        Walks a directory and returns the files which are not ignored. Ignored
+        directories are pruned without being walked into.
+
+            Parameters:
+                dir_path (string): root directory path
+                matcher (IgnoreMatcher): compiled ignore patterns, None to list every file
+
+            Returns:
+                files (list): list of (relative path, absolute path) tuples
+    """
+    files = []
+    for dir_name, sub_dirs, file_names in os.walk(dir_path):
+        relative_dir = os.path.relpath(dir_name, dir_path).replace(os.sep, '/')
+        relative_dir = '' if relative_dir == '.' else ''.join([relative_dir, '/'])
+        if matcher is not None:
+            sub_dirs[:] = [sub_dir for sub_dir in sub_dirs
+                           if not matcher.ignored(''.join([relative_dir, sub_dir]), True)]
+        sub_dirs.sort()
+        for file_name in sorted(file_names):
+            relative_path = ''.join([relative_dir, file_name])
+            if matcher is not None and matcher.ignored(relative_path):
+                continue
+            files.append((relative_path, os.path.join(dir_name, file_name)))
+    return files
+
+
+def get_tree_digest(dir_path, manifest_file=None, matcher=None):
+    """
+        Returns a digest of a directory tree computed from relative file paths,
+        executable bits and file contents. Files whose size, modification time and inode are
+        unchanged since the last scan are not read again.
+
+            Parameters:
+                dir_path (string): root directory path
+                manifest_file (string): path to manifest of the previous scan
+                matcher (IgnoreMatcher): compiled ignore patterns, None to hash every file
+
+            Returns:
+                digest (string): hex digest of the directory tree
+    """
+    with manifests_lock:
+        manifest = load_manifest(manifest_file)
+    trusted_before = manifest['scanned_at'] - MTIME_GRANULARITY
+    scanned_at = time.time_ns()
+    entries = {}
+    executables = set()
+    pending = []
+    for relative_path, file_path in list_files(dir_path, matcher):
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            continue
+        if file_stat.st_mode & 0o111:
+            executables.add(relative_path)
+        stat_key = [file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino]
+        entry = manifest['files'].get(relative_path)
+        if entry is not None and entry[:3] == stat_key and file_stat.st_mtime_ns < trusted_before:
+            entries[relative_path] = entry
+        else:
+            entries[relative_path] = stat_key + [None]
+            pending.append((relative_path, file_path, file_stat.st_size))
+    large_files = [item for item in pending if item[2] >= LARGE_FILE_SIZE]
+    with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+        futures = {executor.submit(get_file_digest, file_path): relative_path
+                   for relative_path, file_path, size in large_files}
+        for relative_path, file_path, size in pending:
+            if size < LARGE_FILE_SIZE:
+                entries[relative_path][3] = get_file_digest(file_path)
+        for future, relative_path in futures.items():
+            entries[relative_path][3] = future.result()
+    tree_hash = hashlib.sha256()
+    for relative_path in sorted(entries.keys()):
+        file_mode = 'x' if relative_path in executables else '-'
+        tree_hash.update(''.join([relative_path, '\0', entries[relative_path][3], '\0', file_mode, '\n']).encode())
+    if manifest_file is not None and (len(pending) != 0 or len(entries) != len(manifest['files'])):
+        with manifests_lock:
+            save_manifest(manifest_file, {'version': MANIFEST_VERSION, 'scanned_at': scanned_at, 'files': entries})
+    return tree_hash.hexdigest()
@@ -0,0 +1,184 @@
+import os
+import re
+import threading
+
+from gostep.consts import GOSTEP_IGNORE_FILE, ARCHIVE_EXCLUDED_PATTERNS
+
+ignore_matchers = {}
+ignore_matchers_lock = threading.Lock()
+
+
+def translate_pattern(pattern):
+    """
+        Translates a gitignore style glob into a regular expression matching
+        relative paths separated by '/'.
+
+            Parameters:
+                pattern (string): glob without negation and trailing slash
+
+            Returns:
+                expression (string): regular expression
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    expression = '' if anchored else '(?:.*/)?'
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith('**/', index) and (index == 0 or pattern[index - 1] == '/'):
+            expression += '(?:.*/)?'
+            index += 3
+        elif pattern.endswith('**') and index == len(pattern) - 2 and (index == 0 or pattern[index - 1] == '/'):
+            expression += '.*'
+            index += 2
+        elif pattern[index] == '*':
+            expression += '[^/]*'
+            index += 1
+        elif pattern[index] == '?':
+            expression += '[^/]'
+            index += 1
+        elif pattern[index] == '[' and ']' in pattern[index + 2:]:
+            end = pattern.index(']', index + 2)
+            characters = pattern[index + 1:end]
+            if characters.startswith('!'):
+                characters = '^' + characters[1:]
+            expression += ''.join(['[', characters.replace('\\', '\\\\'), ']'])
+            index = end + 1
+        elif pattern[index] == '\\' and index + 1 < len(pattern):
+            expression += re.escape(pattern[index + 1])
+            index += 2
+        else:
+            expression += re.escape(pattern[index])
+            index += 1
+    return expression
+
+
+class IgnoreMatcher(object):
+    """
+        Matches relative paths against gitignore style patterns compiled into
+        one regular expression for directories and one for files. The last
+        matching pattern wins and '!' patterns re-include paths.
+    """
+
+    def __init__(self, patterns):
+        rules = []
+        for pattern in patterns:
+            negated = pattern.startswith('!')
+            pattern = pattern[1:] if negated else pattern
+            if pattern.startswith('\\#') or pattern.startswith('\\!'):
+                pattern = pattern[1:]
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if pattern != '':
+                rules.append((translate_pattern(pattern), negated, dir_only))
+        self.patterns = list(patterns)
+        self.dir_rules, self.dir_expression = self.compile(rules)
+        self.file_rules, self.file_expression = self.compile([rule for rule in rules if not rule[2]])
+
+    @staticmethod
+    def compile(rules):
+        """
+            Compiles rules into one expression whose alternatives are ordered
+            from the last rule to the first, so the matched group is the rule
+            which decides.
+
+                Parameters:
+                    rules (list): list of (expression, negated, directory only) tuples
+
+                Returns:
+                    compiled (tuple): reversed rules and the compiled expression, None if there are no rules
+        """
+        rules = list(reversed(rules))
+        if len(rules) == 0:
+            return rules, None
+        return rules, re.compile('|'.join(['(%s)' % rule[0] for rule in rules]), re.DOTALL)
+
+    def ignored(self, relative_path, is_dir=False):
+        """
+            Find that a path is ignored.
+
+                Parameters:
+                    relative_path (string): path relative to the service root, separated by '/'
+                    is_dir (boolean): true, if the path is a directory
+
+                Returns:
+                    ignored (boolean): true, if the path is ignored
+        """
+        rules, expression = (self.dir_rules, self.dir_expression) if is_dir else \
+            (self.file_rules, self.file_expression)
+        if expression is None:
+            return False
+        match = expression.fullmatch(relative_path)
+        return match is not None and not rules[match.lastindex - 1][1]
+
+
+def read_ignore_patterns(config_dir):
+    """
+        Reads the patterns of the gostep ignore file. Patterns are separated by
+        white spaces or new lines and lines starting with '#' are comments.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+
+            Returns:
+                patterns (list): list of patterns
+    """
+    patterns = []
+    with open(os.path.join(config_dir, GOSTEP_IGNORE_FILE)) as ignore_file:
+        for line in ignore_file:
+            if not line.lstrip().startswith('#'):
+                patterns.extend(line.split())
+    return patterns
+
+
+def get_ignore_matcher(config_dir):
+    """
+        Returns the compiled ignore matcher of a service. Matchers are compiled
+        once and recompiled only when the ignore file changes.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+
+            Returns:
+                matcher (IgnoreMatcher): compiled matcher, None if there is no ignore file
+    """
+    ignore_file = os.path.join(os.path.abspath(config_dir), GOSTEP_IGNORE_FILE)
+    try:
+        file_stat = os.stat(ignore_file)
+    except OSError:
+        return None
+    key = (ignore_file, file_stat.st_mtime_ns, file_stat.st_size)
+    with ignore_matchers_lock:
+        matcher = ignore_matchers.get(key)
+    if matcher is None:
+        matcher = IgnoreMatcher(read_ignore_patterns(config_dir))
+        with ignore_matchers_lock:
+            ignore_matchers[key] = matcher
+    return matcher
+
+
+def get_archive_matcher(config_dir):
+    """
+        Returns the ignore matcher of a service extended with the files which
+        are kept out of source archives, like the function specification.
+
+            Parameters:
+                config_dir (string): path where gostep config files exists
+
+            Returns:
+                matcher (IgnoreMatcher): compiled matcher
+    """
+    ignore_file = os.path.join(os.path.abspath(config_dir), GOSTEP_IGNORE_FILE)
+    try:
+        file_stat = os.stat(ignore_file)
+        key = ('archive', ignore_file, file_stat.st_mtime_ns, file_stat.st_size)
+    except OSError:
+        file_stat = None
+        key = ('archive', None)
+    with ignore_matchers_lock:
+        matcher = ignore_matchers.get(key)
+    if matcher is None:
+        patterns = read_ignore_patterns(config_dir) if file_stat is not None else []
+        matcher = IgnoreMatcher(patterns + ARCHIVE_EXCLUDED_PATTERNS)
+        with ignore_matchers_lock:
+            ignore_matchers[key] = matcher
+    return matcher
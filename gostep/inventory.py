@@ -0,0 +1,97 @@
+import threading
+
+from gostep.consts import NAME, INVENTORY_FIELDS, RESPONSE, ERROR
+from gostep.gcloud_ops import get_cloud_functions, get_cloud_functions_by_name
+
+inventory = {}
+inventory_lock = threading.Lock()
+location_locks = {}
+
+
+def get_location_lock(location_path):
+    """
+        Returns the lock guarding the listing of a location.
+
+            Parameters:
+                location_path (string): location path as 'projects/{project_id}/locations/{location_id}'
+
+            Returns:
+                lock (Lock): lock of the location
+    """
+    with inventory_lock:
+        if location_path not in location_locks:
+            location_locks[location_path] = threading.Lock()
+        return location_locks[location_path]
+
+
+def get_inventory(location_path):
+    """
+        Returns the cloud functions of a location keyed by function name,
+        listing the location only once per process.
+
+            Parameters:
+                location_path (string): location path as 'projects/{project_id}/locations/{location_id}'
+
+            Returns:
+                functions (dictionary): function name against function object,
+                None for functions whose details are stale
+    """
+    with get_location_lock(location_path):
+        if location_path not in inventory:
+            functions = get_cloud_functions(location_path, INVENTORY_FIELDS)
+            if functions is None:
+                raise RuntimeError(''.join(['Unable to list cloud functions in ', location_path, '.']))
+            inventory[location_path] = {function[NAME]: function for function in functions}
+        return inventory[location_path]
+
+
+def cloud_function_exists(name, location_path):
+    """
+        Find that function already has been deployed.
+
+            Parameters:
+                name (string): full name of the function
+                location_path (string): location path of the functions
+
+            Returns:
+                is_exists (boolean): true, if function already has been deployed
+    """
+    return name in get_inventory(location_path)
+
+
+def invalidate_cloud_function(name, location_path):
+    """
+        Marks a function as deployed with stale details after a create or patch.
+
+            Parameters:
+                name (string): full name of the function
+                location_path (string): location path of the functions
+    """
+    with get_location_lock(location_path):
+        if location_path in inventory:
+            inventory[location_path][name] = None
+
+
+def refresh_cloud_functions(names):
+    """
+        Fetches the details of many deployed functions with batched requests
+        and stores them in the inventory.
+
+            Parameters:
+                names (list): full names of the functions
+
+            Returns:
+                errors (dictionary): function name against the error of its request
+    """
+    results = get_cloud_functions_by_name(names) or {}
+    errors = {}
+    for name in names:
+        result = results.get(name, {RESPONSE: None, ERROR: 'No response.'})
+        if result[ERROR] is not None:
+            errors[name] = result[ERROR]
+            continue
+        location_path = name.rsplit('/functions/', 1)[0]
+        with get_location_lock(location_path):
+            if location_path in inventory:
+                inventory[location_path][name] = result[RESPONSE]
+    return errors
@@ -0,0 +1,159 @@
+import json
+import os
+import threading
+import time
+import traceback
+
+from gostep.consts import GOSTEP_CACHE_DIR, METADATA_CACHE_FILE, METADATA_TTLS
+from gostep.file_manager import write_file_atomically
+
+metadata_settings = {'offline': False}
+metadata_lock = threading.Lock()
+
+
+def set_metadata_offline(offline):
+    """
+        Switches cached metadata to be served without network calls, however
+        old it is.
+
+            Parameters:
+                offline (boolean): serve cached metadata without network calls
+    """
+    with metadata_lock:
+        metadata_settings['offline'] = offline
+
+
+def get_metadata_offline():
+    """
+        Find that cached metadata is served without network calls.
+
+            Returns:
+                offline (boolean): true, if network calls are not made
+    """
+    with metadata_lock:
+        return metadata_settings['offline']
+
+
+def get_metadata_file():
+    """
+        Returns the machine wide metadata cache file.
+
+            Returns:
+                metadata_file (string): path to metadata cache file
+    """
+    return os.path.join(GOSTEP_CACHE_DIR, METADATA_CACHE_FILE)
+
+
+def load_metadata():
+    """
+        Reads the metadata cache.
+
+            Returns:
+                metadata (dictionary): cache key against the cached value and
+                the time it has been fetched
+    """
+    try:
+        with open(get_metadata_file()) as metadata_file:
+            return json.load(metadata_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_metadata(metadata):
+    """
+        Replaces the metadata cache.
+
+            Parameters:
+                metadata (dictionary): cache key against the cached value and
+                the time it has been fetched
+    """
+    write_file_atomically(get_metadata_file(), json.dumps(metadata, indent=4))
+
+
+def update_metadata(key, value):
+    """
+        Records a fetched value in the metadata cache.
+
+            Parameters:
+                key (string): cache key
+                value (object): fetched value
+    """
+    try:
+        with metadata_lock:
+            metadata = load_metadata()
+            metadata[key] = {'value': value, 'fetched_at': time.time()}
+            write_metadata(metadata)
+    except OSError:
+        print(traceback.format_exc())
+
+
+def get_metadata(kind, scope, loader):
+    """
+        Returns cached metadata, fetching it only when the cached value is
+        older than the time to live of its kind. A stale value is served in
+        offline mode and when it can not be fetched.
+
+            Parameters:
+                kind (string): metadata kind, a key of METADATA_TTLS
+                scope (string): project id the metadata belongs to, None if it is global
+                loader (function): function fetching the value
+
+            Returns:
+                value (object): cached or fetched value, None if it is not known
+    """
+    key = kind if scope is None else '/'.join([kind, scope])
+    entry = load_metadata().get(key)
+    offline = get_metadata_offline()
+    if entry is not None and (offline or time.time() - entry['fetched_at'] < METADATA_TTLS[kind]):
+        return entry['value']
+    if offline:
+        print('Metadata %s is not cached. It can not be fetched in offline mode.' % key)
+        return None
+    try:
+        value = loader()
+    except Exception:
+        if entry is None:
+            raise
+        print('Unable to fetch %s, cached metadata has been used.' % key)
+        return entry['value']
+    if value is not None:
+        update_metadata(key, value)
+    return value
+
+
+def forget_metadata(kind, scope=None):
+    """
+        Removes a cached value, so the next lookup fetches it again.
+
+            Parameters:
+                kind (string): metadata kind, a key of METADATA_TTLS
+                scope (string): project id the metadata belongs to, None if it is global
+    """
+    key = kind if scope is None else '/'.join([kind, scope])
+    try:
+        with metadata_lock:
+            metadata = load_metadata()
+            if metadata.pop(key, None) is not None:
+                write_metadata(metadata)
+    except OSError:
+        print(traceback.format_exc())
+
+
+def refresh_metadata(kind, scope, loader):
+    """
+        Fetches a value however recently it has been cached, and replaces the
+        cached value only when the fetch succeeds.
+
+            Parameters:
+                kind (string): metadata kind, a key of METADATA_TTLS
+                scope (string): project id the metadata belongs to, None if it is global
+                loader (function): function fetching the value
+
+            Returns:
+                value (object): fetched value, None if it could not be fetched
+    """
+    key = kind if scope is None else '/'.join([kind, scope])
+    value = loader()
+    if value is not None:
+        update_metadata(key, value)
+    return value
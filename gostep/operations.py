@@ -0,0 +1,108 @@
+import random
+import time
+
+from gostep.consts import OPERATION_POLL_INITIAL_DELAY, OPERATION_POLL_MAX_DELAY, DEPLOY_TIMEOUT, DONE, ERROR, \
+    RESPONSE, LATENCY, OPERATION_MAX_LOOKUP_FAILURES
+from gostep.gcloud_ops import get_operation
+
+
+def get_poll_delay(attempt):
+    """
+        Returns the delay before the next poll using exponential backoff with
+        jitter.
+
+            Parameters:
+                attempt (int): number of polls already made for the operation
+
+            Returns:
+                delay (float): delay in seconds
+    """
+    delay = min(OPERATION_POLL_MAX_DELAY, OPERATION_POLL_INITIAL_DELAY * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+
+def wait_for_operations(operations, timeout=DEPLOY_TIMEOUT):
+    """
+        Polls many long running operations from a single loop until every one
+        of them has finished or the deadline has been reached. Operations which
+        can not be looked up several times in a row are given up as failed.
+
+            Parameters:
+                operations (dictionary): operation name against the time it has been started
+                timeout (float): deadline in seconds, None to wait forever
+
+            Returns:
+                results (dictionary): operation name against an object containing
+                done, error, response and latency
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    pending = {name: {'attempt': 0, 'failures': 0, 'next_poll': time.time()} for name in operations.keys()}
+    results = {}
+    while len(pending) != 0:
+        now = time.time()
+        if deadline is not None and now >= deadline:
+            break
+        for name in [key for key in pending.keys() if pending[key]['next_poll'] <= now]:
+            operation = get_operation(name)
+            if operation is not None and operation.get(DONE):
+                results[name] = {
+                    DONE: True,
+                    ERROR: operation.get(ERROR),
+                    RESPONSE: operation.get(RESPONSE),
+                    LATENCY: time.time() - operations[name]
+                }
+                del pending[name]
+            elif operation is None and pending[name]['failures'] + 1 >= OPERATION_MAX_LOOKUP_FAILURES:
+                results[name] = {
+                    DONE: False,
+                    ERROR: {'message': 'Operation could not be looked up %d times in a row.' %
+                                       OPERATION_MAX_LOOKUP_FAILURES},
+                    RESPONSE: None,
+                    LATENCY: time.time() - operations[name]
+                }
+                del pending[name]
+            else:
+                pending[name]['failures'] = pending[name]['failures'] + 1 if operation is None else 0
+                pending[name]['next_poll'] = time.time() + get_poll_delay(pending[name]['attempt'])
+                pending[name]['attempt'] += 1
+        if len(pending) != 0:
+            next_poll = min(state['next_poll'] for state in pending.values())
+            if deadline is not None:
+                next_poll = min(next_poll, deadline)
+            time.sleep(max(0.0, next_poll - time.time()))
+    for name in pending.keys():
+        results[name] = {
+            DONE: False,
+            ERROR: {'message': 'Deadline of %s seconds exceeded.' % timeout},
+            RESPONSE: None,
+            LATENCY: time.time() - operations[name]
+        }
+    return results
+
+
+def operation_succeeded(result):
+    """
+        Find that a finished operation has been completed without an error.
+
+            Parameters:
+                result (dictionary): operation result returned by wait_for_operations
+
+            Returns:
+                succeeded (boolean): true, if the operation has been succeeded
+    """
+    return result[DONE] and result[ERROR] is None
+
+
+def describe_operation(result):
+    """
+        Returns a line describing the outcome and latency of an operation.
+
+            Parameters:
+                result (dictionary): operation result returned by wait_for_operations
+
+            Returns:
+                description (string): outcome of the operation
+    """
+    if operation_succeeded(result):
+        return 'succeeded in %.1fs' % result[LATENCY]
+    return 'failed in %.1fs: %s' % (result[LATENCY], result[ERROR].get('message', result[ERROR]))
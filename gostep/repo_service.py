@@ -1,28 +1,147 @@
+import json
+import os
+import shutil
+import threading
+import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 
-from svn import remote
+from gostep.consts import TEMPLATE_REPO, GOSTEP_CACHE_DIR, TEMPLATES_CACHE_DIR, TEMPLATES_INDEX_FILE, \
+    TEMPLATE_REFRESH_INTERVAL, TEMPLATE_FETCH_WORKERS, ENVIRONMENTS, TRIGGERS
+from gostep.file_manager import link_dir, write_file_atomically
 
-from gostep.consts import TEMPLATE_REPO
+templates_index_lock = threading.Lock()
 
 
-def clone_template(environment, target_dir):
+def get_templates_cache_dir():
     """
-        Observe serverless template and returns the directory path.
+        Returns the machine wide template cache directory.
+
+            Returns:
+                cache_dir (string): path to template cache
+    """
+    return os.path.join(GOSTEP_CACHE_DIR, TEMPLATES_CACHE_DIR)
+
+
+def load_templates_index():
+    """
+        Reads the template cache index.
+
+            Returns:
+                index (dictionary): template id against cached revision and
+                the time it has been checked
+    """
+    try:
+        with open(os.path.join(get_templates_cache_dir(), TEMPLATES_INDEX_FILE)) as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def update_templates_index(template_id, revision):
+    """
+        Records the latest revision of a template in the template cache index.
 
             Parameters:
-                kind (string): root directory of the repo
-                environment (string): sublevel directory of the repo
-                target_dir (string): download target
+                template_id (string): template id as <environment>/<trigger>
+                revision (string): latest revision of the template
+    """
+    with templates_index_lock:
+        index = load_templates_index()
+        index[template_id] = {'revision': revision, 'checked_at': time.time()}
+        index_file = os.path.join(get_templates_cache_dir(), TEMPLATES_INDEX_FILE)
+        write_file_atomically(index_file, json.dumps(index, indent=4))
+
+
+def get_template_revision(template_id, offline=False):
+    """
+        Returns the latest revision of a template. The template store is asked
+        only for the revision, and only when the cached one has not been
+        checked within the refresh interval.
+
+            Parameters:
+                template_id (string): template id as <environment>/<trigger>
+                offline (boolean): use the cached revision without a network call
 
             Returns:
-                template_dir (str): path of downloaded template
+                revision (string): latest revision, None if it is not known
+    """
+    entry = load_templates_index().get(template_id)
+    if offline or (entry is not None and time.time() - entry['checked_at'] < TEMPLATE_REFRESH_INTERVAL):
+        return None if entry is None else entry['revision']
+    from svn import remote
+    template = ''.join([TEMPLATE_REPO, '/function/', template_id])
+    revision = str(remote.RemoteClient(template).info()['commit_revision'])
+    update_templates_index(template_id, revision)
+    return revision
+
+
+def fetch_template(template_id, offline=False):
+    """
+        Returns the path of a template in the machine wide template cache,
+        downloading it if the cache does not have its latest revision.
+
+            Parameters:
+                template_id (string): template id as <environment>/<trigger>
+                offline (boolean): use cached templates without network calls
+
+            Returns:
+                template_dir (str): path of cached template
     """
     try:
-        template = ''.join([TEMPLATE_REPO, '/function/', environment])
-        print("Getting %s template..." % environment)
-        svn_client = remote.RemoteClient(template)
-        svn_client.checkout(target_dir)
-        print("Successfully fetched template")
-        return target_dir
+        revision = get_template_revision(template_id, offline)
+        if revision is None:
+            print('Template %s is not cached. It can not be fetched in offline mode.' % template_id)
+            return None
+        template_dir = os.path.join(get_templates_cache_dir(), template_id, revision)
+        if not os.path.exists(template_dir):
+            from svn import remote
+            print("Getting %s template..." % template_id)
+            temp_dir = '%s.%d.%d.tmp' % (template_dir, os.getpid(), threading.get_ident())
+            template = ''.join([TEMPLATE_REPO, '/function/', template_id])
+            os.makedirs(os.path.dirname(template_dir), exist_ok=True)
+            remote.RemoteClient(template).export(temp_dir, revision=revision)
+            try:
+                os.rename(temp_dir, template_dir)
+            except OSError:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            print("Successfully fetched template")
+        return template_dir
     except Exception:
         print(traceback.format_exc())
+
+
+def prefetch_templates(offline=False):
+    """
+        Fetches every environment and trigger template into the machine wide
+        template cache in parallel.
+
+            Parameters:
+                offline (boolean): check cached templates without network calls
+
+            Returns:
+                templates (dictionary): template id against cached template path
+    """
+    template_ids = [''.join([environment, '/', trigger]) for environment in ENVIRONMENTS for trigger in TRIGGERS]
+    with ThreadPoolExecutor(max_workers=TEMPLATE_FETCH_WORKERS) as executor:
+        template_dirs = list(executor.map(lambda template_id: fetch_template(template_id, offline), template_ids))
+    return dict(zip(template_ids, template_dirs))
+
+
+def clone_template(template_id, target_dir, offline=False):
+    """
+        Materializes a cached template into a workspace with linked files and
+        returns the directory path.
+
+            Parameters:
+                template_id (string): template id as <environment>/<trigger>
+                target_dir (string): materialization target
+                offline (boolean): use cached templates without network calls
+
+            Returns:
+                template_dir (str): path of materialized template
+    """
+    template_dir = fetch_template(template_id, offline)
+    if template_dir is None:
+        return None
+    return link_dir(template_dir, target_dir)
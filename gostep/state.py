@@ -0,0 +1,343 @@
+import copy
+import json
+import os
+import re
+import threading
+import traceback
+from contextlib import contextmanager
+
+from gostep.consts import BASE_CONFIG_FILE, SERVICES, GOSTEP_STATE_DIR, SERVICES_STATE_DIR, STATE_INDEX_FILE, \
+    STATE_LOCK_FILE, STATE_VERSION, STATE_MANAGED_FIELDS, STATE_GITIGNORE_FILE, STATE_IGNORED_PATTERNS
+from gostep.file_manager import write_file_atomically
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+state_lock = threading.Lock()
+state_files = {}
+state_files_lock = threading.Lock()
+migrated_configs = set()
+
+
+def get_state_dir(workspace_dir):
+    """
+        Returns the directory holding the state of a workspace.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                state_dir (string): path to state directory
+    """
+    return os.path.join(workspace_dir, GOSTEP_STATE_DIR)
+
+
+def valid_service_key(service_key):
+    """
+        Find that a service name can be used as a file name.
+
+            Parameters:
+                service_key (string): service name
+
+            Returns:
+                valid (boolean): true, if the name is valid
+    """
+    return re.fullmatch('[A-Za-z0-9][A-Za-z0-9_.-]*', service_key) is not None
+
+
+def get_service_file(workspace_dir, service_key):
+    """
+        Returns the file holding the entry of a service.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                service_key (string): service name
+
+            Returns:
+                service_file (string): path to service state file
+    """
+    if not valid_service_key(service_key):
+        raise ValueError('Invalid service name %s.' % service_key)
+    return os.path.join(get_state_dir(workspace_dir), SERVICES_STATE_DIR, ''.join([service_key, '.json']))
+
+
+def get_index_file(workspace_dir):
+    """
+        Returns the file listing the services of a workspace.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                index_file (string): path to index file
+    """
+    return os.path.join(get_state_dir(workspace_dir), STATE_INDEX_FILE)
+
+
+def write_state_gitignore(state_dir):
+    """
+        Keeps the lock file, file manifests and temporary files of the state
+        directory out of version control, unless a .gitignore already exists.
+
+            Parameters:
+                state_dir (string): path to state directory
+    """
+    gitignore_file = os.path.join(state_dir, STATE_GITIGNORE_FILE)
+    if not os.path.exists(gitignore_file):
+        write_file_atomically(gitignore_file, ''.join([pattern + '\n' for pattern in STATE_IGNORED_PATTERNS]))
+
+
+@contextmanager
+def locked_state(workspace_dir):
+    """
+        Holds the state of a workspace for writing, against other threads and,
+        with an advisory lock, against other gostep processes.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+    """
+    state_dir = get_state_dir(workspace_dir)
+    with state_lock:
+        os.makedirs(state_dir, exist_ok=True)
+        with open(os.path.join(state_dir, STATE_LOCK_FILE), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                write_state_gitignore(state_dir)
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def read_state_file(state_file):
+    """
+        Reads a state file. Files are parsed once and parsed again only when
+        they have been replaced.
+
+            Parameters:
+                state_file (string): path to state file
+
+            Returns:
+                state (dictionary): file contents, None if the file does not exist
+    """
+    try:
+        file_stat = os.stat(state_file)
+    except FileNotFoundError:
+        return None
+    key = (file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino)
+    with state_files_lock:
+        loaded = state_files.get(state_file)
+    if loaded is None or loaded[0] != key:
+        with open(state_file) as state_file_object:
+            loaded = (key, json.load(state_file_object))
+        with state_files_lock:
+            state_files[state_file] = loaded
+    return copy.deepcopy(loaded[1])
+
+
+def write_state_file(state_file, state):
+    """
+        Replaces a state file atomically.
+
+            Parameters:
+                state_file (string): path to state file
+                state (dictionary): file contents
+    """
+    write_file_atomically(state_file, json.dumps(state, indent=4))
+
+
+def write_index(workspace_dir, service_keys):
+    """
+        Replaces the index of a workspace.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                service_keys (iterable): service names
+    """
+    write_state_file(get_index_file(workspace_dir), {'version': STATE_VERSION, SERVICES: sorted(set(service_keys))})
+
+
+def migrate_services(workspace_dir):
+    """
+        Moves the services found in the base project config into their own
+        state files. Fields edited by hand in config.json are merged into the
+        entries of services which are already in the state, except for the
+        fields gostep keeps itself, so a config.json restored from version
+        control does not reset checksums.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+    """
+    project_spec_file = os.path.join(workspace_dir, BASE_CONFIG_FILE)
+    try:
+        file_stat = os.stat(project_spec_file)
+    except FileNotFoundError:
+        return
+    key = (os.path.abspath(project_spec_file), file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino)
+    if key in migrated_configs:
+        return
+    if read_state_file(project_spec_file).get(SERVICES):
+        with locked_state(workspace_dir):
+            project_spec = read_state_file(project_spec_file)
+            service_keys = load_index(workspace_dir)
+            services = {}
+            merged = {}
+            for service_key, service in (project_spec.get(SERVICES) or {}).items():
+                if service_key not in service_keys:
+                    services[service_key] = service
+                    write_state_file(get_service_file(workspace_dir, service_key), service)
+                    continue
+                service_file = get_service_file(workspace_dir, service_key)
+                stored = read_state_file(service_file) or {}
+                fields = {field: value for field, value in service.items()
+                          if field not in STATE_MANAGED_FIELDS and stored.get(field) != value}
+                if len(fields) != 0:
+                    stored.update(fields)
+                    write_state_file(service_file, stored)
+                    merged[service_key] = sorted(fields.keys())
+            if len(services) != 0:
+                write_index(workspace_dir, service_keys + list(services.keys()))
+            if project_spec.get(SERVICES):
+                project_spec[SERVICES] = {}
+                write_state_file(project_spec_file, project_spec)
+        if len(services) != 0:
+            print('%d services have been moved from %s to %s.' % (
+                len(services), BASE_CONFIG_FILE, os.path.join(GOSTEP_STATE_DIR, SERVICES_STATE_DIR)))
+        for service_key, fields in sorted(merged.items()):
+            print('%s of %s in %s have been merged into %s.' % (
+                ', '.join(fields), service_key, BASE_CONFIG_FILE,
+                os.path.relpath(get_service_file(workspace_dir, service_key), workspace_dir)))
+        file_stat = os.stat(project_spec_file)
+        key = (os.path.abspath(project_spec_file), file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino)
+    migrated_configs.add(key)
+
+
+def load_index(workspace_dir):
+    """
+        Reads the service names of a workspace, without migrating.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                service_keys (list): sorted service names
+    """
+    index = read_state_file(get_index_file(workspace_dir))
+    return [] if index is None else index[SERVICES]
+
+
+def get_service_keys(workspace_dir):
+    """
+        Returns the names of every service of a workspace.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                service_keys (list): sorted service names
+    """
+    migrate_services(workspace_dir)
+    return load_index(workspace_dir)
+
+
+def get_service(workspace_dir, service_key):
+    """
+        Returns the entry of a service, reading only its own state file.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                service_key (string): service name
+
+            Returns:
+                service (dictionary): service entry, None if the service does not exist
+    """
+    migrate_services(workspace_dir)
+    if not valid_service_key(service_key):
+        return None
+    return read_state_file(get_service_file(workspace_dir, service_key))
+
+
+def get_services(workspace_dir, service_keys=None):
+    """
+        Returns the entries of many services.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                service_keys (iterable): service names, None for every service
+
+            Returns:
+                services (dictionary): service name against its entry
+    """
+    migrate_services(workspace_dir)
+    services = {}
+    for service_key in load_index(workspace_dir) if service_keys is None else service_keys:
+        service = read_state_file(get_service_file(workspace_dir, service_key)) \
+            if valid_service_key(service_key) else None
+        if service is not None:
+            services[service_key] = service
+    return services
+
+
+def put_service(workspace_dir, service_key, service):
+    """
+        Stores the entry of a service, adding it to the index if it is new.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                service_key (string): service name
+                service (dictionary): service entry
+    """
+    migrate_services(workspace_dir)
+    with locked_state(workspace_dir):
+        write_state_file(get_service_file(workspace_dir, service_key), service)
+        service_keys = load_index(workspace_dir)
+        if service_key not in service_keys:
+            write_index(workspace_dir, service_keys + [service_key])
+
+
+def update_services(workspace_dir, changes):
+    """
+        Updates fields of many services. Every entry is read again while the
+        state is held, so updates made by other processes are kept.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                changes (dictionary): service name against the fields to set
+
+            Returns:
+                services (dictionary): service name against its updated entry
+    """
+    migrate_services(workspace_dir)
+    services = {}
+    try:
+        with locked_state(workspace_dir):
+            for service_key, fields in changes.items():
+                service_file = get_service_file(workspace_dir, service_key)
+                service = read_state_file(service_file)
+                if service is None:
+                    continue
+                service.update(fields)
+                write_state_file(service_file, service)
+                services[service_key] = service
+    except Exception:
+        print(traceback.format_exc())
+    return services
+
+
+def load_project_spec(workspace_dir):
+    """
+        Reads the base project config with the entries of every service.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+
+            Returns:
+                project_spec (dictionary): base project config
+    """
+    migrate_services(workspace_dir)
+    project_spec = read_state_file(os.path.join(workspace_dir, BASE_CONFIG_FILE))
+    project_spec[SERVICES] = get_services(workspace_dir)
+    return project_spec
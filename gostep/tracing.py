@@ -0,0 +1,237 @@
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from functools import wraps
+
+trace_settings = {'enabled': False, 'origin': time.perf_counter()}
+trace_events = []
+trace_threads = {}
+trace_counters = {'api_calls': {}, 'bytes': {}}
+trace_lock = threading.Lock()
+trace_context = threading.local()
+
+
+def get_timestamp():
+    """
+        Returns the time since tracing has been started in microseconds.
+
+            Returns:
+                timestamp (float): microseconds since the trace origin
+    """
+    return (time.perf_counter() - trace_settings['origin']) * 1000000
+
+
+@contextmanager
+def span(name, category='phase', service=None, **args):
+    """
+        Records the duration of a block as a complete trace event. Spans
+        started inside the block inherit its service.
+
+            Parameters:
+                name (string): phase name
+                category (string): phase category
+                service (string): service name, None to inherit it
+                args (dictionary): values shown with the event
+
+            Returns:
+                args (dictionary): event values, which may be added to inside the block
+    """
+    if not trace_settings['enabled']:
+        yield args
+        return
+    parent_service = getattr(trace_context, 'service', None)
+    trace_context.service = parent_service if service is None else service
+    started_at = get_timestamp()
+    try:
+        yield args
+    finally:
+        duration = get_timestamp() - started_at
+        if trace_context.service is not None:
+            args['service'] = trace_context.service
+        trace_context.service = parent_service
+        thread = threading.current_thread()
+        with trace_lock:
+            trace_threads[thread.ident] = thread.name
+            trace_events.append({
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': started_at,
+                'dur': duration,
+                'pid': os.getpid(),
+                'tid': thread.ident,
+                'args': args
+            })
+
+
+def traced(name, category='phase'):
+    """
+        Returns a decorator recording every call of a function as a span.
+
+            Parameters:
+                name (string): phase name
+                category (string): phase category
+
+            Returns:
+                decorator (function): span decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def api_call(name):
+    """
+        Returns a decorator recording every call of a function as an API span
+        and counting it.
+
+            Parameters:
+                name (string): API method name
+
+            Returns:
+                decorator (function): span decorator
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            count_api_call(name)
+            with span(name, 'api'):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_api_call(name, count=1):
+    """
+        Counts calls made to a cloud API.
+
+            Parameters:
+                name (string): API method name
+                count (int): number of calls
+    """
+    if trace_settings['enabled']:
+        with trace_lock:
+            trace_counters['api_calls'][name] = trace_counters['api_calls'].get(name, 0) + count
+
+
+def count_bytes(name, count):
+    """
+        Counts bytes moved by a phase.
+
+            Parameters:
+                name (string): phase name
+                count (int): number of bytes
+    """
+    if trace_settings['enabled'] and count is not None:
+        with trace_lock:
+            trace_counters['bytes'][name] = trace_counters['bytes'].get(name, 0) + count
+
+
+def get_trace_summary():
+    """
+        Summarizes recorded spans as durations per phase and per service, with
+        API call and byte counts.
+
+            Returns:
+                summary (dictionary): phases, services, api calls and bytes
+    """
+    with trace_lock:
+        events = list(trace_events)
+        counters = json.loads(json.dumps(trace_counters))
+    phases = {}
+    services = {}
+    for event in events:
+        phase = phases.setdefault(event['name'], {'count': 0, 'seconds': 0.0})
+        phase['count'] += 1
+        phase['seconds'] += event['dur'] / 1000000
+        if 'service' in event['args']:
+            service = services.setdefault(event['args']['service'], {})
+            service[event['name']] = service.get(event['name'], 0.0) + event['dur'] / 1000000
+    return {'phases': phases, 'services': services, 'api_calls': counters['api_calls'], 'bytes': counters['bytes']}
+
+
+def write_trace(trace_file):
+    """
+        Writes recorded spans in Chrome trace event format, with a summary of
+        durations and counters.
+
+            Parameters:
+                trace_file (string): path to trace file
+    """
+    try:
+        with trace_lock:
+            events = list(trace_events)
+            threads = dict(trace_threads)
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': ident, 'args': {'name': name}}
+                    for ident, name in threads.items()]
+        with open(trace_file, 'w') as trace_file_object:
+            json.dump({
+                'traceEvents': metadata + events,
+                'displayTimeUnit': 'ms',
+                'summary': get_trace_summary()
+            }, trace_file_object, indent=4)
+        print('Trace has been written to %s' % trace_file)
+    except Exception:
+        print(traceback.format_exc())
+
+
+def start_trace(trace_file):
+    """
+        Enables tracing and writes the trace when the process exits.
+
+            Parameters:
+                trace_file (string): path to trace file
+    """
+    trace_settings['enabled'] = True
+    trace_settings['origin'] = time.perf_counter()
+    atexit.register(write_trace, os.path.abspath(trace_file))
+
+
+def start_profile(profile_file):
+    """
+        Profiles the whole command with cProfile and dumps the statistics of
+        every thread, merged, when the process exits. Before Python 3.12 a
+        profiler only sees the thread which enabled it, so each new thread
+        starts its own.
+
+            Parameters:
+                profile_file (string): path to profile statistics file
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    thread_profilers = []
+    profile_file = os.path.abspath(profile_file)
+
+    def start_thread_profile(frame, event, arg):
+        thread_profiler = cProfile.Profile()
+        with trace_lock:
+            thread_profilers.append(thread_profiler)
+        thread_profiler.enable()
+
+    def dump_profile():
+        threading.setprofile(None)
+        profiler.disable()
+        with trace_lock:
+            profilers = list(thread_profilers)
+        stats = pstats.Stats(profiler)
+        for thread_profiler in profilers:
+            thread_profiler.create_stats()
+            if len(thread_profiler.stats) != 0:
+                stats.add(thread_profiler)
+        stats.dump_stats(profile_file)
+        print('Profile has been written to %s (%d threads)' % (profile_file, len(profilers) + 1))
+
+    atexit.register(dump_profile)
+    if sys.version_info < (3, 12):
+        threading.setprofile(start_thread_profile)
+    profiler.enable()
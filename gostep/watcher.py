@@ -0,0 +1,325 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from gostep.aggregator import deploy_all, get_service_checksum
+from gostep.consts import SOURCE_DIRECTORY, CHECKSUM, ENVIRONMENT, JAVA_RUNTIME, BUILD_IGNORE_PATTERNS, \
+    IN_NONBLOCK, IN_CLOEXEC, IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE, IN_MOVED_FROM, \
+    IN_MOVED_TO, IN_CREATE, IN_DELETE, IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR, IN_DONT_FOLLOW, IN_ISDIR, \
+    INOTIFY_READ_SIZE, WATCH_DEBOUNCE, WATCH_MAX_DELAY, WATCH_POLL_INTERVAL
+from gostep.hashing import list_files
+from gostep.ignore import IgnoreMatcher, get_ignore_matcher
+from gostep.state import get_services
+
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_ONLYDIR | IN_DONT_FOLLOW
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+class ServiceTree(object):
+    """
+        Source directory of a watched service and the patterns of the files
+        whose changes do not affect its deployment.
+    """
+
+    def __init__(self, service_key, service_dir, java):
+        self.service_key = service_key
+        self.service_dir = service_dir
+        self.java = java
+        self.base_matcher = None
+        self.matcher = None
+
+    def get_matcher(self):
+        """
+            Returns the ignore matcher of the service, compiled again when its
+            ignore file changes. Build outputs of Java services are ignored.
+
+                Returns:
+                    matcher (IgnoreMatcher): compiled matcher, None if nothing is ignored
+        """
+        base_matcher = get_ignore_matcher(self.service_dir)
+        if self.matcher is None or base_matcher is not self.base_matcher:
+            patterns = [] if base_matcher is None else base_matcher.patterns
+            patterns = patterns + BUILD_IGNORE_PATTERNS if self.java else patterns
+            self.base_matcher = base_matcher
+            self.matcher = IgnoreMatcher(patterns) if len(patterns) != 0 else None
+        return self.matcher
+
+    def ignored(self, relative_path, is_dir=False):
+        """
+            Find that a path does not affect the deployment of the service.
+
+                Parameters:
+                    relative_path (string): path relative to the service root, separated by '/'
+                    is_dir (boolean): true, if the path is a directory
+
+                Returns:
+                    ignored (boolean): true, if the path is ignored
+        """
+        matcher = self.get_matcher()
+        return matcher is not None and matcher.ignored(relative_path, is_dir)
+
+
+class InotifyWatcher(object):
+    """
+        Watches service directories with Linux inotify, called through
+        ctypes. Every directory which is not ignored gets a watch, and
+        directories created later are watched as they appear.
+    """
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.trees = []
+        self.watches = {}
+
+    def add_service(self, tree):
+        """
+            Watches the source directory of a service.
+
+                Parameters:
+                    tree (ServiceTree): watched service
+        """
+        self.trees.append(tree)
+        self.watch_dir(tree, '')
+
+    def watch_dir(self, tree, relative_dir):
+        """
+            Watches a directory of a service and every directory below it which
+            is not ignored.
+
+                Parameters:
+                    tree (ServiceTree): watched service
+                    relative_dir (string): directory relative to the service root, '' for the root
+        """
+        dir_path = os.path.join(tree.service_dir, relative_dir) if relative_dir else tree.service_dir
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), INOTIFY_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error in [errno.ENOENT, errno.ENOTDIR, errno.EACCES]:
+                return
+            raise OSError(error, os.strerror(error), dir_path)
+        self.watches[wd] = (tree, relative_dir)
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            return
+        for entry in entries:
+            relative_path = '/'.join([relative_dir, entry.name]) if relative_dir else entry.name
+            if entry.is_dir(follow_symlinks=False) and not tree.ignored(relative_path, True):
+                self.watch_dir(tree, relative_path)
+
+    def read(self, timeout=None):
+        """
+            Waits for changes and returns the services they affect.
+
+                Parameters:
+                    timeout (float): seconds to wait, None to wait until something changes
+
+                Returns:
+                    changed (set): names of the changed services, empty if nothing changed in time
+        """
+        changed = set()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return changed
+        while True:
+            try:
+                data = os.read(self.fd, INOTIFY_READ_SIZE)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, name_size = INOTIFY_EVENT.unpack_from(data, offset)
+                name = os.fsdecode(data[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_size]
+                                   .rstrip(b'\0'))
+                offset += INOTIFY_EVENT.size + name_size
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(tree.service_key for tree in self.trees)
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches:
+                    continue
+                tree, relative_dir = self.watches[wd]
+                relative_path = '/'.join([relative_dir, name]) if relative_dir else name
+                is_dir = mask & IN_ISDIR != 0
+                if name == '' or tree.ignored(relative_path, is_dir):
+                    continue
+                if is_dir and mask & (IN_CREATE | IN_MOVED_TO):
+                    self.watch_dir(tree, relative_path)
+                changed.add(tree.service_key)
+
+    def close(self):
+        """
+            Stops watching.
+        """
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+        Watches service directories by comparing the size, modification time
+        and inode of their files, for systems without inotify.
+    """
+
+    def __init__(self):
+        self.trees = []
+        self.snapshots = {}
+
+    def get_snapshot(self, tree):
+        """
+            Returns the state of every file of a service which is not ignored.
+
+                Parameters:
+                    tree (ServiceTree): watched service
+
+                Returns:
+                    snapshot (dictionary): relative path against size, modification time and inode
+        """
+        snapshot = {}
+        for relative_path, file_path in list_files(tree.service_dir, tree.get_matcher()):
+            try:
+                file_stat = os.stat(file_path)
+                snapshot[relative_path] = (file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino)
+            except OSError:
+                continue
+        return snapshot
+
+    def add_service(self, tree):
+        """
+            Watches the source directory of a service.
+
+                Parameters:
+                    tree (ServiceTree): watched service
+        """
+        self.trees.append(tree)
+        self.snapshots[tree.service_key] = self.get_snapshot(tree)
+
+    def read(self, timeout=None):
+        """
+            Waits for one polling interval, or less if the timeout is shorter,
+            and returns the services whose files changed.
+
+                Parameters:
+                    timeout (float): seconds to wait, None for a polling interval
+
+                Returns:
+                    changed (set): names of the changed services
+        """
+        time.sleep(WATCH_POLL_INTERVAL if timeout is None else min(timeout, WATCH_POLL_INTERVAL))
+        changed = set()
+        for tree in self.trees:
+            snapshot = self.get_snapshot(tree)
+            if snapshot != self.snapshots[tree.service_key]:
+                self.snapshots[tree.service_key] = snapshot
+                changed.add(tree.service_key)
+        return changed
+
+    def close(self):
+        """
+            Stops watching.
+        """
+        self.snapshots = {}
+
+
+def create_watcher():
+    """
+        Returns an inotify watcher, or a polling watcher where inotify is not
+        available.
+
+            Returns:
+                watcher (object): InotifyWatcher or PollingWatcher
+    """
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError):
+        print('Inotify is not available, source directories will be polled.')
+        return PollingWatcher()
+
+
+def wait_for_changes(watcher):
+    """
+        Waits for changes and collects the ones which follow them within the
+        debounce interval, so a burst of edits is deployed once.
+
+            Parameters:
+                watcher (object): InotifyWatcher or PollingWatcher
+
+            Returns:
+                changed (set): names of the changed services
+    """
+    changed = watcher.read()
+    started_at = time.time()
+    while len(changed) != 0 and time.time() - started_at < WATCH_MAX_DELAY:
+        burst = watcher.read(WATCH_DEBOUNCE)
+        if len(burst) == 0:
+            break
+        changed.update(burst)
+    return changed
+
+
+def get_changed_services(workspace_dir, service_keys):
+    """
+        Returns the services whose sources differ from their last deployment,
+        dropping the ones only touched by gostep itself.
+
+            Parameters:
+                workspace_dir (string): workspace directory path
+                service_keys (set): names of the services to check
+
+            Returns:
+                changed (set): names of the services to deploy
+    """
+    return {service_key for service_key, service in get_services(workspace_dir, service_keys).items()
+            if get_service_checksum(workspace_dir, service) != service[CHECKSUM]}
+
+
+def watch(workspace_dir, jobs=1, timeout=None, streaming=False, wait_builds=False, vendor=False):
+    """
+        Deploys changed services, then watches the source directory of every
+        service and deploys the services whose sources change until it is
+        interrupted. Workers, API clients and file manifests are kept between
+        deployments.
+
+        Parameters:
+            workspace_dir (string): workspace directory path
+            jobs (int): number of services deployed at the same time
+            timeout (float): deadline of each deployment round in seconds, None to wait forever
+            streaming (boolean): upload sources without temporary zip files
+            wait_builds (boolean): wait until every build has been succeeded or failed
+            vendor (boolean): include locally resolved Python or Node.js dependencies
+    """
+    services = get_services(workspace_dir)
+    watcher = create_watcher()
+    executor = ThreadPoolExecutor(max_workers=max(1, jobs))
+    try:
+        for service_key, service in services.items():
+            service_dir = os.path.join(workspace_dir, service[SOURCE_DIRECTORY])
+            watcher.add_service(ServiceTree(service_key, service_dir, JAVA_RUNTIME in service.get(ENVIRONMENT, '')))
+        print('Deploying changes...')
+        deploy_all(workspace_dir, jobs, timeout, streaming, wait_builds, vendor, None, executor)
+        while True:
+            print('Watching %d services for changes...' % len(services))
+            changed = set()
+            while len(changed) == 0:
+                changed = get_changed_services(workspace_dir, wait_for_changes(watcher))
+            print('Changes in %s.' % ', '.join(sorted(changed)))
+            deploy_all(workspace_dir, jobs, timeout, streaming, wait_builds, vendor, changed, executor)
+    except KeyboardInterrupt:
+        print('Stopped watching.')
+    except Exception:
+        print(traceback.format_exc())
+    finally:
+        watcher.close()
+        executor.shutdown(wait=False, cancel_futures=True)
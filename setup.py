@@ -24,6 +24,7 @@ setup(
     install_requires=[
         'svn',
         'google-cloud-storage',
+        'google-crc32c',
         'google-api-python-client',
         'google-auth-httplib2',
         'google-auth-oauthlib',
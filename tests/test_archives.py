@@ -0,0 +1,132 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from contextlib import redirect_stdout
+from zipfile import ZipFile
+
+from gostep.compression import set_compression_level, get_compression_level
+from gostep.consts import SERVICE_CONFIG_FILE, ARCHIVE_DATE_TIME, ARCHIVE_FILE_MODE, ARCHIVE_EXECUTABLE_MODE, \
+    DEPENDENCIES_DIR, DEPENDENCIES_PREFIX, DEPENDENCIES_KEY, EXCLUDED_FILES
+from gostep.file_manager import create_compressed_file, open_compressed_stream, get_archive_digest, \
+    get_service_digest
+
+FILES = {
+    'main.py': 'print("hello")\n' * 100,
+    'requirements.txt': 'flask\n',
+    'lib/util.py': 'def util():\n    pass\n',
+    'bin/run.sh': '#!/bin/sh\n'
+}
+FUNCTION_SPEC = {'name': 'projects/project/locations/us-central1/functions/service', 'runtime': 'python311',
+                 'sourceArchiveUrl': 'gs://bucket/service.zip'}
+
+
+class ArchiveTest(unittest.TestCase):
+    """
+        Builds source archives which only depend on the source files, and
+        their content digests.
+    """
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        self.level = get_compression_level()
+
+    def tearDown(self):
+        set_compression_level(self.level)
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def write_files(self, name, files):
+        files_dir = os.path.join(self.root_dir, name)
+        for relative_path, content in reversed(sorted(files.items())):
+            file_path = os.path.join(files_dir, relative_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'w') as file_object:
+                file_object.write(content)
+            os.chmod(file_path, 0o775 if relative_path.endswith('.sh') else 0o664)
+        return files_dir
+
+    def write_service(self, name, files=None, function_spec=None):
+        service_dir = self.write_files(name, files or FILES)
+        with open(os.path.join(service_dir, SERVICE_CONFIG_FILE), 'w') as function_spec_file:
+            json.dump(function_spec or FUNCTION_SPEC, function_spec_file)
+        return service_dir
+
+    def archive(self, service_dir, dependencies=None):
+        with redirect_stdout(io.StringIO()):
+            archive_file = create_compressed_file(os.path.basename(service_dir), service_dir, service_dir,
+                                                  self.root_dir, dependencies)
+        with open(archive_file, 'rb') as archive_file_object:
+            return archive_file_object.read()
+
+    def stream(self, service_dir):
+        with redirect_stdout(io.StringIO()):
+            stream = open_compressed_stream(service_dir, service_dir)
+            try:
+                return b''.join(iter(lambda: stream.read(65536), b''))
+            finally:
+                stream.close()
+
+    def test_same_sources_give_the_same_archive(self):
+        service_dir = self.write_service('service-a')
+        archive = self.archive(service_dir)
+        time.sleep(0.01)
+        copied_dir = self.write_service('service-b')
+        self.assertEqual(self.archive(copied_dir), archive)
+        self.assertEqual(self.stream(service_dir), self.stream(copied_dir))
+
+    def test_entries_are_sorted_and_normalized(self):
+        with ZipFile(io.BytesIO(self.archive(self.write_service('service')))) as compressed_file:
+            self.assertIsNone(compressed_file.testzip())
+            self.assertEqual(compressed_file.namelist(), sorted(FILES.keys()))
+            for entry in compressed_file.infolist():
+                self.assertEqual(entry.date_time, ARCHIVE_DATE_TIME)
+                self.assertEqual(entry.external_attr >> 16, ARCHIVE_EXECUTABLE_MODE
+                                 if entry.filename.endswith('.sh') else ARCHIVE_FILE_MODE)
+
+    def test_function_specification_is_left_out(self):
+        service_dir = self.write_service('service')
+        with ZipFile(io.BytesIO(self.archive(service_dir))) as compressed_file:
+            self.assertNotIn(SERVICE_CONFIG_FILE, compressed_file.namelist())
+        with ZipFile(io.BytesIO(self.stream(service_dir))) as compressed_file:
+            self.assertNotIn(SERVICE_CONFIG_FILE, compressed_file.namelist())
+        digest = get_archive_digest(service_dir, service_dir)
+        self.write_service('service', function_spec=dict(FUNCTION_SPEC, runtime='python312'))
+        self.assertEqual(get_archive_digest(service_dir, service_dir), digest)
+
+    def test_archive_digests_follow_sources_and_level(self):
+        service_dir = self.write_service('service-a')
+        digest = get_archive_digest(service_dir, service_dir)
+        self.assertEqual(get_archive_digest(self.write_service('service-b'), service_dir), digest)
+        self.assertEqual(get_archive_digest(service_dir, self.write_service('service-b')), digest)
+        set_compression_level(0)
+        self.assertNotEqual(get_archive_digest(service_dir, service_dir), digest)
+        set_compression_level(self.level)
+        changed_dir = self.write_service('service-c', dict(FILES, **{'main.py': 'print("changed")\n'}))
+        self.assertNotEqual(get_archive_digest(changed_dir, changed_dir), digest)
+
+    def test_service_digests_leave_out_deployment_fields(self):
+        service_dir = self.write_service('service')
+        digest = get_service_digest(service_dir)
+        self.write_service('service', function_spec=dict(FUNCTION_SPEC, name='other', sourceArchiveUrl='gs://x/y.zip'))
+        self.assertEqual(get_service_digest(service_dir), digest)
+        self.write_service('service', function_spec=dict(FUNCTION_SPEC, runtime='python312'))
+        self.assertNotEqual(get_service_digest(service_dir), digest)
+
+    def test_sources_take_precedence_over_dependencies(self):
+        service_dir = self.write_service('service')
+        dependencies_dir = self.write_files('dependencies', {'flask/__init__.py': 'flask\n', 'main.py': 'vendored\n'})
+        dependencies = {DEPENDENCIES_DIR: dependencies_dir, DEPENDENCIES_PREFIX: '', DEPENDENCIES_KEY: 'key',
+                        EXCLUDED_FILES: ['requirements.txt']}
+        with ZipFile(io.BytesIO(self.archive(service_dir, dependencies))) as compressed_file:
+            self.assertIn('flask/__init__.py', compressed_file.namelist())
+            self.assertNotIn('requirements.txt', compressed_file.namelist())
+            self.assertEqual(compressed_file.read('main.py').decode(), FILES['main.py'])
+        self.assertNotEqual(get_archive_digest(service_dir, service_dir, dependencies=dependencies),
+                            get_archive_digest(service_dir, service_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
+
+from gostep.compression import write_entries, compress_entry, write_compressed_entry, raw_entries_supported
+from gostep.file_manager import create_compressed_file, open_compressed_stream
+
+FILES = {
+    'main.py': b'print("hello")\n' * 4096,
+    'lib/data.json': b'{"key": "value"}\n' * 1024,
+    'image.png': os.urandom(70000),
+    'random.bin': os.urandom(200000),
+    'empty.txt': b''
+}
+
+
+class CompressionTest(unittest.TestCase):
+    """
+        Writes archives of files of several kinds and reads them back, with
+        already compressed entries and through ZipFile.open.
+    """
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        self.sources_dir = os.path.join(self.root_dir, 'sources')
+        for relative_path, content in FILES.items():
+            file_path = os.path.join(self.sources_dir, relative_path)
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, 'wb') as file_object:
+                file_object.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def write_archive(self, level=6):
+        archive = io.BytesIO()
+        with ZipFile(archive, 'w') as compressed_file:
+            stats = write_entries(compressed_file, [
+                (ZipInfo(relative_path, (1980, 1, 1, 0, 0, 0)), os.path.join(self.sources_dir, relative_path))
+                for relative_path in sorted(FILES.keys())], level)
+        archive.seek(0)
+        return ZipFile(archive), stats
+
+    def assert_round_trip(self, compressed_file):
+        self.assertIsNone(compressed_file.testzip())
+        self.assertEqual(sorted(compressed_file.namelist()), sorted(FILES.keys()))
+        for relative_path, content in FILES.items():
+            self.assertEqual(compressed_file.read(relative_path), content)
+
+    def test_compressed_entries_round_trip(self):
+        with ZipFile(io.BytesIO(), 'w') as compressed_file:
+            self.assertTrue(raw_entries_supported(compressed_file))
+        compressed_file, stats = self.write_archive()
+        self.assert_round_trip(compressed_file)
+        self.assertEqual(stats['files'], len(FILES))
+        self.assertEqual(stats['bytes_in'], sum(len(content) for content in FILES.values()))
+        self.assertEqual(compressed_file.getinfo('main.py').compress_type, ZIP_DEFLATED)
+        self.assertEqual(compressed_file.getinfo('image.png').compress_type, ZIP_STORED)
+        self.assertEqual(compressed_file.getinfo('random.bin').compress_type, ZIP_STORED)
+
+    def test_opened_entries_round_trip(self):
+        with mock.patch('gostep.compression.raw_entries_supported', return_value=False):
+            compressed_file, stats = self.write_archive()
+        self.assert_round_trip(compressed_file)
+        self.assertEqual(stats['files'], len(FILES))
+        self.assertEqual(compressed_file.getinfo('main.py').compress_type, ZIP_DEFLATED)
+        self.assertEqual(compressed_file.getinfo('image.png').compress_type, ZIP_STORED)
+
+    def test_level_zero_stores_every_file(self):
+        compressed_file, stats = self.write_archive(0)
+        self.assert_round_trip(compressed_file)
+        self.assertTrue(all(entry.compress_type == ZIP_STORED for entry in compressed_file.infolist()))
+        self.assertEqual(stats['bytes_in'], stats['bytes_out'])
+
+    def test_streamed_archives_round_trip(self):
+        for raw_entries in [True, False]:
+            with mock.patch('gostep.compression.raw_entries_supported', return_value=raw_entries), \
+                    redirect_stdout(io.StringIO()):
+                stream = open_compressed_stream(self.sources_dir, self.sources_dir)
+                try:
+                    archive = b''.join(iter(lambda: stream.read(65536), b''))
+                finally:
+                    stream.close()
+            self.assert_round_trip(ZipFile(io.BytesIO(archive)))
+
+    def test_archive_files_round_trip(self):
+        with redirect_stdout(io.StringIO()):
+            archive_file = create_compressed_file('service', self.sources_dir, self.sources_dir, self.root_dir)
+        with ZipFile(archive_file) as compressed_file:
+            self.assert_round_trip(compressed_file)
+
+    def test_files_changed_while_archived_are_rejected(self):
+        file_path = os.path.join(self.sources_dir, 'random.bin')
+        compressed = compress_entry(file_path, 6)
+        self.assertIsNone(compressed['buffer'])
+        with open(file_path, 'ab') as file_object:
+            file_object.write(b'more')
+        with ZipFile(io.BytesIO(), 'w') as compressed_file:
+            with self.assertRaises(RuntimeError):
+                write_compressed_entry(compressed_file, ZipInfo('random.bin'), compressed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+from deploy_benchmark import create_workspace, write_credentials, PROJECT_ID
+from fake_gcp import FakeGcp
+
+DEPLOY_SCRIPT = '''
+import sys
+from gostep.aggregator import deploy
+for location in sys.argv[2:]:
+    if not deploy('service-0000', location, sys.argv[1], wait=True):
+        sys.exit(1)
+'''
+DEPLOY_ALL_SCRIPT = '''
+import sys
+from gostep.aggregator import deploy_all
+deploy_all(sys.argv[1], git=True)
+'''
+
+
+class DeployTest(unittest.TestCase):
+    """
+        Deploys a workspace against the fake of the Google cloud APIs used by
+        the benchmarks, in a fresh process per run.
+    """
+
+    def setUp(self):
+        self.fake = FakeGcp(0.0, 0.0, 0.1)
+        self.fake.start()
+        self.root_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        self.workspace_dir = os.path.join(self.root_dir, 'workspace')
+        self.home_dir = os.path.join(self.root_dir, 'home')
+        os.makedirs(self.workspace_dir)
+        os.makedirs(self.home_dir)
+        create_workspace(self.workspace_dir, 1, 2, 1024)
+        write_credentials(os.path.join(self.workspace_dir, 'credentials.json'), self.fake.base_url)
+
+    def tearDown(self):
+        self.fake.stop()
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def run_script(self, script, *args, returncode=0):
+        env = dict(
+            os.environ,
+            HOME=self.home_dir,
+            PYTHONPATH=REPO_DIR,
+            GOOGLE_APPLICATION_CREDENTIALS=os.path.join(self.workspace_dir, 'credentials.json'),
+            GOOGLE_CLOUD_PROJECT=PROJECT_ID,
+            GOSTEP_API_ROOT_URL=self.fake.base_url,
+            STORAGE_EMULATOR_HOST=self.fake.base_url,
+            PATH=os.pathsep.join([os.path.join(self.root_dir, 'bin'), os.environ.get('PATH', '')])
+        )
+        process = subprocess.run([sys.executable, '-c', script, self.workspace_dir] + list(args),
+                                 env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        self.assertEqual(process.returncode, returncode, process.stdout)
+        return process.stdout
+
+    def deploy(self, *locations, returncode=0):
+        return self.run_script(DEPLOY_SCRIPT, *locations, returncode=returncode)
+
+    def write_command(self, name, script):
+        command_file = os.path.join(self.root_dir, 'bin', name)
+        os.makedirs(os.path.dirname(command_file), exist_ok=True)
+        with open(command_file, 'w') as command_file_object:
+            command_file_object.write(script)
+        os.chmod(command_file, 0o755)
+
+    def commit(self):
+        for args in [['init', '-q'], ['add', '-A'], ['commit', '-q', '--allow-empty', '-m', 'deploy']]:
+            subprocess.run(['git', '-c', 'user.name=gostep', '-c', 'user.email=gostep@example.com'] + args,
+                           cwd=self.workspace_dir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, check=True)
+
+    def test_unchanged_sources_are_uploaded_once(self):
+        self.deploy('us-central1')
+        self.deploy('us-central1', 'europe-west1')
+        stats = self.fake.get_stats()
+        self.assertEqual(stats['requests'].get('storage.objects.insert'), 1)
+        self.assertEqual(stats['requests'].get('functions.create'), 2)
+        self.assertEqual(stats['requests'].get('functions.patch'), 1)
+
+    @unittest.skipIf(shutil.which('git') is None, 'git is not installed')
+    def test_committed_deployments_are_not_redeployed(self):
+        self.commit()
+        self.run_script(DEPLOY_ALL_SCRIPT)
+        self.commit()
+        output = self.run_script(DEPLOY_ALL_SCRIPT)
+        stats = self.fake.get_stats()
+        self.assertEqual(stats['requests'].get('functions.create'), 1, output)
+        self.assertIsNone(stats['requests'].get('functions.patch'), output)
+        self.assertIn('All up to date.', output)
+
+
+    def test_failed_java_build_is_reported(self):
+        self.write_command('mvn', '#!/bin/sh\necho build failure\nexit 1\n')
+        function_spec_file = os.path.join(self.workspace_dir, 'src', 'service-0000', 'function.json')
+        with open(function_spec_file) as function_spec_file_object:
+            function_spec = json.load(function_spec_file_object)
+        function_spec['runtime'] = 'java11'
+        with open(function_spec_file, 'w') as function_spec_file_object:
+            json.dump(function_spec, function_spec_file_object)
+        output = self.deploy('us-central1', returncode=1)
+        self.assertIn('Build has been failed for service-0000.', output)
+        self.assertNotIn('Traceback', output)
+        self.assertIsNone(self.fake.get_stats()['requests'].get('functions.create'))
+
+
+if __name__ == '__main__':
+    unittest.main()
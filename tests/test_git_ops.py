@@ -0,0 +1,96 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from gostep.consts import SOURCE_DIRECTORY, GIT_COMMIT, STATE_GITIGNORE_FILE
+from gostep.git_ops import get_git_changes, ServicePrefixes
+from gostep.state import locked_state, get_state_dir
+
+
+def run_git(repo_dir, *args):
+    return subprocess.run(['git', '-c', 'user.name=gostep', '-c', 'user.email=gostep@example.com'] + list(args),
+                          cwd=repo_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout.decode()
+
+
+@unittest.skipIf(shutil.which('git') is None, 'git is not installed')
+class GitChangesTest(unittest.TestCase):
+    """
+        Maps files changed in a git repository to the services containing them.
+    """
+
+    def setUp(self):
+        self.repo_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        self.workspace_dir = os.path.join(self.repo_dir, 'workspace')
+        for service_key in ['service-a', 'service-b', 'service-ab']:
+            self.write_file(os.path.join('src', service_key, 'main.py'), service_key)
+        run_git(self.repo_dir, 'init', '-q')
+        self.commit()
+        self.head = run_git(self.repo_dir, 'rev-parse', 'HEAD').strip()
+        self.services = {service_key: {SOURCE_DIRECTORY: 'src/' + service_key, GIT_COMMIT: self.head}
+                         for service_key in ['service-a', 'service-b', 'service-ab']}
+
+    def tearDown(self):
+        shutil.rmtree(self.repo_dir, ignore_errors=True)
+
+    def write_file(self, relative_path, content):
+        file_path = os.path.join(self.workspace_dir, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as file_object:
+            file_object.write(content)
+
+    def commit(self):
+        run_git(self.repo_dir, 'add', '-A')
+        run_git(self.repo_dir, 'commit', '-q', '-m', 'change')
+
+    def test_nothing_changed_at_the_recorded_commit(self):
+        changes = get_git_changes(self.workspace_dir, self.services)
+        self.assertEqual(changes[GIT_COMMIT], self.head)
+        self.assertEqual(changes['unchanged'], {'service-a', 'service-b', 'service-ab'})
+        self.assertEqual(changes['changed'] | changes['unknown'], set())
+
+    def test_committed_files_change_only_their_service(self):
+        self.write_file('src/service-a/main.py', 'changed')
+        self.commit()
+        changes = get_git_changes(self.workspace_dir, self.services)
+        self.assertEqual(changes['changed'], {'service-a'})
+        self.assertEqual(changes['unchanged'], {'service-b', 'service-ab'})
+
+    def test_modified_and_untracked_files_are_hashed(self):
+        self.write_file('src/service-b/main.py', 'modified')
+        self.write_file('src/service-ab/new.py', 'untracked')
+        changes = get_git_changes(self.workspace_dir, self.services)
+        self.assertEqual(changes['unknown'], {'service-b', 'service-ab'})
+        self.assertEqual(changes['dirty'], {'service-b', 'service-ab'})
+        self.assertEqual(changes['unchanged'], {'service-a'})
+
+    def test_services_without_a_known_commit_are_hashed(self):
+        self.services['service-a'][GIT_COMMIT] = ''
+        self.services['service-b'][GIT_COMMIT] = '0' * 40
+        changes = get_git_changes(self.workspace_dir, self.services)
+        self.assertEqual(changes['unknown'], {'service-a', 'service-b'})
+        self.assertEqual(changes['unchanged'], {'service-ab'})
+
+    def test_state_files_are_kept_out_of_the_tree(self):
+        with locked_state(self.workspace_dir):
+            pass
+        self.assertTrue(os.path.exists(os.path.join(get_state_dir(self.workspace_dir), STATE_GITIGNORE_FILE)))
+        status = run_git(self.repo_dir, 'status', '--porcelain', '--untracked-files=all')
+        self.assertNotIn('state.lock', status)
+
+    def test_workspace_outside_git_has_no_changes(self):
+        outside_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        try:
+            self.assertIsNone(get_git_changes(outside_dir, {}))
+        finally:
+            shutil.rmtree(outside_dir, ignore_errors=True)
+
+    def test_prefixes_match_whole_directories(self):
+        prefixes = ServicePrefixes('workspace/', self.services)
+        self.assertEqual(prefixes.get_services(['workspace/src/service-ab/main.py']), {'service-ab'})
+        self.assertEqual(prefixes.get_services(['workspace/src/service-abc/main.py', 'README.md']), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from gostep.consts import MTIME_GRANULARITY
+from gostep.hashing import get_tree_digest, get_file_digest, list_files
+from gostep.ignore import IgnoreMatcher
+
+FILES = {
+    'main.py': 'print("hello")\n',
+    'lib/util.py': 'def util():\n    pass\n',
+    'lib/data/values.json': '{"key": "value"}\n',
+    'build/output.bin': 'output\n'
+}
+
+
+class TreeDigestTest(unittest.TestCase):
+    """
+        Hashes directory trees, reusing the digests of a previous scan for
+        files which have not been changed since.
+    """
+
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        self.source_dir = os.path.join(self.root_dir, 'source')
+        self.manifest_file = os.path.join(self.root_dir, 'manifests', 'source.json')
+        for relative_path, content in FILES.items():
+            self.write_file(relative_path, content)
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def write_file(self, relative_path, content, mtime_ns=None):
+        file_path = os.path.join(self.source_dir, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'w') as file_object:
+            file_object.write(content)
+        mtime_ns = time.time_ns() - MTIME_GRANULARITY * 10 if mtime_ns is None else mtime_ns
+        os.utime(file_path, ns=(mtime_ns, mtime_ns))
+        return file_path
+
+    def digest(self, matcher=None):
+        with mock.patch('gostep.hashing.get_file_digest', side_effect=get_file_digest) as file_digest:
+            digest = get_tree_digest(self.source_dir, self.manifest_file, matcher)
+        return digest, sorted(os.path.relpath(call.args[0], self.source_dir).replace(os.sep, '/')
+                              for call in file_digest.call_args_list)
+
+    def test_unchanged_trees_have_the_same_digest(self):
+        digest, read_files = self.digest()
+        self.assertEqual(read_files, sorted(FILES.keys()))
+        self.assertEqual(get_tree_digest(self.source_dir), digest)
+        moved_dir = os.path.join(self.root_dir, 'moved')
+        shutil.copytree(self.source_dir, moved_dir)
+        self.assertEqual(get_tree_digest(moved_dir), digest)
+
+    def test_contents_names_and_modes_change_the_digest(self):
+        digest = get_tree_digest(self.source_dir)
+        self.write_file('main.py', 'print("changed")\n')
+        changed_digest = get_tree_digest(self.source_dir)
+        self.assertNotEqual(changed_digest, digest)
+        os.rename(os.path.join(self.source_dir, 'main.py'), os.path.join(self.source_dir, 'app.py'))
+        renamed_digest = get_tree_digest(self.source_dir)
+        self.assertNotEqual(renamed_digest, changed_digest)
+        os.chmod(os.path.join(self.source_dir, 'app.py'), 0o755)
+        self.assertNotEqual(get_tree_digest(self.source_dir), renamed_digest)
+
+    def test_unchanged_files_are_not_read_again(self):
+        digest, read_files = self.digest()
+        self.assertTrue(os.path.exists(self.manifest_file))
+        self.assertEqual(self.digest(), (digest, []))
+        self.write_file('lib/util.py', 'def util():\n    return 1\n')
+        changed_digest, read_files = self.digest()
+        self.assertNotEqual(changed_digest, digest)
+        self.assertEqual(read_files, ['lib/util.py'])
+
+    def test_files_changed_within_the_mtime_granularity_are_read_again(self):
+        mtime_ns = time.time_ns()
+        file_path = self.write_file('main.py', 'print("first")\n', mtime_ns)
+        inode = os.stat(file_path).st_ino
+        digest, read_files = self.digest()
+        self.assertIn('main.py', read_files)
+        self.write_file('main.py', 'print("other")\n', mtime_ns)
+        self.assertEqual(os.stat(file_path).st_ino, inode)
+        changed_digest, read_files = self.digest()
+        self.assertEqual(read_files, ['main.py'])
+        self.assertNotEqual(changed_digest, digest)
+        self.assertEqual(changed_digest, get_tree_digest(self.source_dir))
+
+    def test_unreadable_manifests_are_ignored(self):
+        digest, read_files = self.digest()
+        with open(self.manifest_file, 'w') as manifest_file_object:
+            manifest_file_object.write('{')
+        self.assertEqual(self.digest(), (digest, sorted(FILES.keys())))
+        with open(self.manifest_file) as manifest_file_object:
+            self.assertEqual(sorted(json.load(manifest_file_object)['files'].keys()), sorted(FILES.keys()))
+
+    def test_large_files_hash_the_same(self):
+        digest = get_tree_digest(self.source_dir)
+        with mock.patch('gostep.hashing.LARGE_FILE_SIZE', 1):
+            self.assertEqual(get_tree_digest(self.source_dir), digest)
+
+    def test_ignored_files_are_not_hashed(self):
+        matcher = IgnoreMatcher(['/build/', '*.json'])
+        self.assertEqual([relative_path for relative_path, file_path in list_files(self.source_dir, matcher)],
+                         ['main.py', 'lib/util.py'])
+        digest, read_files = self.digest(matcher)
+        self.assertEqual(read_files, ['lib/util.py', 'main.py'])
+        self.write_file('build/output.bin', 'changed\n')
+        self.assertEqual(self.digest(matcher), (digest, []))
+
+    def test_files_are_listed_directory_by_directory(self):
+        self.assertEqual([relative_path for relative_path, file_path in list_files(self.source_dir)],
+                         ['main.py', 'build/output.bin', 'lib/util.py', 'lib/data/values.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from gostep.consts import GOSTEP_IGNORE_FILE, SERVICE_CONFIG_FILE
+from gostep.ignore import IgnoreMatcher, get_ignore_matcher, get_archive_matcher
+
+
+class IgnoreMatcherTest(unittest.TestCase):
+    """
+        Matches relative paths against gitignore style patterns.
+    """
+
+    def test_unanchored_patterns_match_at_any_depth(self):
+        matcher = IgnoreMatcher(['*.pyc', '__pycache__/'])
+        self.assertTrue(matcher.ignored('main.pyc'))
+        self.assertTrue(matcher.ignored('lib/deep/main.pyc'))
+        self.assertTrue(matcher.ignored('lib/__pycache__', True))
+        self.assertFalse(matcher.ignored('lib/__pycache__'))
+        self.assertFalse(matcher.ignored('main.py'))
+
+    def test_anchored_patterns_match_from_the_root(self):
+        matcher = IgnoreMatcher(['/build', 'docs/*.md'])
+        self.assertTrue(matcher.ignored('build', True))
+        self.assertFalse(matcher.ignored('lib/build', True))
+        self.assertTrue(matcher.ignored('docs/index.md'))
+        self.assertFalse(matcher.ignored('docs/api/index.md'))
+        self.assertFalse(matcher.ignored('lib/docs/index.md'))
+
+    def test_double_asterisks_cross_directories(self):
+        matcher = IgnoreMatcher(['**/logs', 'cache/**', 'a/**/b'])
+        self.assertTrue(matcher.ignored('logs', True))
+        self.assertTrue(matcher.ignored('x/y/logs'))
+        self.assertTrue(matcher.ignored('cache/x/y.txt'))
+        self.assertFalse(matcher.ignored('cache'))
+        self.assertTrue(matcher.ignored('a/b'))
+        self.assertTrue(matcher.ignored('a/x/y/b'))
+
+    def test_wildcards_do_not_cross_directories(self):
+        matcher = IgnoreMatcher(['src/*.js', 'file?.txt', 'data[0-9].csv', 'keep[!a].txt'])
+        self.assertTrue(matcher.ignored('src/app.js'))
+        self.assertFalse(matcher.ignored('src/lib/app.js'))
+        self.assertTrue(matcher.ignored('file1.txt'))
+        self.assertFalse(matcher.ignored('file/.txt'))
+        self.assertTrue(matcher.ignored('data7.csv'))
+        self.assertFalse(matcher.ignored('datax.csv'))
+        self.assertTrue(matcher.ignored('keepb.txt'))
+        self.assertFalse(matcher.ignored('keepa.txt'))
+
+    def test_last_matching_pattern_wins(self):
+        matcher = IgnoreMatcher(['*.log', '!important.log', 'debug/important.log'])
+        self.assertTrue(matcher.ignored('error.log'))
+        self.assertFalse(matcher.ignored('important.log'))
+        self.assertTrue(matcher.ignored('debug/important.log'))
+
+    def test_escaped_characters_are_literal(self):
+        matcher = IgnoreMatcher(['\\#notes', '\\!bang', 'a\\*b', 'x.y'])
+        self.assertTrue(matcher.ignored('#notes'))
+        self.assertTrue(matcher.ignored('!bang'))
+        self.assertTrue(matcher.ignored('a*b'))
+        self.assertFalse(matcher.ignored('acb'))
+        self.assertFalse(matcher.ignored('xzy'))
+
+    def test_no_patterns_ignore_nothing(self):
+        matcher = IgnoreMatcher([])
+        self.assertFalse(matcher.ignored('main.py'))
+        self.assertFalse(matcher.ignored('lib', True))
+
+
+class IgnoreFileTest(unittest.TestCase):
+    """
+        Reads and caches the ignore matchers of a service.
+    """
+
+    def setUp(self):
+        self.config_dir = tempfile.mkdtemp(prefix='gostep-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.config_dir, ignore_errors=True)
+
+    def write_ignore_file(self, content):
+        ignore_file = os.path.join(self.config_dir, GOSTEP_IGNORE_FILE)
+        with open(ignore_file, 'w') as ignore_file_object:
+            ignore_file_object.write(content)
+        file_stat = os.stat(ignore_file)
+        os.utime(ignore_file, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1000000000))
+
+    def test_services_without_an_ignore_file(self):
+        self.assertIsNone(get_ignore_matcher(self.config_dir))
+        matcher = get_archive_matcher(self.config_dir)
+        self.assertTrue(matcher.ignored(SERVICE_CONFIG_FILE))
+        self.assertFalse(matcher.ignored('src/' + SERVICE_CONFIG_FILE))
+
+    def test_patterns_are_split_and_comments_skipped(self):
+        self.write_ignore_file('# *.py\n*.pyc  *.log\n  # tests/\nnode_modules/\n')
+        matcher = get_ignore_matcher(self.config_dir)
+        self.assertEqual(matcher.patterns, ['*.pyc', '*.log', 'node_modules/'])
+        self.assertFalse(matcher.ignored('main.py'))
+        self.assertTrue(matcher.ignored('node_modules', True))
+        self.assertTrue(get_archive_matcher(self.config_dir).ignored('debug.log'))
+        self.assertTrue(get_archive_matcher(self.config_dir).ignored(SERVICE_CONFIG_FILE))
+
+    def test_matchers_are_cached_until_the_file_changes(self):
+        self.write_ignore_file('*.pyc\n')
+        matcher = get_ignore_matcher(self.config_dir)
+        self.assertIs(get_ignore_matcher(self.config_dir), matcher)
+        self.write_ignore_file('*.log\n')
+        self.assertIsNot(get_ignore_matcher(self.config_dir), matcher)
+        self.assertTrue(get_ignore_matcher(self.config_dir).ignored('debug.log'))
+        self.assertFalse(get_ignore_matcher(self.config_dir).ignored('main.pyc'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import time
+import unittest
+from unittest import mock
+
+from gostep.consts import DONE, ERROR, RESPONSE, OPERATION_POLL_MAX_DELAY, OPERATION_MAX_LOOKUP_FAILURES
+from gostep.operations import wait_for_operations, get_poll_delay, operation_succeeded, describe_operation
+
+
+class OperationsTest(unittest.TestCase):
+    """
+        Polls long running operations through a fake operation lookup.
+    """
+
+    def wait(self, lookups, timeout=None):
+        calls = []
+
+        def get_operation(name):
+            calls.append(name)
+            return lookups[name].pop(0) if len(lookups[name]) > 1 else lookups[name][0]
+
+        with mock.patch('gostep.operations.get_operation', side_effect=get_operation), \
+                mock.patch('gostep.operations.get_poll_delay', return_value=0.0):
+            results = wait_for_operations({name: time.time() for name in lookups.keys()}, timeout)
+        return results, calls
+
+    def test_operations_are_polled_until_done(self):
+        results, calls = self.wait({
+            'operations/a': [{}, {}, {DONE: True, RESPONSE: {'name': 'a'}}],
+            'operations/b': [{DONE: True, ERROR: {'message': 'build failed'}}]
+        })
+        self.assertTrue(operation_succeeded(results['operations/a']))
+        self.assertFalse(operation_succeeded(results['operations/b']))
+        self.assertIn('build failed', describe_operation(results['operations/b']))
+        self.assertEqual(calls.count('operations/a'), 3)
+        self.assertEqual(calls.count('operations/b'), 1)
+
+    def test_operations_which_can_not_be_looked_up_fail(self):
+        results, calls = self.wait({'operations/a': [None]})
+        self.assertFalse(operation_succeeded(results['operations/a']))
+        self.assertIn('could not be looked up', describe_operation(results['operations/a']))
+        self.assertEqual(len(calls), OPERATION_MAX_LOOKUP_FAILURES)
+
+    def test_lookup_failures_must_be_consecutive(self):
+        lookups = [None] * (OPERATION_MAX_LOOKUP_FAILURES - 1) + [{}] + \
+            [None] * (OPERATION_MAX_LOOKUP_FAILURES - 1) + [{DONE: True, RESPONSE: {}}]
+        results, calls = self.wait({'operations/a': lookups})
+        self.assertTrue(operation_succeeded(results['operations/a']))
+        self.assertEqual(len(calls), OPERATION_MAX_LOOKUP_FAILURES * 2)
+
+    def test_pending_operations_fail_at_the_deadline(self):
+        with mock.patch('gostep.operations.get_operation', return_value={}):
+            results = wait_for_operations({'operations/a': time.time()}, 0.05)
+        self.assertFalse(results['operations/a'][DONE])
+        self.assertIn('Deadline', describe_operation(results['operations/a']))
+
+    def test_poll_delays_are_bounded(self):
+        for attempt in range(20):
+            self.assertLessEqual(get_poll_delay(attempt), OPERATION_POLL_MAX_DELAY)
+            self.assertGreater(get_poll_delay(attempt), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
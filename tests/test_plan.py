@@ -0,0 +1,66 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+from deploy_benchmark import create_workspace, PROJECT_ID
+from gostep.aggregator import get_deployment_plan, print_deployment_plan
+from gostep.consts import ACTION, CREATE_ACTION, PATCH_ACTION, IAM_BINDING, LOCATION_ID, LOCATION_IDS, SERVICE, \
+    SOURCE_SIZE
+from gostep.state import update_services
+
+
+def get_inventory(location_name):
+    if location_name.endswith('/europe-west1'):
+        raise RuntimeError(''.join(['Unable to list cloud functions in ', location_name, '.']))
+    return {''.join([location_name, '/functions/service-0000']): None}
+
+
+class PlanTest(unittest.TestCase):
+    """
+        Works out deployment plans with a fake function inventory.
+    """
+
+    def setUp(self):
+        self.workspace_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        create_workspace(self.workspace_dir, 2, 2, 1024)
+        with redirect_stdout(io.StringIO()):
+            update_services(self.workspace_dir, {'service-0001': {LOCATION_IDS: ['us-central1', 'europe-west1']}})
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace_dir, ignore_errors=True)
+
+    def plan(self):
+        output = io.StringIO()
+        with mock.patch('gostep.aggregator.get_inventory', side_effect=get_inventory), \
+                mock.patch('gostep.aggregator.get_iam_policies', return_value={}), redirect_stdout(output):
+            plan = get_deployment_plan(self.workspace_dir)
+            print_deployment_plan(plan)
+        return {(service_plan[SERVICE], service_plan[LOCATION_ID]): service_plan for service_plan in plan}, \
+            output.getvalue()
+
+    def test_actions_follow_the_inventory(self):
+        plan, output = self.plan()
+        self.assertEqual(sorted(plan.keys()), [('service-0000', 'us-central1'), ('service-0001', 'europe-west1'),
+                                               ('service-0001', 'us-central1')])
+        self.assertEqual(plan[('service-0000', 'us-central1')][ACTION], PATCH_ACTION)
+        self.assertEqual(plan[('service-0001', 'us-central1')][ACTION], CREATE_ACTION)
+        self.assertGreater(plan[('service-0000', 'us-central1')][SOURCE_SIZE], 0)
+
+    def test_failed_listing_is_shown_as_unknown(self):
+        plan, output = self.plan()
+        self.assertIsNone(plan[('service-0001', 'europe-west1')][ACTION])
+        self.assertIsNone(plan[('service-0001', 'europe-west1')][IAM_BINDING])
+        self.assertIn('Unable to list cloud functions in projects/%s/locations/europe-west1.' % PROJECT_ID, output)
+        self.assertIn('1 unknown', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+
+from gostep.consts import BASE_CONFIG_FILE, SERVICES, CHECKSUM, LOCATION_IDS, NAME
+from gostep.state import get_service, get_service_keys, get_services, put_service, update_services, \
+    load_project_spec, get_service_file, valid_service_key
+from gostep.file_manager import write_file_atomically
+
+
+class StateTest(unittest.TestCase):
+    """
+        Moves services out of config.json and reads and writes their state files.
+    """
+
+    def setUp(self):
+        self.workspace_dir = tempfile.mkdtemp(prefix='gostep-test-')
+        self.write_config({
+            'service-a': {NAME: 'service-a', CHECKSUM: 'a1'},
+            'service-b': {NAME: 'service-b', CHECKSUM: 'b1'}
+        })
+
+    def tearDown(self):
+        shutil.rmtree(self.workspace_dir, ignore_errors=True)
+
+    def write_config(self, services):
+        with open(os.path.join(self.workspace_dir, BASE_CONFIG_FILE), 'w') as config_file:
+            json.dump({NAME: 'project', SERVICES: services}, config_file)
+
+    def read_config(self):
+        with open(os.path.join(self.workspace_dir, BASE_CONFIG_FILE)) as config_file:
+            return json.load(config_file)
+
+    def migrate(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            service_keys = get_service_keys(self.workspace_dir)
+        return service_keys, output.getvalue()
+
+    def test_services_are_moved_out_of_config(self):
+        service_keys, output = self.migrate()
+        self.assertEqual(service_keys, ['service-a', 'service-b'])
+        self.assertIn('2 services have been moved', output)
+        self.assertEqual(self.read_config()[SERVICES], {})
+        self.assertTrue(os.path.exists(get_service_file(self.workspace_dir, 'service-a')))
+        self.assertEqual(load_project_spec(self.workspace_dir)[SERVICES]['service-b'][CHECKSUM], 'b1')
+
+    def test_config_edits_are_merged_into_stored_services(self):
+        self.migrate()
+        self.write_config({'service-a': {NAME: 'service-a', LOCATION_IDS: ['us-central1', 'europe-west1']}})
+        service_keys, output = self.migrate()
+        self.assertEqual(service_keys, ['service-a', 'service-b'])
+        self.assertIn('location_ids of service-a', output)
+        self.assertEqual(get_service(self.workspace_dir, 'service-a')[LOCATION_IDS], ['us-central1', 'europe-west1'])
+        self.assertEqual(self.read_config()[SERVICES], {})
+
+    def test_restored_config_does_not_reset_checksums(self):
+        self.migrate()
+        update_services(self.workspace_dir, {'service-a': {CHECKSUM: 'a2'}})
+        self.write_config({'service-a': {NAME: 'service-a', CHECKSUM: 'a1'}})
+        service_keys, output = self.migrate()
+        self.assertEqual(get_service(self.workspace_dir, 'service-a')[CHECKSUM], 'a2')
+        self.assertEqual(output, '')
+
+    def test_new_services_are_added_to_the_index(self):
+        self.migrate()
+        put_service(self.workspace_dir, 'service-c', {NAME: 'service-c', CHECKSUM: ''})
+        self.assertEqual(get_service_keys(self.workspace_dir), ['service-a', 'service-b', 'service-c'])
+        self.assertEqual(sorted(get_services(self.workspace_dir, ['service-c', 'missing']).keys()), ['service-c'])
+
+    def test_concurrent_updates_are_kept(self):
+        self.migrate()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda index: update_services(self.workspace_dir, {
+                'service-a': {'field-%d' % index: index}, 'service-b': {'field-%d' % index: index}}), range(32)))
+        for service in get_services(self.workspace_dir).values():
+            self.assertEqual(sorted(key for key in service.keys() if key.startswith('field-')),
+                             sorted('field-%d' % index for index in range(32)))
+
+    def test_files_are_replaced_without_leftovers(self):
+        state_file = os.path.join(self.workspace_dir, 'nested', 'state.json')
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda index: write_file_atomically(state_file, json.dumps({'index': index})), range(32)))
+        with open(state_file) as state_file_object:
+            self.assertIn(json.load(state_file_object)['index'], range(32))
+        self.assertEqual(os.listdir(os.path.dirname(state_file)), ['state.json'])
+
+    def test_service_names_must_be_file_names(self):
+        self.assertTrue(valid_service_key('service-a.v2'))
+        self.assertFalse(valid_service_key('../service'))
+        self.assertIsNone(get_service(self.workspace_dir, '../service'))
+
+
+if __name__ == '__main__':
+    unittest.main()